@@ -2,13 +2,26 @@ import dash
 from dash import html, dcc
 import dash_bootstrap_components as dbc
 
+from utils.jobs import background_callback_manager
+
 app = dash.Dash(__name__, 
                 use_pages=True, 
                 external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME],
                 assets_folder='assets',
-                suppress_callback_exceptions=True)
+                suppress_callback_exceptions=True,
+                compress=False,
+                background_callback_manager=background_callback_manager)
 server = app.server
 
+from utils.encoding import init_compression
+from utils.singleflight import register_stats_route
+from utils.datastore import init_datastore
+from utils.api import init_api
+init_compression(server)
+register_stats_route(server)
+init_datastore(server)
+init_api(server)
+
 from assets.nav import sidebar
 
 app.layout = dbc.Container([
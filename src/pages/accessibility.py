@@ -1,13 +1,22 @@
-from dash import Dash, html, dcc, Input, Output, ctx, callback
+from dash import Dash, html, dcc, Input, Output, State, ctx, callback
 import dash
+from dash.exceptions import PreventUpdate
 import pandas as pd
 import geopandas as gpd
 import plotly.express as px
 import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
 import json
-from access import Access
 import os
+from utils.encoding import encode_figure, compact_geojson
+from utils.singleflight import singleflight, shared_store
+from utils import raam
+from utils import scenario
+from utils import siting
+from utils import ensemble
+from utils import hourly
+from utils import datastore
+from utils.exposure import PROJECTED_CRS
 
 #Register dash page
 dash.register_page(__name__,
@@ -22,11 +31,41 @@ desc_2 = "Using RAAM (lower score is better), we can see that on the onset (i.e.
 desc_3 = "Through a comparison of accessibility scores considering liquefaction risk, we identified the top 20 barangays most significantly affected in terms of healthcare access. These particular barangays are likely to face heightened challenges in accessing the healthcare system if the liquefaction potential becomes a reality."
 desc_4 = "In essence, the accessibility scores for each barangay condense three variables (population count, hospital bed capacity, and travel time) into a singular value. This value serves as a tool to pinpoint which barangays would experience the lowest healthcare accessibility in the event of \"The Big One.\""
 
-ncr_hosp = gpd.read_file("../data/analytics/ncr_hosp.geojson", driver="GeoJSON")
-liquefaction_map = gpd.read_file("../data/analytics/liquefaction_map.geojson",
-                                 driver="GeoJSON")
-travel_matrix = pd.read_csv("../data/analytics/travel_matrix.csv")
-ncr_boundary_pop = gpd.read_file("../data/analytics/ncr_boundary_pop.geojson", driver="GeoJSON")
+#supply columns solved together in one RAAM run
+supply_levels = {'All Hospitals': 'bed_capacity',
+                 'Level 2 and 3': 'beds_level_2_up',
+                 'Level 3': 'beds_level_3'}
+
+#map layers: RAAM score, or a summary of the travel-time ensemble (column, colorbar title, hover label)
+map_layers = {'Score': None,
+              'Uncertainty': ('score_spread', 'p95 - p5', 'Score Range (p5-p95)'),
+              'Worst-served Frequency': ('worst_frequency', 'Share', 'Share of Runs in Worst 10%')}
+
+
+def load(read):
+    ncr_hosp = read.geojson('ncr_hosp.geojson')
+    liquefaction_map = read.geojson('liquefaction_map.geojson')
+    travel_matrix = read.csv('travel_matrix.csv')
+    ncr_boundary_pop = read.geojson('ncr_boundary_pop.geojson')
+
+    #beds by the service level they can serve: Level 3 hospitals also provide Level 2 services
+    ncr_hosp['beds_level_2_up'] = ncr_hosp['bed_capacity'].where(ncr_hosp['service_capability'].isin(['Level 2', 'Level 3']), 0)
+    ncr_hosp['beds_level_3'] = ncr_hosp['bed_capacity'].where(ncr_hosp['service_capability'] == 'Level 3', 0)
+
+    return {'ncr_hosp': ncr_hosp,
+            'liquefaction_map': liquefaction_map,
+            'travel_matrix': travel_matrix,
+            'ncr_boundary_pop': ncr_boundary_pop,
+            #barangay centroids, where new hospitals are tried by the siting optimizer
+            'brgy_centroids': ncr_boundary_pop.to_crs(PROJECTED_CRS).centroid.to_crs('EPSG:4326'),
+            #boundaries sent to the browser only need the id used by featureidkey
+            'ncr_boundary_geojson': compact_geojson(ncr_boundary_pop, properties=["brgy_index"]),
+            #RAAM problems (demand, supply, cost matrix) per scenario, built once per worker
+            'raam_problems': {}}
+
+
+#data of the current generation of the analytics artifacts
+dataset = datastore.register(__name__, load)
 
 #Set api token using environment variables
 mapbox_token = os.environ.get('MAPBOX_TOKEN')
@@ -38,147 +77,197 @@ token = mapbox_token
 # token = open("assets/.mapbox_token").read()
 
 
-layout = dbc.Container([
-    dbc.Row([
-        dbc.Col([
-            html.Div([
-                html.Span('Accessibility',
-                          style={
-                              "font-size":"3rem",
-                              "font-family":"Cardo ,serif",
-                              "font-weight":"400",
-                              "line-height":"1.04",
-                              "margin-bottom":"10px",
-                          }),
-                html.P([html.Br(), desc, html.Br(), html.Br(), desc_2, html.Br(), html.Br(), desc_3, html.Br(), html.Br(), desc_4],
-                        style={
-                            "font-size":"1rem",
-                            "font-family":"Josefin Sans,,sans-serif",
-                            "font-weight":"400",
-                            "line-height":"1.46429em",
-                            "text-align":"justify"
-                        })
-            ], style={"margin-top":"15px"})
-        ], width=3),
-        dbc.Col([
-            dbc.Row([
-                dbc.Checklist([
-                    {"label": "High Potential", "value": "High Potential"},
-                    {"label": "Moderate Potential", "value": "Moderate Potential"},
-                    {"label": "Low Potential", "value": "Low Potential"},],
-                    value =['High Potential'],
-                    id='risk_type_dropdown',
-                    switch=True,
-                    inline=True,
-                    input_checked_style={
-                        "backgroundColor": "#1d1a1a",
-                        "borderColor": "#1d1a1a",
-                        "box-shadow": "0 0 1px #1d1a1a"},
-                    className='mb-2'),
-            ]),
-            dbc.Row([
-                dbc.Col([
-                    dcc.Loading(id="map-loading",
-                                type="circle",
-                                children=dcc.Graph(id="accessi_map")),
-                    html.Div(children="Travel time (min)"),
-                    dcc.Slider(0,60,1,
-                            value=30,
-                            marks=None,
-                            tooltip={"placement": "bottom", "always_visible": True},
-                            id='my_slider'),
+def layout(**kwargs):
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                html.Div([
+                    html.Span('Accessibility',
+                              style={
+                                  "font-size":"3rem",
+                                  "font-family":"Cardo ,serif",
+                                  "font-weight":"400",
+                                  "line-height":"1.04",
+                                  "margin-bottom":"10px",
+                              }),
+                    html.P([html.Br(), desc, html.Br(), html.Br(), desc_2, html.Br(), html.Br(), desc_3, html.Br(), html.Br(), desc_4],
+                            style={
+                                "font-size":"1rem",
+                                "font-family":"Josefin Sans,,sans-serif",
+                                "font-weight":"400",
+                                "line-height":"1.46429em",
+                                "text-align":"justify"
+                            })
+                ], style={"margin-top":"15px"})
+            ], width=3),
+            dbc.Col([
+                dbc.Row([
+                    dbc.Checklist([
+                        {"label": "High Potential", "value": "High Potential"},
+                        {"label": "Moderate Potential", "value": "Moderate Potential"},
+                        {"label": "Low Potential", "value": "Low Potential"},],
+                        value =['High Potential'],
+                        id='risk_type_dropdown',
+                        switch=True,
+                        inline=True,
+                        input_checked_style={
+                            "backgroundColor": "#1d1a1a",
+                            "borderColor": "#1d1a1a",
+                            "box-shadow": "0 0 1px #1d1a1a"},
+                        className='mb-2'),
+                    #needs the road graph built by the pipeline (data/analytics/road_graph.npz)
+                    dbc.Switch(id='road_scenario',
+                               label='Damaged roads in selected zones',
+                               value=False,
+                               disabled=not scenario.available(),
+                               className='mb-2'),
+                    dbc.RadioItems(options=list(supply_levels),
+                                   value='All Hospitals',
+                                   id='level_radios',
+                                   inline=True,
+                                   className='mb-2'),
+                    #needs the hourly travel times built by the pipeline (data/analytics/travel_hourly.npy)
+                    dcc.Dropdown(options=hourly.hour_options(),
+                                 value=hourly.FREE_FLOW,
+                                 id='hour_dropdown',
+                                 clearable=False,
+                                 disabled=not hourly.available(),
+                                 className='mb-2'),
+                    #uncertainty layers solve an ensemble of perturbed travel times, once per scenario
+                    dbc.RadioItems(options=list(map_layers),
+                                   value='Score',
+                                   id='map_layer',
+                                   inline=True,
+                                   className='mb-2'),
                 ]),
-                dbc.Col([
-                    dcc.Loading(id="map2-loading",
-                                type="circle",
-                                children=dcc.Graph(id="liq_map_2"))
+                dbc.Row([
+                    dbc.Progress(id='raam_progress',
+                                 value=0,
+                                 label='',
+                                 color='dark',
+                                 style={'visibility': 'hidden'},
+                                 className='mb-2'),
                 ]),
-            ]),
-        ], width=9, className="custom-margin"),
-    ])
-], fluid=True, style = {'display': 'flex', 'flexDirection': 'column', 'height': '90vh',})
+                dbc.Row([
+                    dbc.Col([
+                        dcc.Loading(id="map-loading",
+                                    type="circle",
+                                    children=dcc.Graph(id="accessi_map")),
+                        html.Div(id='raam_convergence',
+                                 style={"font-size": "0.8rem", "color": "#6c757d"}),
+                        html.Div(children="Travel time (min)"),
+                        dcc.Slider(0,60,1,
+                                value=30,
+                                marks=None,
+                                tooltip={"placement": "bottom", "always_visible": True},
+                                id='my_slider'),
+                        html.Div(children="Siting (current scenario, level and travel time)",
+                                 className='mt-3'),
+                        dbc.RadioItems(options=[{'label': 'Add beds to hospitals', 'value': 'beds'},
+                                                {'label': 'New hospital', 'value': 'site'}],
+                                       value='beds',
+                                       id='siting_mode',
+                                       inline=True),
+                        dbc.InputGroup([
+                            dbc.InputGroupText("Beds"),
+                            dbc.Input(id='siting_beds', type='number', value=200, min=siting.BED_STEP,
+                                      step=siting.BED_STEP),
+                            dbc.Button('Recommend', id='siting_button', color='dark'),
+                        ], size='sm', className='mb-2'),
+                        html.Div(id='siting_status',
+                                 style={"font-size": "0.8rem", "color": "#6c757d"}),
+                        dcc.Loading(id="siting-loading",
+                                    type="circle",
+                                    children=html.Div(id='siting_table')),
+                    ]),
+                    dbc.Col([
+                        dcc.Loading(id="map2-loading",
+                                    type="circle",
+                                    children=dcc.Graph(id="liq_map_2"))
+                    ]),
+                ]),
+            ], width=9, className="custom-margin"),
+        ])
+    ], fluid=True, style = {'display': 'flex', 'flexDirection': 'column', 'height': '90vh',})
+
+
+#converged solutions per scenario and tau, shared by workers and used as warm starts
+raam_cache = raam.RaamCache(shared_store, namespace='accessibility.raam')
+
+
+def raam_problem(snapshot, excluded_potentials, damaged_roads=False, hour=None):
+    #the generation's version keeps results in the shared store apart from other generations'
+    key = (snapshot.version, tuple(sorted(excluded_potentials)), damaged_roads, tuple(supply_levels.values()), hour)
+    if key not in snapshot.raam_problems:
+        #travel times with roads in the selected zones closed or slowed
+        cost_df = snapshot.travel_matrix
+        if damaged_roads:
+            cost_df = scenario.degraded_travel_matrix(excluded_potentials, snapshot.travel_matrix)
+        #and slowed by the hour's congestion
+        if hour is not None:
+            cost_df = hourly.hourly_travel_matrix(cost_df, hour, key[1] if damaged_roads else None)
+
+        #filter hospitals not in selected liquefaction potential
+        brgy_hospital = cost_df.loc[~(cost_df['potential'].isin(excluded_potentials))]
+        ncr_hosp_filtered = snapshot.ncr_hosp.loc[snapshot.ncr_hosp['hospital_index'].isin(brgy_hospital['hospital_index'].tolist())]
+
+        snapshot.raam_problems[key] = raam.RaamProblem.from_frames(
+            demand_df=snapshot.ncr_boundary_pop,
+            demand_index="brgy_index",
+            demand_value="population",
+            supply_df=ncr_hosp_filtered,
+            supply_index="hospital_index",
+            supply_values=list(supply_levels.values()),
+            cost_df=cost_df,
+            cost_origin="brgy_index",
+            cost_dest="hospital_index",
+            cost_name="duration", #duration is in seconds
+        )
+    return key, snapshot.raam_problems[key]
 
 
-@callback(
-    Output('liq_map_2', 'figure'),
-    Output('accessi_map', 'figure'),
-    Input('risk_type_dropdown', 'value'),
-    Input('my_slider', 'value')
-)
-def display_map(risk_type_dropdown, my_slider):
-
-    #access method for RAAM - all hospitals available
-    all_hosp_access = Access(
-        demand_df=ncr_boundary_pop,
-        demand_index="brgy_index",
-        demand_value="population",
-        supply_df=ncr_hosp,
-        supply_index="hospital_index",
-        supply_value="bed_capacity",
-        cost_df=travel_matrix,
-        cost_origin="brgy_index",
-        cost_dest="hospital_index",
-        cost_name="duration", #duration is in seconds
-        neighbor_cost_df=travel_matrix,
-        neighbor_cost_origin="brgy_index",
-        neighbor_cost_dest="hospital_index",
-        neighbor_cost_name="duration"
-    )
+def raam_results(snapshot, excluded_potentials, tau, damaged_roads=False, hour=None):
+    #a coarse solution after a few cycles, then refinements until converged; cached per scenario and hour
+    key, problem = raam_problem(snapshot, excluded_potentials, damaged_roads, hour)
+    for result in raam.progressive(problem, tau, raam_cache, key, first_report=5, report_every=25):
+        yield problem, result
 
-    #Run RAAM - all hospitals available
-    all_hosp_access.raam(name="raam_all", tau=my_slider*60) #slider in minutes * 60
-
-    #filter hospitals not in selected liquefaction potential
-    brgy_hospital = travel_matrix.loc[~(travel_matrix['potential'].isin(risk_type_dropdown))]
-    ncr_hosp_filtered = ncr_hosp.loc[ncr_hosp['hospital_index'].isin(brgy_hospital['hospital_index'].tolist())]
-
-    #access method for RAAM - filtered hospitals
-    filtered_hosp_access = Access(
-        demand_df=ncr_boundary_pop,
-        demand_index="brgy_index",
-        demand_value="population",
-        supply_df=ncr_hosp_filtered,
-        supply_index="hospital_index",
-        supply_value="bed_capacity",
-        cost_df=travel_matrix,
-        cost_origin="brgy_index",
-        cost_dest="hospital_index",
-        cost_name="duration", #duration is in seconds
-        neighbor_cost_df=travel_matrix,
-        neighbor_cost_origin="brgy_index",
-        neighbor_cost_dest="hospital_index",
-        neighbor_cost_name="duration"
-    )
 
-    #Run RAAM - filtered hospitals
-    filtered_hosp_access.raam(name="raam_filtered", tau=my_slider*60) #slider in minutes * 60
+#identical solves requested by concurrent sessions are computed once
+@singleflight('accessibility.solve_raam')
+def solve_raam(excluded_potentials, tau, name, damaged_roads=False, hour=None):
+    for problem, result in raam_results(dataset.current(), excluded_potentials, tau, damaged_roads, hour):
+        pass
+    return raam.result_frame(problem, result, name, "brgy_index")
 
 
+def accessibility_figure(snapshot, filtered_access_df, score_column, colorbar_title='RAAM', hover_label='Accesibility Score'):
+
     #Plot filtered hospitals
-    map_fig  = px.choropleth_mapbox(filtered_hosp_access.access_df.reset_index(),
+    map_fig  = px.choropleth_mapbox(filtered_access_df.reset_index(),
                                 locations='brgy_index',
-                                geojson=ncr_boundary_pop,
+                                geojson=snapshot.ncr_boundary_geojson,
                                 featureidkey="properties.brgy_index",
-                                color='raam_filtered_bed_capacity',
+                                color=score_column,
                                 color_continuous_scale='viridis_r',
-                                range_color = [filtered_hosp_access.access_df["raam_filtered_bed_capacity"].quantile(0.05),
-                                               filtered_hosp_access.access_df["raam_filtered_bed_capacity"].quantile(0.95)],
+                                range_color = [filtered_access_df[score_column].quantile(0.05),
+                                               filtered_access_df[score_column].quantile(0.95)],
                                 )
 
-    customdata_df = ncr_boundary_pop[["barangay", "city"]]
-    customdata_df['raam_filtered_bed_capacity'] = round(filtered_hosp_access.access_df['raam_filtered_bed_capacity'], 3)
+    customdata_df = snapshot.ncr_boundary_pop[["barangay", "city"]]
+    customdata_df[score_column] = round(filtered_access_df[score_column], 3)
 
     map_fig.update_traces(customdata= customdata_df,
                         hovertemplate=
                         'Barangay Name: %{customdata[0]}<br>' +
                         'Municipality: %{customdata[1]}<br>' + 
-                        'Accesibility Score: %{customdata[2]}')
+                        f'{hover_label}: %{{customdata[2]}}')
 
 
 
     map_fig.update_layout(
     margin={'l': 0, 't': 0, 'b': 0, 'r': 0},
-    coloraxis_colorbar_title_text = 'RAAM',
+    coloraxis_colorbar_title_text = colorbar_title,
     mapbox={
         'center': {'lon': 120.9967449, 'lat': 14.60785},
         'style': "dark",
@@ -188,26 +277,79 @@ def display_map(risk_type_dropdown, my_slider):
     height=800
     )
 
+    return encode_figure(map_fig)
+
+
+def convergence_text(result):
+    if result.converged:
+        return f'RAAM converged after {result.cycle} cycles (gap {result.gap:.2%})'
+    return f'RAAM stopped after {result.cycle} cycles (gap {result.gap:.2%})'
+
+
+#RAAM solves run as background jobs so slider drags don't pin a worker;
+#the accessibility map is drawn from progress updates as the solution refines
+@callback(
+    Output('liq_map_2', 'figure'),
+    Output('raam_convergence', 'children'),
+    Input('risk_type_dropdown', 'value'),
+    Input('my_slider', 'value'),
+    Input('road_scenario', 'value'),
+    Input('level_radios', 'value'),
+    Input('hour_dropdown', 'value'),
+    Input('map_layer', 'value'),
+    background=True,
+    progress=[Output('accessi_map', 'figure'), Output('raam_progress', 'value'), Output('raam_progress', 'label')],
+    running=[(Output('raam_progress', 'style'), {'visibility': 'visible'}, {'visibility': 'hidden'})],
+)
+def display_map(set_progress, risk_type_dropdown, my_slider, road_scenario, level_radios, hour_dropdown, map_layer):
+    snapshot = dataset.current()
+
+    tau = my_slider*60 #slider in minutes * 60
+    damaged_roads = bool(road_scenario) and scenario.available()
+    supply = supply_levels[level_radios]
+    hour = hourly.selected_hour(hour_dropdown)
+
+    #Run RAAM - filtered hospitals, redrawn at every refinement; every level is solved in the same run
+    for problem, result in raam_results(snapshot, risk_type_dropdown, tau, damaged_roads, hour):
+        filtered_access_df = raam.result_frame(problem, result, "raam_filtered", "brgy_index")
+        set_progress((accessibility_figure(snapshot, filtered_access_df, f"raam_filtered_{supply}"),
+                      min(100, int(100 * result.cycle / raam.MAX_CYCLES)),
+                      f'Refining: cycle {result.cycle}, gap {result.gap:.2%}'))
+
+    #Uncertainty layers - RAAM under perturbed travel times, warm-started from the solution above
+    if map_layers.get(map_layer):
+        column, colorbar_title, hover_label = map_layers[map_layer]
+        key, _ = raam_problem(snapshot, risk_type_dropdown, damaged_roads, hour)
+
+        def log(done, members):
+            set_progress((dash.no_update, int(100 * done / members), f'Ensemble: {done} of {members} runs'))
+
+        summary = ensemble.cached_summary(shared_store, key, tau, problem, result,
+                                          row=list(supply_levels).index(level_radios), log=log)
+        set_progress((accessibility_figure(snapshot, summary, column, colorbar_title, hover_label),
+                      100, f'Ensemble of {ensemble.N_MEMBERS} runs'))
+
+    #Run RAAM - all hospitals available
+    all_access_df = solve_raam([], tau, "raam_all", hour=hour)
+
+
     #Liquefaction Plot
     liqf_traces = []
     colors = {'HP':'#f03b20', 'MP':'#feb24c', 'LP':'#ffeda0'}
 
-    liquefaction_map_filtered = liquefaction_map.loc[liquefaction_map['potential'].isin(risk_type_dropdown)]
+    liquefaction_map_filtered = snapshot.liquefaction_map.loc[snapshot.liquefaction_map['potential'].isin(risk_type_dropdown)]
 
     for area in liquefaction_map_filtered.iterrows():
         lons = list(area[1].geometry.exterior.coords.xy[0])
         lats = list(area[1].geometry.exterior.coords.xy[1])
 
-        customdata_df = pd.DataFrame(len(lons)*[area[1].potential])
-
         liqf_traces.append(go.Scattermapbox(
             fill = "toself",
             lon = lons,
             lat = lats,
             marker = {'size': 1, 'color': colors[area[1].Name[:2]]},
-            customdata=customdata_df,
             hovertemplate=
-            'Liquefaction Potential: %{customdata[0]}<br>' +
+            f'Liquefaction Potential: {area[1].potential}<br>' +
             '<extra></extra>'
         )
                         )
@@ -215,7 +357,7 @@ def display_map(risk_type_dropdown, my_slider):
     for trace in liqf_traces:
         liquefaction_fig.add_trace(trace)
 
-    ncr_hosp_filtered = ncr_hosp.loc[ncr_hosp['potential'].isin(risk_type_dropdown)]
+    ncr_hosp_filtered = snapshot.ncr_hosp.loc[snapshot.ncr_hosp['potential'].isin(risk_type_dropdown)]
 
     hosp_data = ncr_hosp_filtered[['facility_name','service_capability','bed_capacity']]
     hosp_data['facility_name'] = hosp_data['facility_name'].str.title()
@@ -241,16 +383,16 @@ def display_map(risk_type_dropdown, my_slider):
     ))
 
     #find top 20 affected barangays
-    combined_hosp_access = pd.merge(all_hosp_access.access_df["raam_all_bed_capacity"],
-                                    filtered_hosp_access.access_df["raam_filtered_bed_capacity"],
+    combined_hosp_access = pd.merge(all_access_df[f"raam_all_{supply}"],
+                                    filtered_access_df[f"raam_filtered_{supply}"],
                                     how="inner",
                                     on="brgy_index")
-    combined_hosp_access['raam_difference'] = combined_hosp_access["raam_filtered_bed_capacity"] - combined_hosp_access["raam_all_bed_capacity"]
+    combined_hosp_access['raam_difference'] = combined_hosp_access[f"raam_filtered_{supply}"] - combined_hosp_access[f"raam_all_{supply}"]
     combined_hosp_access = combined_hosp_access.fillna(0)
     combined_hosp_access = combined_hosp_access.sort_values("raam_difference", ascending=False).head(20)
 
     #Plot top 20 affected barangays
-    brgy_losers = pd.merge(ncr_boundary_pop[['barangay', 'brgy_index', 'city', 'geometry']],
+    brgy_losers = pd.merge(snapshot.ncr_boundary_pop[['barangay', 'brgy_index', 'city', 'geometry']],
                            combined_hosp_access,
                            on='brgy_index')
     ##Locating the barangay
@@ -266,10 +408,9 @@ def display_map(risk_type_dropdown, my_slider):
                 lon = lons,
                 lat = lats,
                 marker = {'size': 1, 'color': '#FF0000'},
-                customdata= pd.DataFrame(len(lons)*[area[1].loc[['barangay', 'city']]]),
                 hovertemplate=
-                'Barangay Name: %{customdata[0]}<br>' +
-                'Municipality: %{customdata[1]}<br>' + 
+                f'Barangay Name: {area[1].barangay}<br>' +
+                f'Municipality: {area[1].city}<br>' +
                 '<extra></extra>'
             )
                             )
@@ -285,10 +426,9 @@ def display_map(risk_type_dropdown, my_slider):
                 lon = lons_multi,
                 lat = lats_multi,
                 marker = {'size': 1, 'color': '#FF0000'},
-                customdata= pd.DataFrame(len(lons)*[area[1].loc[['barangay', 'city']]]),
                 hovertemplate=
-                'Barangay Name: %{customdata[0]}<br>' +
-                'Municipality: %{customdata[1]}<br>' + 
+                f'Barangay Name: {area[1].barangay}<br>' +
+                f'Municipality: {area[1].city}<br>' +
                 '<extra></extra>'
                 )
                             )
@@ -308,4 +448,74 @@ def display_map(risk_type_dropdown, my_slider):
     height=800
     )
 
-    return liquefaction_fig, map_fig
+    return encode_figure(liquefaction_fig), convergence_text(result)
+
+
+
+#greedy bed and hospital siting on top of the current RAAM solution
+@callback(
+    Output('siting_table', 'children'),
+    Input('siting_button', 'n_clicks'),
+    State('risk_type_dropdown', 'value'),
+    State('my_slider', 'value'),
+    State('road_scenario', 'value'),
+    State('level_radios', 'value'),
+    State('hour_dropdown', 'value'),
+    State('siting_mode', 'value'),
+    State('siting_beds', 'value'),
+    background=True,
+    progress=[Output('siting_status', 'children')],
+    prevent_initial_call=True,
+)
+def recommend_sites(set_progress, n_clicks, risk_type_dropdown, my_slider, road_scenario, level_radios,
+                    hour_dropdown, siting_mode, siting_beds):
+
+    if not n_clicks:
+        raise PreventUpdate
+    snapshot = dataset.current()
+
+    tau = my_slider*60
+    damaged_roads = bool(road_scenario) and scenario.available()
+    beds = int(siting_beds or siting.BED_STEP)
+
+    set_progress(('Solving RAAM for the current scenario',))
+    for problem, result in raam_results(snapshot, risk_type_dropdown, tau, damaged_roads,
+                                        hourly.selected_hour(hour_dropdown)):
+        pass
+
+    hosp = snapshot.ncr_hosp.set_index('hospital_index').loc[problem.supply_ids]
+    model = siting.SitingModel(problem, result,
+                               snapshot.brgy_centroids.x.to_numpy(), snapshot.brgy_centroids.y.to_numpy(),
+                               hosp.geometry.x.to_numpy(), hosp.geometry.y.to_numpy(),
+                               tau, row=list(supply_levels).index(level_radios))
+    baseline = model.objective
+
+    def log(step, steps, pick):
+        set_progress((f'Step {step} of {steps}: worst-served score {pick.objective:.3f} (from {baseline:.3f})',))
+
+    if siting_mode == 'beds':
+        picks = model.lazy_greedy(model.bed_candidates(), steps=max(1, beds // siting.BED_STEP),
+                                  repeat=True, log=log)
+    else:
+        picks = model.lazy_greedy(model.site_candidates(beds), steps=1, log=log)
+
+    if not picks:
+        set_progress(('No candidate improves the worst-served barangays',))
+        return None
+
+    rows = []
+    for pick in picks:
+        if pick.candidate.kind == 'beds':
+            location = hosp.iloc[pick.candidate.target]['facility_name'].title()
+        else:
+            area = snapshot.ncr_boundary_pop.iloc[pick.candidate.target]
+            location = f'New hospital near {area.barangay}, {area.city}'
+        rows.append({'Location': location, 'Beds Added': pick.candidate.beds, 'Score Gain': pick.gain})
+
+    recommendations = (pd.DataFrame(rows)
+                       .groupby('Location', sort=False, as_index=False)
+                       .agg({'Beds Added': 'sum', 'Score Gain': 'sum'})
+                       .round({'Score Gain': 4}))
+
+    set_progress((f'Worst {siting.WORST_SHARE:.0%} of barangays: RAAM score {baseline:.3f} to {picks[-1].objective:.3f}',))
+    return dbc.Table.from_dataframe(recommendations, striped=True, bordered=False, hover=True, size='sm')
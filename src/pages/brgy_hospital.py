@@ -1,4 +1,5 @@
-from dash import Dash, html, dcc, Input, Output, ctx, callback
+from dash import Dash, html, dcc, Input, Output, State, ctx, callback
+from dash.exceptions import PreventUpdate
 import dash
 import pandas as pd
 import geopandas as gpd
@@ -7,6 +8,14 @@ import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
 import json
 import os
+from utils.encoding import encode_figure
+from utils.singleflight import singleflight
+from utils.reach_index import ReachIndex
+from utils.search import SearchIndex
+from utils.locate import BarangayLocator
+from utils import scenario
+from utils import hourly
+from utils import datastore
 
 # Register dash page
 dash.register_page(__name__,
@@ -20,11 +29,45 @@ desc = "Inherently, the healthcare accessibility across various barangays in Met
 desc_2 = "With this in mind, this page functions as a resource to identify each barangay and determine the number and types of hospitals accessible within a specific travel time on a typical day. When exploring the impact of liquefaction in this project, we operate under the assumption that any liquefaction potential could result in the unavailability of all nearby hospitals, thereby impacting the range of hospitals accessible to barangays within a specified travel time."
 
 
-#import data
-ncr_hosp = gpd.read_file("../data/analytics/ncr_hosp.geojson", driver="GeoJSON")
-liquefaction_map = gpd.read_file("../data/analytics/liquefaction_map.geojson", driver="GeoJSON")
-travel_matrix = pd.read_csv("../data/analytics/travel_matrix.csv")
-ncr_boundary_pop = gpd.read_file("../data/analytics/ncr_boundary_pop.geojson", driver="GeoJSON")
+def load(read):
+    #import data
+    ncr_hosp = read.geojson('ncr_hosp.geojson')
+    liquefaction_map = read.geojson('liquefaction_map.geojson')
+    travel_matrix = read.csv('travel_matrix.csv')
+    ncr_boundary_pop = read.geojson('ncr_boundary_pop.geojson')
+
+    return {'ncr_hosp': ncr_hosp,
+            'liquefaction_map': liquefaction_map,
+            'travel_matrix': travel_matrix,
+            'ncr_boundary_pop': ncr_boundary_pop,
+            #hospitals of each barangay sorted by travel time, built once per worker
+            'reach_index': ReachIndex(travel_matrix, ncr_hosp),
+            #reach indexes over damaged-road or hourly travel times, one per liquefaction combination and hour
+            'degraded_reach_indexes': {},
+            #barangay selector options are searched on the server instead of shipped with the layout
+            'barangay_search': SearchIndex(ncr_boundary_pop['brgy_index_city']),
+            #barangay and liquefaction zone of GPS coordinates
+            'barangay_locator': BarangayLocator(ncr_boundary_pop, liquefaction_map)}
+
+
+#data and reach indexes of the current generation of the analytics artifacts
+dataset = datastore.register(__name__, load)
+
+
+def get_reach_index(snapshot, risk_type_dropdown, road_scenario, hour=None):
+    damaged = bool(road_scenario) and scenario.available()
+    if not damaged and hour is None:
+        return snapshot.reach_index
+    combination = tuple(sorted(risk_type_dropdown)) if damaged else None
+    if (combination, hour) not in snapshot.degraded_reach_indexes:
+        matrix = snapshot.travel_matrix
+        if damaged:
+            matrix = scenario.degraded_travel_matrix(risk_type_dropdown, snapshot.travel_matrix)
+        if hour is not None:
+            matrix = hourly.hourly_travel_matrix(matrix, hour, combination)
+        snapshot.degraded_reach_indexes[combination, hour] = ReachIndex(matrix, snapshot.ncr_hosp)
+    return snapshot.degraded_reach_indexes[combination, hour]
+
 
 #Set api token using environment variables
 mapbox_token = os.environ.get('MAPBOX_TOKEN')
@@ -36,87 +79,115 @@ token = mapbox_token
 # token = open("assets/.mapbox_token").read()
 
 
-layout = dbc.Container([
-    dbc.Row([
-        dbc.Col([
-            html.Div([
-                html.Span('A Closer Look',
-                          style={
-                              "font-size":"3rem",
-                              "font-family":"Cardo ,serif",
-                              "font-weight":"400",
-                              "line-height":"1.04",
-                              "margin-bottom":"10px",
-                          }),
-                html.P([html.Br(), desc, html.Br(), html.Br(), desc_2],
-                        style={
-                            "font-size":"1rem",
-                            "font-family":"Josefin Sans,,sans-serif",
-                            "font-weight":"400",
-                            "line-height":"1.46429em",
-                            "text-align":"justify"
-                        })
-            ], style={"margin-top":"15px"})
-        ], width=3),
-        dbc.Col([
-            dbc.Row([
-                dbc.Checklist([
-                    {"label": "High Potential", "value": "High Potential"},
-                    {"label": "Moderate Potential", "value": "Moderate Potential"},
-                    {"label": "Low Potential", "value": "Low Potential"},],
-                    value =['High Potential'],
-                    id='risk_type_dropdown',
-                    switch=True,
-                    inline=True,
-                    input_checked_style={
-                        "backgroundColor": "#1d1a1a",
-                        "borderColor": "#1d1a1a",
-                        "box-shadow": "0 0 1px #1d1a1a"},
-                    className='mb-2'),
-            ]),
-            dbc.Row([
-                dbc.Col([
-                    dcc.Dropdown(options = ncr_boundary_pop['brgy_index_city'],
-                                             value = 'Barangay 100 | (Caloocan)',
-                                             id='barangay_dropdown',
-                                             style={"backgroundColor": 'white'},
-                                             optionHeight=50),
-                    html.Div(children = ["Population:",
-                                        dcc.Loading(id="pop_count_loading",
-                                                    type="circle",
-                                                    children=html.Div(id="pop_count"))
-                                        ]),
-                    html.Div(children=["Number of Hospitals:",
-                                       dcc.Loading(id="hosp_count_loading",
-                                                   type="circle",
-                                                   children=html.Div(id="hosp_count"))]),
-                    html.Div(children=["Number of Beds:",
-                                       dcc.Loading(id="bed_count_loading",
-                                                   type="circle",
-                                                   children=html.Div(id="hosp_bed"))]),
-                    html.Div(children="Number of Hospitals by level"),
-                    dcc.Loading(id="pop-loading",
-                                type="circle",
-                                children=dcc.Graph(id="bar_chart")),
-                    html.Div(children="Travel time (min)"),
-                    dcc.Slider(0, 60, 1,
-                                value=30,
-                                marks=None,
-                                tooltip={"placement": "bottom", "always_visible": True},
-                                id='my_slider'
-                                ),
-                ], width=4),
-                dbc.Col([
-                    #plot
-                    dcc.Loading(
-                        id="map2-loading",
-                        type="circle",
-                        children=dcc.Graph(id="liq_map")),
-                ], width=8)
-            ]),
-        ], width=9, className="custom-margin")
-    ])
-], fluid=True, style = {'display': 'flex', 'flexDirection': 'column', 'height': '90vh',})
+#barangay shown when the page opens
+default_barangay = 'Barangay 100 | (Caloocan)'
+
+
+def layout(**kwargs):
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                html.Div([
+                    html.Span('A Closer Look',
+                              style={
+                                  "font-size":"3rem",
+                                  "font-family":"Cardo ,serif",
+                                  "font-weight":"400",
+                                  "line-height":"1.04",
+                                  "margin-bottom":"10px",
+                              }),
+                    html.P([html.Br(), desc, html.Br(), html.Br(), desc_2],
+                            style={
+                                "font-size":"1rem",
+                                "font-family":"Josefin Sans,,sans-serif",
+                                "font-weight":"400",
+                                "line-height":"1.46429em",
+                                "text-align":"justify"
+                            })
+                ], style={"margin-top":"15px"})
+            ], width=3),
+            dbc.Col([
+                dbc.Row([
+                    dbc.Checklist([
+                        {"label": "High Potential", "value": "High Potential"},
+                        {"label": "Moderate Potential", "value": "Moderate Potential"},
+                        {"label": "Low Potential", "value": "Low Potential"},],
+                        value =['High Potential'],
+                        id='risk_type_dropdown',
+                        switch=True,
+                        inline=True,
+                        input_checked_style={
+                            "backgroundColor": "#1d1a1a",
+                            "borderColor": "#1d1a1a",
+                            "box-shadow": "0 0 1px #1d1a1a"},
+                        className='mb-2'),
+                    #needs the road graph built by the pipeline (data/analytics/road_graph.npz)
+                    dbc.Switch(id='road_scenario',
+                               label='Damaged roads in selected zones',
+                               value=False,
+                               disabled=not scenario.available(),
+                               className='mb-2'),
+                    #needs the hourly travel times built by the pipeline (data/analytics/travel_hourly.npy)
+                    dcc.Dropdown(options=hourly.hour_options(),
+                                 value=hourly.FREE_FLOW,
+                                 id='hour_dropdown',
+                                 clearable=False,
+                                 disabled=not hourly.available(),
+                                 className='mb-2'),
+                ]),
+                dbc.Row([
+                    dbc.Col([
+                        #options are filled by search_barangays as the user types
+                        dcc.Dropdown(options = [default_barangay],
+                                                 value = default_barangay,
+                                                 id='barangay_dropdown',
+                                                 placeholder='Search barangay or city',
+                                                 style={"backgroundColor": 'white'},
+                                                 optionHeight=50),
+                        #or the barangay of a GPS reading
+                        dbc.Input(id='coordinates_input',
+                                  placeholder='or latitude, longitude',
+                                  debounce=True,
+                                  size='sm',
+                                  className='mt-1'),
+                        html.Div(id='coordinates_status',
+                                 style={"font-size": "0.8rem", "color": "#6c757d"}),
+                        html.Div(children = ["Population:",
+                                            dcc.Loading(id="pop_count_loading",
+                                                        type="circle",
+                                                        children=html.Div(id="pop_count"))
+                                            ]),
+                        html.Div(children=["Number of Hospitals:",
+                                           dcc.Loading(id="hosp_count_loading",
+                                                       type="circle",
+                                                       children=html.Div(id="hosp_count"))]),
+                        html.Div(children=["Number of Beds:",
+                                           dcc.Loading(id="bed_count_loading",
+                                                       type="circle",
+                                                       children=html.Div(id="hosp_bed"))]),
+                        html.Div(children="Number of Hospitals by level"),
+                        dcc.Loading(id="pop-loading",
+                                    type="circle",
+                                    children=dcc.Graph(id="bar_chart")),
+                        html.Div(children="Travel time (min)"),
+                        dcc.Slider(0, 60, 1,
+                                    value=30,
+                                    marks=None,
+                                    tooltip={"placement": "bottom", "always_visible": True},
+                                    id='my_slider'
+                                    ),
+                    ], width=4),
+                    dbc.Col([
+                        #plot
+                        dcc.Loading(
+                            id="map2-loading",
+                            type="circle",
+                            children=dcc.Graph(id="liq_map")),
+                    ], width=8)
+                ]),
+            ], width=9, className="custom-margin")
+        ])
+    ], fluid=True, style = {'display': 'flex', 'flexDirection': 'column', 'height': '90vh',})
 
 
 @callback(
@@ -127,30 +198,31 @@ layout = dbc.Container([
     Output("hosp_count", "children"),
     Input('risk_type_dropdown', 'value'),
     Input('barangay_dropdown', 'value'),
-    Input('my_slider', 'value')
+    Input('my_slider', 'value'),
+    Input('road_scenario', 'value'),
+    Input('hour_dropdown', 'value')
 )
-def display_map(risk_type_dropdown, barangay_dropdown, my_slider):
+@singleflight('brgy_hospital.display_map')
+def display_map(risk_type_dropdown, barangay_dropdown, my_slider, road_scenario, hour_dropdown):
+    snapshot = dataset.current()
 
     #liquefaction plot
     liqf_traces = []
     colors = {'HP':'#f03b20', 'MP':'#feb24c', 'LP':'#ffeda0'}
 
-    liquefaction_map_filtered = liquefaction_map.loc[liquefaction_map['potential'].isin(risk_type_dropdown)]
+    liquefaction_map_filtered = snapshot.liquefaction_map.loc[snapshot.liquefaction_map['potential'].isin(risk_type_dropdown)]
 
     for area in liquefaction_map_filtered.iterrows():
         lons = list(area[1].geometry.exterior.coords.xy[0])
         lats = list(area[1].geometry.exterior.coords.xy[1])
 
-        customdata_df = pd.DataFrame(len(lons)*[area[1].potential])
-
         liqf_traces.append(go.Scattermapbox(
             fill = "toself",
             lon = lons,
             lat = lats,
             marker = {'size': 1, 'color': colors[area[1].Name[:2]]},
-            customdata=customdata_df,
             hovertemplate=
-            'Liquefaction Potential: %{customdata[0]}<br>' +
+            f'Liquefaction Potential: {area[1].potential}<br>' +
             '<extra></extra>'
         ))
 
@@ -161,7 +233,7 @@ def display_map(risk_type_dropdown, barangay_dropdown, my_slider):
     #brgy plot
     brgy_traces = []
 
-    ncr_boundary_pop_filtered = ncr_boundary_pop.loc[ncr_boundary_pop['brgy_index_city'] == barangay_dropdown]
+    ncr_boundary_pop_filtered = snapshot.ncr_boundary_pop.loc[snapshot.ncr_boundary_pop['brgy_index_city'] == barangay_dropdown]
     area = ncr_boundary_pop_filtered.iloc[0]
 
     if area.geometry.geom_type == 'Polygon':
@@ -173,10 +245,9 @@ def display_map(risk_type_dropdown, barangay_dropdown, my_slider):
             lon = lons,
             lat = lats,
             marker = {'size': 1, 'color': '#FFFF00'},
-            customdata= pd.DataFrame(len(lons)*[area[area.index != 'geometry']]),
             hovertemplate=
-            'Barangay Name: %{customdata[2]}<br>' +
-            'Municipality: %{customdata[1]}<br>' + 
+            f'Barangay Name: {area.barangay}<br>' +
+            f'Municipality: {area.city}<br>' +
             '<extra></extra>'
         ))
 
@@ -191,10 +262,9 @@ def display_map(risk_type_dropdown, barangay_dropdown, my_slider):
             lon = lons_multi,
             lat = lats_multi,
             marker = {'size': 1, 'color': '#FFFF00'},
-            customdata= pd.DataFrame(len(lons)*[area[area.index != 'geometry']]),
             hovertemplate=
-            'Barangay Name: %{customdata[2]}<br>' +
-            'Municipality: %{customdata[1]}<br>' + 
+            f'Barangay Name: {area.barangay}<br>' +
+            f'Municipality: {area.city}<br>' +
             '<extra></extra>'
             )
                               )
@@ -205,10 +275,9 @@ def display_map(risk_type_dropdown, barangay_dropdown, my_slider):
 
     #locating the accessible hospitals given a liquefaction potential and travel time
 
-    brgy_hospital = travel_matrix.loc[~(travel_matrix['potential'].isin(risk_type_dropdown)) &
-                                        (travel_matrix['brgy_index'].isin(ncr_boundary_pop_filtered['brgy_index'].tolist())) &
-                                        (travel_matrix['duration']/60 < my_slider)]
-    ncr_hosp_filtered = ncr_hosp.loc[ncr_hosp['hospital_index'].isin(brgy_hospital['hospital_index'].tolist())]
+    reach = (get_reach_index(snapshot, risk_type_dropdown, road_scenario, hourly.selected_hour(hour_dropdown))
+             .query(area.brgy_index, my_slider, risk_type_dropdown))
+    ncr_hosp_filtered = snapshot.ncr_hosp.loc[snapshot.ncr_hosp['hospital_index'].isin(reach.hospital_index)]
 
     hosp_data = ncr_hosp_filtered[['facility_name','service_capability','bed_capacity']]
     hosp_data['facility_name'] = hosp_data['facility_name'].str.title()
@@ -245,7 +314,9 @@ def display_map(risk_type_dropdown, barangay_dropdown, my_slider):
     )
 
     #bar chart for hospital count per level
-    bar_data = ncr_hosp_filtered.groupby('service_capability').count().reset_index()
+    bar_data = pd.DataFrame({'service_capability': list(reach.level_counts.keys()),
+                             'facility_name': list(reach.level_counts.values())})
+    bar_data = bar_data.loc[bar_data['facility_name'] > 0]
     rem_hospital_by_level = px.bar(bar_data,
                                    x='facility_name',
                                    y="service_capability",
@@ -259,8 +330,49 @@ def display_map(risk_type_dropdown, barangay_dropdown, my_slider):
 
     rem_hospital_by_level.update_layout(plot_bgcolor='white', showlegend=False)
 
-    population = ncr_boundary_pop_filtered['population']
-    hospital_bed = ncr_hosp_filtered['bed_capacity'].sum()
-    hospital_count = ncr_hosp_filtered['facility_name'].nunique()
+    population = int(area.population)
+    hospital_bed = reach.bed_capacity
+    hospital_count = reach.hospital_count
+
+    return encode_figure(liquefaction_fig), encode_figure(rem_hospital_by_level), population, hospital_bed, hospital_count
+
+
+@callback(
+    Output('barangay_dropdown', 'options'),
+    Input('barangay_dropdown', 'search_value'),
+    State('barangay_dropdown', 'value'),
+)
+def search_barangays(search_value, barangay_dropdown):
+    if not search_value:
+        raise PreventUpdate
+    matches = dataset.current().barangay_search.search(search_value)
+    #the selected barangay stays an option, or the dropdown would clear it
+    if barangay_dropdown and barangay_dropdown not in matches:
+        matches.append(barangay_dropdown)
+    #the dropdown still filters options by the typed text; searching on it too keeps fuzzy matches
+    return [{'label': label, 'value': label, 'search': f'{label} {search_value}'} for label in matches]
+
 
-    return liquefaction_fig, rem_hospital_by_level, population, hospital_bed, hospital_count
+@callback(
+    Output('barangay_dropdown', 'value', allow_duplicate=True),
+    Output('barangay_dropdown', 'options', allow_duplicate=True),
+    Output('coordinates_status', 'children'),
+    Input('coordinates_input', 'value'),
+    prevent_initial_call=True,
+)
+def locate_coordinates(coordinates_input):
+    if not coordinates_input:
+        raise PreventUpdate
+    try:
+        lat, lon = (float(value) for value in coordinates_input.replace(',', ' ').split())
+    except ValueError:
+        return dash.no_update, dash.no_update, 'Enter latitude and longitude, e.g. 14.5995, 120.9842'
+
+    snapshot = dataset.current()
+    location = snapshot.barangay_locator.locate([lon], [lat])
+    brgy_index, potential = location.brgy_index[0], location.potential[0]
+    if brgy_index < 0:
+        return dash.no_update, dash.no_update, 'Not inside a Metro Manila barangay'
+    barangay = snapshot.ncr_boundary_pop.loc[snapshot.ncr_boundary_pop['brgy_index'] == brgy_index,
+                                             'brgy_index_city'].iloc[0]
+    return barangay, [barangay], f'{potential or "No liquefaction potential"} at this point'
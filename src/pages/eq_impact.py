@@ -6,6 +6,8 @@ import plotly.express as px
 import dash_bootstrap_components as dbc
 import json
 import os
+from utils.encoding import compact_geojson
+from utils import datastore
 
 #Register dash page
 dash.register_page(__name__,
@@ -18,14 +20,28 @@ dash.register_page(__name__,
 desc = "A potential Magnitude 7.2 earthquake along the West Valley Fault System could have devasting effects, including destruction of the built environment, casualties, and economic losses. \"The Big One\" can paralyze the Philippine economy as Metro Manila contributes to about 32% of the national GDP. World Bank estimates the number of fatalities to be 48,000 and $48 billion in financial losses. Quezon City, Manila, and Pasig are among the municipalities that will be severely affected by the aftermath of \"The Big One\"."
 desc_2 = "For disaster mitigation priorities, PHIVOLCS stated that the normalized proportional damage (per square km) is a better indicator of regions with the highest consequence regarding the number of people affected. Las Pinas, Pasay, and Caloocan are the top candidates for prioritizing emergency response and mitigation programs. The approach for disaster management response in the graphs is appropriate for residential areas only, and engineers should evaluate the damage to critical facilities (airports, hospitals, schools, etc) on a case-by-case basis."
 
-#Import data
-earthquake_impact_total_gdf = gpd.read_file('../data/analytics/earthquake_impact_total_gdf.geojson',
-                                            driver='GeoJSON')
-earthquake_impact_total = pd.read_csv('../data/analytics/earthquake_impact_total.csv')
-earthquake_impact = pd.read_csv('../data/analytics/earthquake_impact.csv')
 
-#Set index for choropleth maps
-earthquake_impact_total_gdf = earthquake_impact_total_gdf.set_index('municipality')
+def load(read):
+    #Import data
+    earthquake_impact_total_gdf = read.geojson('earthquake_impact_total_gdf.geojson')
+    earthquake_impact_total = read.csv('earthquake_impact_total.csv')
+    earthquake_impact = read.csv('earthquake_impact.csv')
+
+    #Set index for choropleth maps
+    earthquake_impact_total_gdf = earthquake_impact_total_gdf.set_index('municipality')
+
+    #one outline per municipality, shared by every impact type and rate
+    impact_geojson = compact_geojson(earthquake_impact_total_gdf[~earthquake_impact_total_gdf.index.duplicated()])
+
+    return {'earthquake_impact_total_gdf': earthquake_impact_total_gdf,
+            'earthquake_impact_total': earthquake_impact_total,
+            'earthquake_impact': earthquake_impact,
+            'impact_geojson': impact_geojson}
+
+
+#data of the current generation of the analytics artifacts
+dataset = datastore.register(__name__, load)
+
 
 #Set api token using environment variables
 mapbox_token = os.environ.get('MAPBOX_TOKEN')
@@ -122,12 +138,13 @@ layout = dbc.Container([
         Input('rate-radios', 'value'),
 )
 def create_graph(impact_type, rate):
+    snapshot = dataset.current()
 
-    impact_df = earthquake_impact_total_gdf[(earthquake_impact_total_gdf['impact_type'] == impact_type) &
-                                            (earthquake_impact_total_gdf['rate'] == rate)]
+    impact_df = snapshot.earthquake_impact_total_gdf[(snapshot.earthquake_impact_total_gdf['impact_type'] == impact_type) &
+                                                     (snapshot.earthquake_impact_total_gdf['rate'] == rate)]
 
     impact_fig = px.choropleth_mapbox(impact_df,
-                                      geojson=impact_df.geometry,
+                                      geojson=snapshot.impact_geojson,
                                       locations=impact_df.index,
                                       color_continuous_scale="Reds",
                                       color='value',
@@ -140,8 +157,8 @@ def create_graph(impact_type, rate):
                                       height=800)
     impact_fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
 
-    impact_bar_df = earthquake_impact_total[(earthquake_impact_total['impact_type'] == impact_type) &
-                                            (earthquake_impact_total['rate'] == rate)]
+    impact_bar_df = snapshot.earthquake_impact_total[(snapshot.earthquake_impact_total['impact_type'] == impact_type) &
+                                                     (snapshot.earthquake_impact_total['rate'] == rate)]
     sorted_df = impact_bar_df.sort_values('value')
 
     impact_bar_fig = px.bar(sorted_df,
@@ -168,6 +185,7 @@ def create_graph(impact_type, rate):
     Input('rate-radios', 'value'),
 )
 def select_municipality(bar_click, map_click, impact_type, rate):
+    snapshot = dataset.current()
     triggered_id = ctx.triggered_id
 
     municipality = 'Manila'
@@ -176,9 +194,9 @@ def select_municipality(bar_click, map_click, impact_type, rate):
     elif triggered_id == 'choropleth-map':
         municipality = map_click['points'][0]['location']
 
-    municipality_df = earthquake_impact[(earthquake_impact['municipality'] == municipality) &
-                                        (earthquake_impact['impact_type'] == impact_type) &
-                                        (earthquake_impact['rate'] == rate)]
+    municipality_df = snapshot.earthquake_impact[(snapshot.earthquake_impact['municipality'] == municipality) &
+                                                 (snapshot.earthquake_impact['impact_type'] == impact_type) &
+                                                 (snapshot.earthquake_impact['rate'] == rate)]
 
     municipality_fig = px.bar(municipality_df,
                               x="value",
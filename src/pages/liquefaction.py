@@ -9,6 +9,9 @@ import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
 import json
 import os
+from utils.encoding import encode_figure, compact_geojson
+from utils.exposure import load_liquefaction_exposure
+from utils import datastore
 
 #Register dash page
 dash.register_page(__name__,
@@ -21,13 +24,6 @@ dash.register_page(__name__,
 desc = "Soil liquefaction is a geologic hazard that results when soil loses its density, turning it into a liquid-like state. The ground deformations can significantly damage roads, pipes, and critical infrastructures, hindering emergency response efforts and recovery. The liquefaction map of Metro Manila shows the areas more susceptible to ground subsidence at varying degrees (Low, Moderate, and High Potential). Metro Manila's western and eastern regions are expected to have difficulties accessing critical services due to the liquefaction-induced damage to transport networks."
 desc_2 = "Out of 155 hospitals, 74 are lying in liquefiable areas, with 11,919 beds at risk of not being accessible to the population. "
 
-#import files
-liquefaction_map = gpd.read_file("../data/analytics/liquefaction_map.geojson", driver='GeoJSON')
-liqf_roadways_gdf = gpd.read_file("../data/analytics/liqf_roadways_gdf.geojson", driver='GeoJSON')
-ncr_hosp = gpd.read_file('../data/analytics/ncr_hosp.geojson', driver='GeoJSON')
-liqf_potential_hosp =pd.read_csv("../data/analytics/liquefaction_potential_hospital.csv")
-liqf_potential_capacity = pd.read_csv("../data/analytics/liquefaction_potential_capacity.csv")
-
 #Set api token using environment variables
 mapbox_token = os.environ.get('MAPBOX_TOKEN')
 px.set_mapbox_access_token(mapbox_token)
@@ -37,201 +33,282 @@ token = mapbox_token
 # px.set_mapbox_access_token(open("assets/.mapbox_token").read())
 # token = open("assets/.mapbox_token").read()
 
-#Liquefaction map with hospitals
-liqf_traces = []
-lats_hosp = []
-lons_hosp = []
-
-colors = {'HP':'#f03b20', 'MP':'#feb24c', 'LP':'#ffeda0'}
-legendgroup = {'HP':'High Potential', 'MP':'Moderate Potential', 'LP':'Low Potential'}
-
-for area in liquefaction_map.iterrows():
-    lons = list(area[1].geometry.exterior.coords.xy[0])
-    lats = list(area[1].geometry.exterior.coords.xy[1])
-
-    customdata_df = pd.DataFrame(len(lons)*[area[1].potential])
-
-    liqf_traces.append(go.Scattermapbox(
-        fill = "toself",
-        lon = lons,
-        lat = lats,
-        marker = {'size': 5, 'color': colors[area[1].Name[:2]]},
-        legendgroup= legendgroup[area[1].Name[:2]],
-        legendgrouptitle_text= legendgroup[area[1].Name[:2]],
-        name=area[1].Name,
-        customdata=customdata_df,
-        hovertemplate=
-        'Liquefaction Potential: %{customdata[0]}<br>' +
-        '<extra></extra>')
-                    )
-
-liquefaction_fig = go.Figure()
-for trace in liqf_traces:
-    liquefaction_fig.add_trace(trace)
-
-hosp_data = ncr_hosp[['facility_name','service_capability','bed_capacity']]
-hosp_data['facility_name'] = hosp_data['facility_name'].str.title()
-
-for index, data in ncr_hosp.iterrows():
-    lats_hosp.append(data.geometry.y)
-    lons_hosp.append(data.geometry.x)
-
-liquefaction_fig.add_trace(go.Scattermapbox(
-        lat=lats_hosp,
-        lon=lons_hosp,
-        mode="markers",
-        marker = {'size': 15, 'symbol': "hospital", "color":"green"},
-        name='Hospitals',
-        customdata=hosp_data,
-        hovertemplate=
-        'Hospital Name: %{customdata[0]}<br>' +
-        'Service Capability: %{customdata[1]}<br>' +
-        'Bed Capacity: %{customdata[2]}<br>' + 
-        '<extra></extra>'
-    ))
-
-
-liquefaction_fig.update_layout(
-    margin ={'l':0,'t':0,'b':0,'r':0},
-    mapbox = {
-        'center': {'lon': 120.9787, 'lat': 14.5826},
-        'style': "dark",
-        'zoom': 9.5},
-    mapbox_accesstoken=token,
-    height=800,
-    legend_title_text='Liquefaction Potential')
-
-#grouped bar chart of hospitals on liquefiable areas
-liqf_hosp_fig = px.bar(liqf_potential_hosp, 
-                       x="facility_name", 
-                       y="service_capability",
-                       color="type", barmode="group",
-                       labels={
-                           "type": "Liquefaction Potential",
-                           "facility_name": "No. of Hospitals",
-                           "service_capability":"Service Capability"},
-                       color_discrete_map={'High Potential':'#f03b20',
-                                           'Moderate Potential':'#feb24c', 
-                                           'Low Potential':'#ffeda0'},
-                       title="Hospitals Lying on Liquefiable Areas",
-                       height=400)
-liqf_hosp_fig.update_yaxes(autorange="reversed")
-liqf_hosp_fig.update_layout(plot_bgcolor='white', showlegend=False)
-
-#bar chart for bed capacity on liquefiable areas
-liqf_bed_fig = px.bar(liqf_potential_capacity,
-                      x="bed_capacity",
-                      y="type",
-                      color="type",
-                      labels={
-                          "type": "Liquefaction Potential",
-                          "bed_capacity": "Bed Capacity",},
-                      color_discrete_map={'High Potential':'#f03b20',
-                                          'Moderate Potential':'#feb24c', 
-                                          'Low Potential':'#ffeda0'},
-                      title="Bed Capacities Lying on Liquefiable Areas",
-                      height=400)
-liqf_bed_fig.update_layout(plot_bgcolor='white', showlegend=False)
-
-#Road ways affected 
-colors = {"motorway":"#33a02c", "trunk":"#e31a1c", "primary":"#1f78b4", "secondary":"#fdbf6f", 
-          "tertiary":"#fb9a99", "unclassified":"#b2df8a", "residential":"#a6cee3"}
-traces = []
-
-for highway_type in liqf_roadways_gdf['type'].unique():
-    gdf_by_type = liqf_roadways_gdf[liqf_roadways_gdf['type'] == highway_type]
-
-    lats = []
-    lons = []
-    names = []
-
-    for feature, name in zip(gdf_by_type.geometry, gdf_by_type['@osmId']):
-
-        if isinstance(feature, shapely.geometry.linestring.LineString):
-            linestrings = [feature]
-        elif isinstance(feature, shapely.geometry.multilinestring.MultiLineString):
-            linestrings = feature.geoms
-        else:
-            continue
-
-        for linestring in linestrings:
-            x, y = linestring.xy
-            lats = np.append(lats, y)
-            lons = np.append(lons, x)
-            names = np.append(names, [name]*len(y))
-            lats = np.append(lats, None)
-            lons = np.append(lons, None)
-            names = np.append(names, None)
-
-    traces.append(go.Scattermapbox(
-        mode = "lines",
-        lon = lons,
-        lat = lats,
-        marker={'size':5, "color":colors[highway_type]},
-        name=highway_type,
-    ))
-
-roadways_fig = go.Figure()
-for trace in traces:
-    roadways_fig.add_trace(trace)
-
-roadways_fig.update_layout(
-    margin ={'l':0,'t':0,'b':0,'r':0},
-    mapbox = {
-        'center': {'lon': 120.9787, 'lat': 14.5826},
-        'style': "dark",
-        'zoom': 10},
-    mapbox_accesstoken=token,
-    height=800,
-    legend_title_text='Roadway Type',
-    legend=dict(
-        orientation="h",
-        yanchor="bottom",
-        y=1,
-        xanchor="left",
-        x=0),
-        )
-
-#liquefaction page layout
-liquefaction_page = dbc.Container([
-    dbc.Row([
-        dbc.Col([
+
+def load(read):
+    #import files
+    liquefaction_map = read.geojson('liquefaction_map.geojson')
+    liqf_roadways_gdf = read.geojson('liqf_roadways_gdf.geojson')
+    ncr_hosp = read.geojson('ncr_hosp.geojson')
+    liqf_potential_hosp =read.csv('liquefaction_potential_hospital.csv')
+    liqf_potential_capacity = read.csv('liquefaction_potential_capacity.csv')
+    ncr_boundary_pop = read.geojson('ncr_boundary_pop.geojson')
+
+    #barangay exposure per liquefaction class, computed once and cached as an artifact
+    liqf_exposure = load_liquefaction_exposure(ncr_boundary_pop, liquefaction_map)
+    brgy_geojson = compact_geojson(ncr_boundary_pop, properties=["brgy_index"])
+
+    #Liquefaction map with hospitals
+    liqf_traces = []
+    lats_hosp = []
+    lons_hosp = []
+
+    colors = {'HP':'#f03b20', 'MP':'#feb24c', 'LP':'#ffeda0'}
+    legendgroup = {'HP':'High Potential', 'MP':'Moderate Potential', 'LP':'Low Potential'}
+
+    for area in liquefaction_map.iterrows():
+        lons = list(area[1].geometry.exterior.coords.xy[0])
+        lats = list(area[1].geometry.exterior.coords.xy[1])
+
+        liqf_traces.append(go.Scattermapbox(
+            fill = "toself",
+            lon = lons,
+            lat = lats,
+            marker = {'size': 5, 'color': colors[area[1].Name[:2]]},
+            legendgroup= legendgroup[area[1].Name[:2]],
+            legendgrouptitle_text= legendgroup[area[1].Name[:2]],
+            name=area[1].Name,
+            hovertemplate=
+            f'Liquefaction Potential: {area[1].potential}<br>' +
+            '<extra></extra>')
+                        )
+
+    liquefaction_fig = go.Figure()
+    for trace in liqf_traces:
+        liquefaction_fig.add_trace(trace)
+
+    hosp_data = ncr_hosp[['facility_name','service_capability','bed_capacity']]
+    hosp_data['facility_name'] = hosp_data['facility_name'].str.title()
+
+    for index, data in ncr_hosp.iterrows():
+        lats_hosp.append(data.geometry.y)
+        lons_hosp.append(data.geometry.x)
+
+    liquefaction_fig.add_trace(go.Scattermapbox(
+            lat=lats_hosp,
+            lon=lons_hosp,
+            mode="markers",
+            marker = {'size': 15, 'symbol': "hospital", "color":"green"},
+            name='Hospitals',
+            customdata=hosp_data,
+            hovertemplate=
+            'Hospital Name: %{customdata[0]}<br>' +
+            'Service Capability: %{customdata[1]}<br>' +
+            'Bed Capacity: %{customdata[2]}<br>' + 
+            '<extra></extra>'
+        ))
+
+
+    liquefaction_fig.update_layout(
+        margin ={'l':0,'t':0,'b':0,'r':0},
+        mapbox = {
+            'center': {'lon': 120.9787, 'lat': 14.5826},
+            'style': "dark",
+            'zoom': 9.5},
+        mapbox_accesstoken=token,
+        height=800,
+        legend_title_text='Liquefaction Potential')
+
+    #grouped bar chart of hospitals on liquefiable areas
+    liqf_hosp_fig = px.bar(liqf_potential_hosp, 
+                           x="facility_name", 
+                           y="service_capability",
+                           color="type", barmode="group",
+                           labels={
+                               "type": "Liquefaction Potential",
+                               "facility_name": "No. of Hospitals",
+                               "service_capability":"Service Capability"},
+                           color_discrete_map={'High Potential':'#f03b20',
+                                               'Moderate Potential':'#feb24c', 
+                                               'Low Potential':'#ffeda0'},
+                           title="Hospitals Lying on Liquefiable Areas",
+                           height=400)
+    liqf_hosp_fig.update_yaxes(autorange="reversed")
+    liqf_hosp_fig.update_layout(plot_bgcolor='white', showlegend=False)
+
+    #bar chart for bed capacity on liquefiable areas
+    liqf_bed_fig = px.bar(liqf_potential_capacity,
+                          x="bed_capacity",
+                          y="type",
+                          color="type",
+                          labels={
+                              "type": "Liquefaction Potential",
+                              "bed_capacity": "Bed Capacity",},
+                          color_discrete_map={'High Potential':'#f03b20',
+                                              'Moderate Potential':'#feb24c', 
+                                              'Low Potential':'#ffeda0'},
+                          title="Bed Capacities Lying on Liquefiable Areas",
+                          height=400)
+    liqf_bed_fig.update_layout(plot_bgcolor='white', showlegend=False)
+
+    #Road ways affected 
+    colors = {"motorway":"#33a02c", "trunk":"#e31a1c", "primary":"#1f78b4", "secondary":"#fdbf6f", 
+              "tertiary":"#fb9a99", "unclassified":"#b2df8a", "residential":"#a6cee3"}
+    traces = []
+
+    for highway_type in liqf_roadways_gdf['type'].unique():
+        gdf_by_type = liqf_roadways_gdf[liqf_roadways_gdf['type'] == highway_type]
+
+        lats = []
+        lons = []
+        names = []
+
+        for feature, name in zip(gdf_by_type.geometry, gdf_by_type['@osmId']):
+
+            if isinstance(feature, shapely.geometry.linestring.LineString):
+                linestrings = [feature]
+            elif isinstance(feature, shapely.geometry.multilinestring.MultiLineString):
+                linestrings = feature.geoms
+            else:
+                continue
+
+            for linestring in linestrings:
+                x, y = linestring.xy
+                lats = np.append(lats, y)
+                lons = np.append(lons, x)
+                names = np.append(names, [name]*len(y))
+                lats = np.append(lats, None)
+                lons = np.append(lons, None)
+                names = np.append(names, None)
+
+        traces.append(go.Scattermapbox(
+            mode = "lines",
+            lon = lons,
+            lat = lats,
+            marker={'size':5, "color":colors[highway_type]},
+            name=highway_type,
+        ))
+
+    #km of road per liquefaction class, written with the roadway artifact (utils/roadways.py)
+    roadways_km_children = []
+    if read.exists('liqf_roadways_km.csv'):
+        liqf_roadways_km = read.csv('liqf_roadways_km.csv')
+        roadways_km_fig = px.bar(liqf_roadways_km.loc[liqf_roadways_km['length_km'] > 0],
+                                 x="length_km",
+                                 y="type",
+                                 color="potential",
+                                 orientation='h',
+                                 labels={
+                                     "potential": "Liquefaction Potential",
+                                     "length_km": "Road Length (km)",
+                                     "type": "Roadway Type"},
+                                 color_discrete_map={'High Potential':'#f03b20',
+                                                     'Moderate Potential':'#feb24c',
+                                                     'Low Potential':'#ffeda0'},
+                                 title="Road Length Lying on Liquefiable Areas",
+                                 height=350)
+        roadways_km_fig.update_yaxes(autorange="reversed")
+        roadways_km_fig.update_layout(plot_bgcolor='white')
+        roadways_km_children = [dcc.Graph(figure=encode_figure(roadways_km_fig))]
+
+    roadways_fig = go.Figure()
+    for trace in traces:
+        roadways_fig.add_trace(trace)
+
+    roadways_fig.update_layout(
+        margin ={'l':0,'t':0,'b':0,'r':0},
+        mapbox = {
+            'center': {'lon': 120.9787, 'lat': 14.5826},
+            'style': "dark",
+            'zoom': 10},
+        mapbox_accesstoken=token,
+        height=800,
+        legend_title_text='Roadway Type',
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1,
+            xanchor="left",
+            x=0),
+            )
+
+    #liquefaction page layout
+    liquefaction_page = dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                dbc.Row([
+                    dcc.Loading(id='liqf_hosp_fig_loading', 
+                                type='circle', 
+                                children=dcc.Graph(figure=encode_figure(liqf_hosp_fig)))
+                ]),
+                dbc.Row([
+                    dcc.Loading(id='liqf_bed_fig_loading', 
+                                type='circle', 
+                                children=dcc.Graph(figure=encode_figure(liqf_bed_fig)))
+                ]),
+            ], width=5),
+            dbc.Col([
+                dbc.Row([
+                    dcc.Loading(id='', 
+                                type='circle', 
+                                children=dcc.Graph(figure=encode_figure(liquefaction_fig)))
+                ]),
+            ], width=7, className="custom-margin"),
+        ])
+    ], fluid=True)
+
+
+    #roadways affected page layout
+    roadways_page = html.Div([
+        dbc.Container([
             dbc.Row([
-                dcc.Loading(id='liqf_hosp_fig_loading', 
-                            type='circle', 
-                            children=dcc.Graph(figure=liqf_hosp_fig))
+                dbc.Col([
+                    dcc.Loading(id='roadways_fig_loading', 
+                                type='circle', 
+                                children=dcc.Graph(figure=encode_figure(roadways_fig)))
+                ], align='center', className="custom-margin")
             ]),
             dbc.Row([
-                dcc.Loading(id='liqf_bed_fig_loading', 
-                            type='circle', 
-                            children=dcc.Graph(figure=liqf_bed_fig))
+                dbc.Col(roadways_km_children)
             ]),
+        ], fluid=True)
+    ])
+
+    return {'liqf_exposure': liqf_exposure,
+            'brgy_geojson': brgy_geojson,
+            'liquefaction_page': liquefaction_page,
+            'roadways_page': roadways_page}
+
+
+#data and prebuilt tabs of the current generation of the analytics artifacts
+dataset = datastore.register(__name__, load)
+
+
+#barangay exposure page layout
+exposure_page = dbc.Container([
+    dbc.Row([
+        html.Div([
+            dbc.RadioItems(
+                id="exposure-radios",
+                className="btn-group",
+                inputClassName="btn-check",
+                labelClassName="btn btn-outline-dark",
+                labelCheckedClassName="active",
+                options=[
+                    {"label": "All Potentials", "value": "All"},
+                    {"label": "High Potential", "value": "High Potential"},
+                    {"label": "Moderate Potential", "value": "Moderate Potential"},
+                    {"label": "Low Potential", "value": "Low Potential"},
+                ],
+                value="All",
+            ),
+        ], className="radio-group", style={"margin-top":"15px"}),
+    ]),
+    dbc.Row([
+        dbc.Col([
+            html.H4(id="exposure-total"),
+            dcc.Loading(id='exposure_bar_loading',
+                        type='circle',
+                        children=dcc.Graph(id="exposure-bar")),
         ], width=5),
         dbc.Col([
-            dbc.Row([
-                dcc.Loading(id='', 
-                            type='circle', 
-                            children=dcc.Graph(figure = liquefaction_fig))
-            ]),
+            dcc.Loading(id='exposure_map_loading',
+                        type='circle',
+                        children=dcc.Graph(id="exposure-map")),
         ], width=7, className="custom-margin"),
-    ])
+    ]),
 ], fluid=True)
 
 
-#roadways affected page layout
-roadways_page = html.Div([
-    dbc.Container([
-        dbc.Row([
-            dbc.Col([
-                dcc.Loading(id='roadways_fig_loading', 
-                            type='circle', 
-                            children=dcc.Graph(figure=roadways_fig))
-            ], align='center', className="custom-margin")
-        ]),
-    ], fluid=True)
-])
-
-
 #Tabs format
 layout = dbc.Container([
     dbc.Row([
@@ -265,6 +342,7 @@ layout = dbc.Container([
             dbc.Tabs([
                 dbc.Tab(label="Liquefaction Map", tab_id="tab-1"),
                 dbc.Tab(label="Transport Networks Affected", tab_id="tab-2"),
+                dbc.Tab(label="Barangay Exposure", tab_id="tab-3"),
             ], id="tabs", active_tab="tab-1",),
                 html.Div(id="content"),
         ], width=9, className="custom-margin")
@@ -276,8 +354,71 @@ layout = dbc.Container([
         Input("tabs", "active_tab"),
 )
 def switch_tab(at):
+    snapshot = dataset.current()
     if at == "tab-1":
-        return liquefaction_page
+        return snapshot.liquefaction_page
     elif at == "tab-2":
-        return roadways_page
-    
\ No newline at end of file
+        return snapshot.roadways_page
+    elif at == "tab-3":
+        return exposure_page
+
+
+@callback(
+        Output("exposure-map", "figure"),
+        Output("exposure-bar", "figure"),
+        Output("exposure-total", "children"),
+        Input("exposure-radios", "value"),
+)
+def display_exposure(potential):
+    snapshot = dataset.current()
+
+    #classes are exclusive, so their sum is the exposure to any zone
+    if potential == "All":
+        exposure_df = snapshot.liqf_exposure.groupby(['brgy_index', 'barangay', 'city', 'population'],
+                                                     as_index=False, observed=True)[['area_fraction',
+                                                                                     'population_at_risk']].sum()
+    else:
+        exposure_df = snapshot.liqf_exposure.loc[snapshot.liqf_exposure['potential'] == potential]
+
+    exposure_fig = px.choropleth_mapbox(exposure_df,
+                                        locations='brgy_index',
+                                        geojson=snapshot.brgy_geojson,
+                                        featureidkey="properties.brgy_index",
+                                        color='population_at_risk',
+                                        color_continuous_scale='OrRd',
+                                        range_color=[0, exposure_df['population_at_risk'].quantile(0.99)],
+                                        opacity=0.7)
+    exposure_fig.update_traces(customdata=exposure_df[['barangay', 'city', 'area_fraction', 'population_at_risk']].round(2),
+                               hovertemplate=
+                               'Barangay Name: %{customdata[0]}<br>' +
+                               'Municipality: %{customdata[1]}<br>' +
+                               'Area Exposed: %{customdata[2]:.0%}<br>' +
+                               'Population at Risk: %{customdata[3]:,.0f}' +
+                               '<extra></extra>')
+    exposure_fig.update_layout(
+        margin ={'l':0,'t':0,'b':0,'r':0},
+        mapbox = {
+            'center': {'lon': 120.9787, 'lat': 14.5826},
+            'style': "dark",
+            'zoom': 10},
+        mapbox_accesstoken=token,
+        coloraxis_colorbar_title_text='Population<br>at Risk',
+        height=800)
+
+    top_df = exposure_df.nlargest(15, 'population_at_risk').sort_values('population_at_risk')
+    top_df = top_df.assign(name=top_df['barangay'].astype(str) + ' (' + top_df['city'].astype(str) + ')')
+    exposure_bar_fig = px.bar(top_df,
+                              x="population_at_risk",
+                              y="name",
+                              color="population_at_risk",
+                              color_continuous_scale="OrRd",
+                              labels={
+                                  "name": "Barangay",
+                                  "population_at_risk": "Population at Risk"},
+                              title="Most Exposed Barangays",
+                              height=600)
+    exposure_bar_fig.update_layout(coloraxis_showscale=False, plot_bgcolor='white')
+
+    total = int(exposure_df['population_at_risk'].sum())
+    return encode_figure(exposure_fig), encode_figure(exposure_bar_fig), f"{total:,} residents on liquefiable ground"
+    
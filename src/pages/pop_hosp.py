@@ -9,6 +9,9 @@ import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
 import json
 import os
+from utils.encoding import encode_figure, compact_geojson
+from utils.exposure import load_fault_proximity, fault_buffers
+from utils import datastore
 
 #Register dash page
 dash.register_page(__name__,
@@ -22,13 +25,6 @@ dash.register_page(__name__,
 desc = "The current population of NCR is 13,484,462, accounting for about 12.37% of the Philippine population based on the 2020 Census of Population and Housing (2020 CPH). The population is higher by 607,209 from the 2015 census, with Quezon City, Manila, and Caloocan having the highest number of inhabitants. The LGUs constantly remind barangays near the WVF to move out of the fault line as they risk receiving catastrophic damages."
 desc_2 = "Access to health facilities is crucial in a post-earthquake situation. The total number of hospitals in Metro Manila is 155, divided into three levels according to their functional capacity. Level 1 is general hospitals, including operating and recovery rooms; Level 2 has available ICU and respiratory services, and Level 3 has physical rehabilitation units and a blood bank. The surge of critical care demand after an earthquake will be a significant challenge to our healthcare system, in addition to continuing their baseline services to their current patients."
 
-ncr_hosp = gpd.read_file('../data/analytics/ncr_hosp.geojson',driver='GeoJSON')
-fault_lines_ph = gpd.read_file('../data/analytics/fault_lines_ph.geojson', driver='GeoJSON')
-population_ncr = gpd.read_file('../data/analytics/ncr_boundary_pop.geojson', driver='GeoJSON')
-
-hosp_data = ncr_hosp[['facility_name','service_capability','bed_capacity']]
-hosp_data['facility_name'] = hosp_data['facility_name'].str.title()
-
 #Set api token using environment variables
 mapbox_token = os.environ.get('MAPBOX_TOKEN')
 px.set_mapbox_access_token(mapbox_token)
@@ -38,140 +34,231 @@ token = mapbox_token
 # px.set_mapbox_access_token(open("assets/.mapbox_token").read())
 # token = open("assets/.mapbox_token").read()
 
-#Fault Line Plot
-lats = []
-lons = []
-names = []
-
-for feature, name in zip(fault_lines_ph.geometry, fault_lines_ph.name):
-    if isinstance(feature, shapely.geometry.linestring.LineString):
-        linestrings = [feature]
-    elif isinstance(feature, shapely.geometry.multilinestring.MultiLineString):
-        linestrings = feature.geoms
-    else:
-        continue
-    for linestring in linestrings:
-        x, y = linestring.xy
-        lats = np.append(lats, y)
-        lons = np.append(lons, x)
-        names = np.append(names, [name]*len(y))
-        lats = np.append(lats, None)
-        lons = np.append(lons, None)
-        names = np.append(names, None)
-
-fault_fig = px.line_mapbox(
-    lat=lats,
-    lon=lons,
-    hover_name=names,
-    color=len(names)*["fault line"],
-    color_discrete_map={"fault line":"#FF0000"},
-)
 
-fault_fig.update_traces(customdata= pd.DataFrame(names),
-                        hovertemplate='Fault Name: %{customdata[0]}<extra></extra>')
+def load(read):
+    ncr_hosp = read.geojson('ncr_hosp.geojson')
+    fault_lines_ph = read.geojson('fault_lines_ph.geojson')
+    population_ncr = read.geojson('ncr_boundary_pop.geojson')
 
+    hosp_data = ncr_hosp[['facility_name','service_capability','bed_capacity']]
+    hosp_data['facility_name'] = hosp_data['facility_name'].str.title()
 
-#population plot
-pop_fig = px.choropleth_mapbox(
-    data_frame=population_ncr,
-    geojson=population_ncr.geometry,
-    locations=population_ncr.index,
-    color='population',
-)
+    #distance to the nearest fault, precomputed as analytics artifacts
+    fault_brgy, fault_hosp = load_fault_proximity(population_ncr, ncr_hosp, fault_lines_ph)
+    buffers_km = fault_buffers(fault_brgy)
+    brgy_geojson = compact_geojson(population_ncr, properties=["brgy_index"])
+
+    #Fault Line Plot
+    lats = []
+    lons = []
+    names = []
+
+    for feature, name in zip(fault_lines_ph.geometry, fault_lines_ph.name):
+        if isinstance(feature, shapely.geometry.linestring.LineString):
+            linestrings = [feature]
+        elif isinstance(feature, shapely.geometry.multilinestring.MultiLineString):
+            linestrings = feature.geoms
+        else:
+            continue
+        for linestring in linestrings:
+            x, y = linestring.xy
+            lats = np.append(lats, y)
+            lons = np.append(lons, x)
+            names = np.append(names, [name]*len(y))
+            lats = np.append(lats, None)
+            lons = np.append(lons, None)
+            names = np.append(names, None)
+
+    fault_fig = px.line_mapbox(
+        lat=lats,
+        lon=lons,
+        hover_name=names,
+        color=len(names)*["fault line"],
+        color_discrete_map={"fault line":"#FF0000"},
+    )
+
+    fault_fig.update_traces(customdata= pd.DataFrame(names),
+                            hovertemplate='Fault Name: %{customdata[0]}<extra></extra>')
+
+
+    #population plot
+    pop_fig = px.choropleth_mapbox(
+        data_frame=population_ncr,
+        geojson=compact_geojson(population_ncr),
+        locations=population_ncr.index,
+        color='population',
+    )
+
+    pop_fig.update_traces(customdata= population_ncr[["barangay", "city", "population"]],
+                          hovertemplate=
+                          'Barangay Name: %{customdata[0]}<br>' +
+                          'Municipality: %{customdata[1]}<br>' + 
+                          'Population: %{customdata[2]}')
+
+    #Hospital Plot
+    lats_hosp = []
+    lons_hosp = []
+
+    for index, data in ncr_hosp.iterrows():
+        lats_hosp.append(data.geometry.y)
+        lons_hosp.append(data.geometry.x)
+
+    hosp_fig = go.Figure(go.Scattermapbox(
+        lat=lats_hosp,
+        lon=lons_hosp,
+        mode="markers",
+        marker = {'size': 15, 'symbol': "hospital", "color":"yellow"},
+        customdata=hosp_data,
+        hovertemplate=
+        'Hospital Name: %{customdata[0]}<br>' +
+        'Service Capability: %{customdata[1]}<br>' +
+        'Bed Capacity: %{customdata[2]}<br>' + 
+        '<extra></extra>'
+    ))
+
+    return {'ncr_hosp': ncr_hosp,
+            'population_ncr': population_ncr,
+            'fault_brgy': fault_brgy,
+            'fault_hosp': fault_hosp,
+            'buffers_km': buffers_km,
+            'brgy_geojson': brgy_geojson,
+            'fault_fig': fault_fig,
+            'pop_fig': pop_fig,
+            'hosp_fig': hosp_fig}
+
+
+#data and prebuilt figures of the current generation of the analytics artifacts
+dataset = datastore.register(__name__, load)
+
+
+def layout(**kwargs):
+    snapshot = dataset.current()
+
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                html.Div([
+                    html.Span('Growing Population and Healthcare Dynamics',
+                              style={
+                                  "font-size":"3rem",
+                                  "font-family":"Cardo ,serif",
+                                  "font-weight":"400",
+                                  "line-height":"1.04",
+                                  "margin-bottom":"10px",
+                              }),
+                    html.P([html.Br(), desc, html.Br(), html.Br(), desc_2],
+                            style={
+                                "font-size":"1rem",
+                                "font-family":"Josefin Sans,,sans-serif",
+                                "font-weight":"400",
+                                "line-height":"1.46429em",
+                                "text-align": "justify"
+                            })
+                ], style={"margin-top":"15px"})         
+            ], width=3),
+            dbc.Col([
+                dbc.Row([
+                    dbc.Checklist(
+                        options=[
+                            {"label": "Barangay Population", "value": "Population"},
+                            {"label": "Hospitals", "value": "Hospitals"},
+                            {"label": "Fault Lines", "value": "Fault Lines"},
+                            {"label": "Fault Proximity", "value": "Fault Proximity"},
+                        ],
+                        value=["Population", "Hospitals", "Fault Lines"],
+                        id="switches-input",
+                        switch=True,
+                        inline=True,
+                        input_checked_style={
+                            "backgroundColor": "#1d1a1a",
+                            "borderColor": "#1d1a1a",
+                            "box-shadow": "0 0 1px #1d1a1a"}
+                    ),
+                ]),
+                dbc.Row([
+                    dbc.Col([
+                        html.Div([
+                            dbc.RadioItems(
+                                id="buffer-radios",
+                                className="btn-group",
+                                inputClassName="btn-check",
+                                labelClassName="btn btn-outline-dark",
+                                labelCheckedClassName="active",
+                                options=[{"label": f"Within {km} km", "value": km} for km in snapshot.buffers_km],
+                                value=snapshot.buffers_km[len(snapshot.buffers_km) // 2],
+                            ),
+                        ], className="radio-group"),
+                    ], width=5),
+                    dbc.Col([html.Div(["Population:", html.Div(id="fault_pop")])], width=2),
+                    dbc.Col([html.Div(["Hospitals:", html.Div(id="fault_hosp")])], width=2),
+                    dbc.Col([html.Div(["Beds:", html.Div(id="fault_beds")])], width=2),
+                ], className="mb-2"),
+                dbc.Row([
+                    dcc.Loading(id='map_plot_loading',
+                                type='circle',
+                                children=dcc.Graph(id='map-plot'))
+                ]),
+            ], width=9, className="custom-margin"),
+        ]),
+    ], fluid=True, style = {'display': 'flex', 'flexDirection': 'column', 'height': '90vh',})
 
-pop_fig.update_traces(customdata= population_ncr[["barangay", "city", "population"]],
-                      hovertemplate=
-                      'Barangay Name: %{customdata[0]}<br>' +
-                      'Municipality: %{customdata[1]}<br>' + 
-                      'Population: %{customdata[2]}')
-
-#Hospital Plot
-lats_hosp = []
-lons_hosp = []
-
-for index, data in ncr_hosp.iterrows():
-    lats_hosp.append(data.geometry.y)
-    lons_hosp.append(data.geometry.x)
-
-hosp_fig = go.Figure(go.Scattermapbox(
-    lat=lats_hosp,
-    lon=lons_hosp,
-    mode="markers",
-    marker = {'size': 15, 'symbol': "hospital", "color":"yellow"},
-    customdata=hosp_data,
-    hovertemplate=
-    'Hospital Name: %{customdata[0]}<br>' +
-    'Service Capability: %{customdata[1]}<br>' +
-    'Bed Capacity: %{customdata[2]}<br>' + 
-    '<extra></extra>'
-))
-
-
-layout = dbc.Container([
-    dbc.Row([
-        dbc.Col([
-            html.Div([
-                html.Span('Growing Population and Healthcare Dynamics',
-                          style={
-                              "font-size":"3rem",
-                              "font-family":"Cardo ,serif",
-                              "font-weight":"400",
-                              "line-height":"1.04",
-                              "margin-bottom":"10px",
-                          }),
-                html.P([html.Br(), desc, html.Br(), html.Br(), desc_2],
-                        style={
-                            "font-size":"1rem",
-                            "font-family":"Josefin Sans,,sans-serif",
-                            "font-weight":"400",
-                            "line-height":"1.46429em",
-                            "text-align": "justify"
-                        })
-            ], style={"margin-top":"15px"})         
-        ], width=3),
-        dbc.Col([
-            dbc.Row([
-                dbc.Checklist(
-                    options=[
-                        {"label": "Barangay Population", "value": "Population"},
-                        {"label": "Hospitals", "value": "Hospitals"},
-                        {"label": "Fault Lines", "value": "Fault Lines"},
-                    ],
-                    value=["Population", "Hospitals", "Fault Lines"],
-                    id="switches-input",
-                    switch=True,
-                    inline=True,
-                    input_checked_style={
-                        "backgroundColor": "#1d1a1a",
-                        "borderColor": "#1d1a1a",
-                        "box-shadow": "0 0 1px #1d1a1a"}
-                ),
-            ]),
-            dbc.Row([
-                dcc.Loading(id='map_plot_loading',
-                            type='circle',
-                            children=dcc.Graph(id='map-plot'))
-            ]),
-        ], width=9, className="custom-margin"),
-    ]),
-], fluid=True, style = {'display': 'flex', 'flexDirection': 'column', 'height': '90vh',})
 
 @callback(
         Output("map-plot", "figure"),
         Input("switches-input", "value"),
+        Input("buffer-radios", "value"),
 )
-def update_map(selected_maps):
+def update_map(selected_maps, buffer_km):
+    snapshot = dataset.current()
     fig = go.Figure()
 
     if "Population" in selected_maps:
-        fig.add_trace(pop_fig.data[0])
+        fig.add_trace(snapshot.pop_fig.data[0])
         fig.update_coloraxes(colorscale="Viridis",
-                             cmin=population_ncr['population'].quantile(0.05),
-                             cmax=population_ncr['population'].quantile(0.99),)
+                             cmin=snapshot.population_ncr['population'].quantile(0.05),
+                             cmax=snapshot.population_ncr['population'].quantile(0.99),)
+    if "Fault Proximity" in selected_maps:
+        near_brgy = snapshot.fault_brgy.loc[snapshot.fault_brgy[f'within_{buffer_km}km']]
+        fig.add_trace(go.Choroplethmapbox(
+            geojson=snapshot.brgy_geojson,
+            featureidkey="properties.brgy_index",
+            locations=near_brgy['brgy_index'],
+            z=near_brgy['fault_distance_km'],
+            zmin=0,
+            zmax=buffer_km,
+            colorscale='Reds_r',
+            showscale=False,
+            marker_opacity=0.6,
+            customdata=near_brgy[['barangay', 'city', 'nearest_fault', 'fault_distance_km',
+                                  f'population_within_{buffer_km}km']].round(2),
+            hovertemplate=
+            'Barangay Name: %{customdata[0]}<br>' +
+            'Municipality: %{customdata[1]}<br>' +
+            'Nearest Fault: %{customdata[2]}<br>' +
+            'Distance: %{customdata[3]} km<br>' +
+            'Population within Buffer: %{customdata[4]:,.0f}' +
+            '<extra></extra>'
+        ))
     if "Hospitals" in selected_maps:
-        fig.add_trace(hosp_fig.data[0])
+        fig.add_trace(snapshot.hosp_fig.data[0])
+    if "Fault Proximity" in selected_maps:
+        near_hosp = snapshot.ncr_hosp.loc[snapshot.ncr_hosp['hospital_index'].isin(
+            snapshot.fault_hosp.loc[snapshot.fault_hosp[f'within_{buffer_km}km'], 'hospital_index'])]
+        fig.add_trace(go.Scattermapbox(
+            lat=near_hosp.geometry.y,
+            lon=near_hosp.geometry.x,
+            mode="markers",
+            marker = {'size': 15, 'symbol': "hospital", "color":"red"},
+            customdata=near_hosp[['facility_name', 'bed_capacity']].assign(
+                facility_name=near_hosp['facility_name'].str.title()),
+            hovertemplate=
+            'Hospital Name: %{customdata[0]}<br>' +
+            'Bed Capacity: %{customdata[1]}<br>' +
+            f'Within {buffer_km} km of a fault' +
+            '<extra></extra>'
+        ))
     if "Fault Lines" in selected_maps:
-        fig.add_trace(fault_fig.data[0])
+        fig.add_trace(snapshot.fault_fig.data[0])
 
     fig.update_layout(
     margin={'l': 0, 't': 0, 'b': 0, 'r': 0},
@@ -184,4 +271,18 @@ def update_map(selected_maps):
     height=800
     )
 
-    return fig
+    return encode_figure(fig)
+
+
+@callback(
+        Output("fault_pop", "children"),
+        Output("fault_hosp", "children"),
+        Output("fault_beds", "children"),
+        Input("buffer-radios", "value"),
+)
+def update_fault_cards(buffer_km):
+    snapshot = dataset.current()
+    near_hosp = snapshot.fault_hosp.loc[snapshot.fault_hosp[f'within_{buffer_km}km']]
+
+    population = int(snapshot.fault_brgy[f'population_within_{buffer_km}km'].sum())
+    return f"{population:,}", len(near_hosp), f"{int(near_hosp['bed_capacity'].sum()):,}"
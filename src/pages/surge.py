@@ -0,0 +1,255 @@
+from dash import Dash, html, dcc, Input, Output, ctx, callback
+import dash
+import pandas as pd
+import geopandas as gpd
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import dash_bootstrap_components as dbc
+import json
+import os
+from utils.encoding import encode_figure, compact_geojson
+from utils.singleflight import singleflight
+from utils import scenario
+from utils import surge
+from utils import datastore
+
+#Register dash page
+dash.register_page(__name__,
+                   path='/hospital-surge',
+                   title='Hospital Surge',
+                   name='Hospital Surge',
+                   order=7,
+)
+
+desc = "Bed capacity is not static after \"The Big One\". Casualties arrive at hospitals over hours and days, on top of patients already admitted, and hospitals in liquefaction zones may not be able to receive anyone. This page simulates the surge over the first week: the casualties estimated by PHIVOLCS for each municipality are spread over its barangays by population and sent to the nearest hospital that can treat them and still has beds, with life-threatening injuries treated first at Level 2 and 3 hospitals."
+desc_2 = "The map shows how full each hospital is at the selected hour and where patients are still waiting for a bed. Overflow counts the patients whose nearest hospital was already full and had to be diverted or wait."
+
+
+def load(read):
+    ncr_hosp = read.geojson('ncr_hosp.geojson')
+    liquefaction_map = read.geojson('liquefaction_map.geojson')
+    travel_matrix = read.csv('travel_matrix.csv')
+    ncr_boundary_pop = read.geojson('ncr_boundary_pop.geojson')
+    earthquake_impact = read.csv('earthquake_impact.csv')
+
+    return {'ncr_hosp': ncr_hosp.drop_duplicates('hospital_index').set_index('hospital_index'),
+            'liquefaction_map': liquefaction_map,
+            'travel_matrix': travel_matrix,
+            'ncr_boundary_pop': ncr_boundary_pop,
+            'earthquake_impact': earthquake_impact,
+            'brgy_geojson': compact_geojson(ncr_boundary_pop, properties=["brgy_index"]),
+            #simulation runs per scenario and baseline occupancy, built once per worker
+            'surge_runs': {}}
+
+
+#data and simulation runs of the current generation of the analytics artifacts
+dataset = datastore.register(__name__, load)
+
+
+def get_surge(snapshot, risk_type, road_scenario, baseline_percent):
+    damaged = bool(road_scenario) and scenario.available()
+    key = (tuple(sorted(risk_type)), damaged, baseline_percent)
+    if key not in snapshot.surge_runs:
+        hospitals = snapshot.ncr_hosp.reset_index()
+        travel_matrix = snapshot.travel_matrix
+        if damaged:
+            travel_matrix = scenario.degraded_travel_matrix(risk_type, snapshot.travel_matrix)
+        snapshot.surge_runs[key] = surge.run(snapshot.ncr_boundary_pop, hospitals, travel_matrix,
+                                             snapshot.earthquake_impact, risk_type,
+                                             baseline_occupancy=baseline_percent / 100)
+    return snapshot.surge_runs[key]
+
+
+#Set api token using environment variables
+mapbox_token = os.environ.get('MAPBOX_TOKEN')
+px.set_mapbox_access_token(mapbox_token)
+token = mapbox_token
+
+#Set api token using .mapbox_token in assets folder
+# px.set_mapbox_access_token(open("assets/.mapbox_token").read())
+# token = open("assets/.mapbox_token").read()
+
+
+def layout(**kwargs):
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                html.Div([
+                    html.Span('Hospital Surge',
+                              style={
+                                  "font-size":"3rem",
+                                  "font-family":"Cardo ,serif",
+                                  "font-weight":"400",
+                                  "line-height":"1.04",
+                                  "margin-bottom":"10px",
+                              }),
+                    html.P([html.Br(), desc, html.Br(), html.Br(), desc_2],
+                            style={
+                                "font-size":"1rem",
+                                "font-family":"Josefin Sans,,sans-serif",
+                                "font-weight":"400",
+                                "line-height":"1.46429em",
+                                "text-align":"justify"
+                            })
+                ], style={"margin-top":"15px"})
+            ], width=3),
+            dbc.Col([
+                dbc.Row([
+                    dbc.Checklist([
+                        {"label": "High Potential", "value": "High Potential"},
+                        {"label": "Moderate Potential", "value": "Moderate Potential"},
+                        {"label": "Low Potential", "value": "Low Potential"},],
+                        value =['High Potential'],
+                        id='surge_zones',
+                        switch=True,
+                        inline=True,
+                        input_checked_style={
+                            "backgroundColor": "#1d1a1a",
+                            "borderColor": "#1d1a1a",
+                            "box-shadow": "0 0 1px #1d1a1a"},
+                        className='mb-2'),
+                    #needs the road graph built by the pipeline (data/analytics/road_graph.npz)
+                    dbc.Switch(id='surge_roads',
+                               label='Damaged roads in selected zones',
+                               value=False,
+                               disabled=not scenario.available(),
+                               className='mb-2'),
+                ]),
+                dbc.Row([
+                    dbc.Col([
+                        html.Div(children="Beds occupied before the earthquake (%)"),
+                        dcc.Slider(0, 95, 5,
+                                   value=int(surge.BASELINE_OCCUPANCY * 100),
+                                   marks=None,
+                                   tooltip={"placement": "bottom", "always_visible": True},
+                                   id='surge_baseline'),
+                        html.Div(children=["Patients needing a bed:",
+                                           dcc.Loading(id="surge_total_loading",
+                                                       type="circle",
+                                                       children=html.Div(id="surge_total"))]),
+                        html.Div(children=["Hospitals full:",
+                                           dcc.Loading(id="surge_full_loading",
+                                                       type="circle",
+                                                       children=html.Div(id="surge_full"))]),
+                        html.Div(children=["Patients waiting for a bed:",
+                                           dcc.Loading(id="surge_waiting_loading",
+                                                       type="circle",
+                                                       children=html.Div(id="surge_waiting"))]),
+                        dcc.Loading(id="surge_chart_loading",
+                                    type="circle",
+                                    children=dcc.Graph(id="surge_chart")),
+                        html.Div(children="Hours after the earthquake"),
+                        dcc.Slider(0, surge.DAYS * 24, 1,
+                                   value=24,
+                                   marks={h: f'Day {h // 24}' for h in range(0, surge.DAYS * 24 + 1, 24)},
+                                   tooltip={"placement": "bottom", "always_visible": True},
+                                   id='surge_hour'),
+                    ], width=4),
+                    dbc.Col([
+                        dcc.Loading(id="surge_map_loading",
+                                    type="circle",
+                                    children=dcc.Graph(id="surge_map")),
+                    ], width=8),
+                ]),
+            ], width=9, className="custom-margin"),
+        ]),
+    ], fluid=True, style = {'display': 'flex', 'flexDirection': 'column', 'height': '90vh',})
+
+
+@callback(
+    Output('surge_map', 'figure'),
+    Output('surge_chart', 'figure'),
+    Output('surge_total', 'children'),
+    Output('surge_full', 'children'),
+    Output('surge_waiting', 'children'),
+    Input('surge_zones', 'value'),
+    Input('surge_roads', 'value'),
+    Input('surge_baseline', 'value'),
+    Input('surge_hour', 'value'),
+)
+@singleflight('surge.display_surge')
+def display_surge(surge_zones, surge_roads, surge_baseline, surge_hour):
+    snapshot = dataset.current()
+    run = get_surge(snapshot, surge_zones, surge_roads, surge_baseline)
+
+    #state at the end of the selected hour, the baseline before the first step
+    steps_per_hour = int(round(60 / surge.STEP_MINUTES))
+    t = surge_hour * steps_per_hour - 1
+    occupancy = run.occupancy[t] if t >= 0 else run.baseline
+    waiting = run.waiting[t] if t >= 0 else np.zeros(len(run.brgy_index))
+    is_open = run.capacity > 0
+    full = is_open & (occupancy >= run.capacity - 0.5)
+
+    #waiting patients per barangay
+    surge_fig = go.Figure(go.Choroplethmapbox(
+        geojson=snapshot.brgy_geojson,
+        featureidkey="properties.brgy_index",
+        locations=run.brgy_index,
+        z=waiting.round(1),
+        zmin=0,
+        zmax=max(1, float(run.waiting.max())),
+        colorscale='Reds',
+        marker_opacity=0.6,
+        marker_line_width=0,
+        colorbar={'title': 'Waiting'},
+        customdata=snapshot.ncr_boundary_pop[["barangay", "city"]],
+        hovertemplate=
+        'Barangay Name: %{customdata[0]}<br>' +
+        'Municipality: %{customdata[1]}<br>' +
+        'Patients Waiting: %{z:,.0f}' +
+        '<extra></extra>'
+    ))
+
+    #hospital occupancy
+    hosp = snapshot.ncr_hosp.loc[run.hospital_index[is_open]]
+    share = occupancy[is_open] / run.capacity[is_open]
+    surge_fig.add_trace(go.Scattermapbox(
+        lat=hosp.geometry.y,
+        lon=hosp.geometry.x,
+        mode="markers",
+        marker={'size': 8 + 12 * np.sqrt(run.capacity[is_open] / run.capacity.max()),
+                'color': share, 'cmin': 0, 'cmax': 1, 'colorscale': 'YlOrRd', 'showscale': False},
+        customdata=np.column_stack([hosp['facility_name'].str.title(), hosp['service_capability'],
+                                    occupancy[is_open].round(), run.capacity[is_open],
+                                    run.overflow[:t + 1, is_open].sum(axis=0).round()]),
+        hovertemplate=
+        'Hospital Name: %{customdata[0]}<br>' +
+        'Service Capability: %{customdata[1]}<br>' +
+        'Occupied Beds: %{customdata[2]} of %{customdata[3]}<br>' +
+        'Overflow so far: %{customdata[4]}<br>' +
+        '<extra></extra>'
+    ))
+
+    surge_fig.update_layout(
+    margin ={'l':0,'t':0,'b':0,'r':0},
+    mapbox = {
+        'center': {'lon': 121.053728, 'lat': 14.5826},
+        'style': "dark",
+        'zoom': 9.5},
+    mapbox_accesstoken=token,
+    showlegend=False,
+    height=800
+    )
+
+    #surge over the week, an hourly sample of the steps
+    hourly_steps = slice(steps_per_hour - 1, None, steps_per_hour)
+    hours = run.hours[hourly_steps]
+    timeline = pd.DataFrame({
+        'hours': np.concatenate([[0], hours]),
+        'Admitted': np.concatenate([[0], (run.occupancy[hourly_steps] - run.baseline).sum(axis=1)]),
+        'Waiting': np.concatenate([[0], run.waiting[hourly_steps].sum(axis=1)]),
+        'Overflow': np.concatenate([[0], np.cumsum(run.overflow.sum(axis=1))[hourly_steps]]),
+    }).melt(id_vars='hours', var_name='series', value_name='patients')
+    chart_fig = px.line(timeline,
+                        x='hours',
+                        y='patients',
+                        color='series',
+                        labels={'hours': 'Hours after the earthquake', 'patients': 'Patients', 'series': ''},
+                        color_discrete_map={'Admitted': '#31a354', 'Waiting': '#f03b20', 'Overflow': '#feb24c'},
+                        height=300)
+    chart_fig.add_vline(x=surge_hour, line_dash='dot', line_color='#1d1a1a')
+    chart_fig.update_layout(plot_bgcolor='white', legend={'orientation': 'h', 'y': 1.1})
+
+    return (encode_figure(surge_fig), encode_figure(chart_fig), f"{run.arrived[-1]:,.0f}",
+            f"{int(full.sum())} of {int(is_open.sum())}", f"{waiting.sum():,.0f}")
@@ -0,0 +1,33 @@
+"""Rebuild the data/analytics artifacts from data/raw.
+
+Run from the src folder:
+
+    python -m pipeline                      #every stale stage
+    python -m pipeline travel_matrix        #a stage and whatever it depends on
+    python -m pipeline --dry-run            #list what would be rebuilt
+"""
+import argparse
+import sys
+
+from pipeline.core import run
+from pipeline.stages import registry
+from utils.datastore import publish
+
+if __name__ == '__main__':
+    names = [stage.name for stage in registry()]
+    parser = argparse.ArgumentParser(description='Rebuild stale data artifacts.')
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        help=f"stages to build, default all ({', '.join(names)})")
+    parser.add_argument('--force', action='store_true', help='rebuild even if up to date')
+    parser.add_argument('--jobs', type=int, default=None, help='parallel worker processes')
+    parser.add_argument('--dry-run', action='store_true', help='only report stale stages')
+    args = parser.parse_args()
+    unknown = set(args.stages) - set(names)
+    if unknown:
+        parser.error(f"unknown stage {', '.join(sorted(unknown))}")
+
+    status = run(registry, targets=args.stages, force=args.force, jobs=args.jobs, dry_run=args.dry_run)
+    #running app workers load the rebuilt artifacts as one new generation
+    if 'built' in status.values():
+        print(f'published generation {publish()}')
+    sys.exit(1 if 'failed' in status.values() else 0)
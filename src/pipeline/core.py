@@ -0,0 +1,207 @@
+import contextlib
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+DATA_DIR = '../data'
+MANIFEST = os.path.join(DATA_DIR, '.pipeline_manifest.json')
+
+#files are read in blocks of this size when hashed
+HASH_BLOCK = 1 << 20
+
+
+class Stage:
+    """One step of the pipeline: a function turning input files into output files."""
+
+    def __init__(self, name, inputs, outputs, run, optional=False):
+        self.name = name
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.run = run
+        #optional stages depend on files that are not shipped, and are skipped without them
+        self.optional = optional
+
+    def code_hash(self):
+        #editing a stage's function makes its outputs stale
+        return hashlib.sha256(inspect.getsource(self.run).encode()).hexdigest()
+
+    def __repr__(self):
+        return f'Stage({self.name!r})'
+
+
+@contextlib.contextmanager
+def atomic_output(path):
+    """Path of a temporary file that replaces `path` only if the block succeeds."""
+    directory, filename = os.path.split(path)
+    os.makedirs(directory or '.', exist_ok=True)
+    suffix = os.path.splitext(filename)[1]
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{filename}.', suffix=suffix, dir=directory or '.')
+    os.close(fd)
+    os.remove(tmp_path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class Manifest:
+    """Hashes of every file seen, and of the inputs each stage was last built from."""
+
+    def __init__(self, path=MANIFEST):
+        self.path = path
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.files = data.get('files', {})
+        self.stages = data.get('stages', {})
+
+    def file_hash(self, path):
+        #rehash only when size or modification time changed since the last run
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        cached = self.files.get(path)
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                digest.update(block)
+        self.files[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                            'sha256': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def fingerprint(self, stage):
+        return {
+            'code': stage.code_hash(),
+            'inputs': {path: self.file_hash(path) for path in stage.inputs},
+            'outputs': {path: self.file_hash(path) for path in stage.outputs},
+        }
+
+    def is_fresh(self, stage):
+        recorded = self.stages.get(stage.name)
+        current = self.fingerprint(stage)
+        if recorded is None or any(h is None for h in current['outputs'].values()):
+            return False
+        return recorded == current
+
+    def record(self, stage):
+        self.stages[stage.name] = self.fingerprint(stage)
+
+    def save(self):
+        with atomic_output(self.path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump({'files': self.files, 'stages': self.stages}, f, indent=1, sort_keys=True)
+
+
+def upstream(stages, targets):
+    """Targets plus every stage producing one of their inputs, transitively."""
+    producers = {output: stage for stage in stages for output in stage.outputs}
+    by_name = {stage.name: stage for stage in stages}
+    selected, queue = set(), list(targets)
+    while queue:
+        stage = by_name[queue.pop()]
+        if stage.name in selected:
+            continue
+        selected.add(stage.name)
+        queue.extend(producers[path].name for path in stage.inputs if path in producers)
+    return [stage for stage in stages if stage.name in selected]
+
+
+def _execute(registry, name):
+    #runs in a worker process, so the stage is looked up by name
+    start = time.perf_counter()
+    stage = {stage.name: stage for stage in registry()}[name]
+    stage.run(stage)
+    return time.perf_counter() - start
+
+
+def run(registry, targets=None, force=False, jobs=None, dry_run=False, log=print):
+    """Rebuild stale stages, running independent ones in parallel.
+
+    `registry` is a module-level function returning the list of stages (so
+    worker processes can rebuild it). A stage is stale when its code, an
+    input or an output changed since it was last built, or an output is
+    missing. Stages whose raw inputs are absent keep their existing outputs.
+    """
+    stages = registry()
+    if targets:
+        stages = upstream(stages, targets)
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    depends_on = {stage.name: {producers[path] for path in stage.inputs if path in producers}
+                  for stage in stages}
+
+    manifest = Manifest()
+    status = {}
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while len(status) < len(stages):
+            for stage in stages:
+                if stage.name in status or stage.name in running.values():
+                    continue
+                if not depends_on[stage.name] <= set(status):
+                    continue
+
+                if any(status[dep] == 'failed' for dep in depends_on[stage.name]):
+                    status[stage.name] = 'failed'
+                    log(f'[{stage.name}] skipped, an upstream stage failed')
+                    continue
+
+                missing = [path for path in stage.inputs if not os.path.exists(path)]
+                if missing:
+                    outputs_exist = all(os.path.exists(path) for path in stage.outputs)
+                    if outputs_exist:
+                        status[stage.name] = 'kept'
+                    else:
+                        status[stage.name] = 'skipped' if stage.optional else 'failed'
+                    outcome = {'kept': 'keeping existing outputs', 'skipped': 'skipped, the stage is optional',
+                               'failed': 'cannot build'}[status[stage.name]]
+                    log(f"[{stage.name}] missing {', '.join(missing)}; {outcome}")
+                    continue
+
+                #a real rebuild shows up in the input hashes; a dry run has to assume it
+                upstream_stale = any(status[dep] == 'stale' for dep in depends_on[stage.name])
+                if not force and not upstream_stale and manifest.is_fresh(stage):
+                    status[stage.name] = 'fresh'
+                    log(f'[{stage.name}] up to date')
+                    continue
+
+                if dry_run:
+                    status[stage.name] = 'stale'
+                    log(f'[{stage.name}] would rebuild')
+                    continue
+
+                log(f'[{stage.name}] building')
+                running[pool.submit(_execute, registry, stage.name)] = stage.name
+
+            if not running:
+                continue
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                stage = next(stage for stage in stages if stage.name == name)
+                try:
+                    seconds = future.result()
+                except Exception as error:
+                    status[name] = 'failed'
+                    log(f'[{name}] failed: {error!r}')
+                    continue
+                status[name] = 'built'
+                manifest.record(stage)
+                manifest.save()
+                log(f'[{name}] built in {seconds:.1f}s')
+
+    if not dry_run:
+        manifest.save()
+    return status
@@ -0,0 +1,407 @@
+import ast
+import csv
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Point
+
+from pipeline.core import DATA_DIR, Stage, atomic_output
+
+RAW = os.path.join(DATA_DIR, 'raw')
+TRANSFORMED = os.path.join(DATA_DIR, 'transformed')
+ANALYTICS = os.path.join(DATA_DIR, 'analytics')
+
+
+def raw(name):
+    return os.path.join(RAW, name)
+
+
+def transformed(name):
+    return os.path.join(TRANSFORMED, name)
+
+
+def analytics(name):
+    return os.path.join(ANALYTICS, name)
+
+
+def shapefile(name):
+    return [raw(f'{name}.{ext}') for ext in ('shp', 'shx', 'dbf', 'prj')]
+
+
+#NCR extent, used to read only Metro Manila out of the nationwide shapefiles
+NCR_BBOX = (120.85, 14.30, 121.20, 14.82)
+
+POTENTIAL_NAMES = {'HP': 'High Potential', 'MP': 'Moderate Potential', 'LP': 'Low Potential'}
+
+#boundary (GADM) city names as spelled in the population and PHIVOLCS tables
+GADM_CITIES = {'Kalookan City': 'Caloocan', 'Las Piñas': 'Las Pinas', 'Makati City': 'Makati',
+               'Parañaque': 'Paranaque', 'Pasay City': 'Pasay', 'Pasig City': 'Pasig'}
+IMPACT_MUNICIPALITIES = {'Quezon City': 'Quezon'}
+
+IMPACT_FILES = [
+    ('building damage per km square.csv', 'Building Damage', 'normalized'),
+    ('casualties per km square.csv', 'Casualties', 'normalized'),
+    ('economic loss per km square.csv', 'Economic Loss', 'normalized'),
+    ('building damage per LGU.csv', 'Building Damage', 'total'),
+    ('economic loss per LGU.csv', 'Economic Loss', 'total'),
+    ('casualties per LGU.csv', 'Casualties', 'total'),
+]
+NCR_MUNICIPALITIES = ['Caloocan', 'Las Pinas', 'Makati', 'Malabon', 'Mandaluyong', 'Manila', 'Marikina',
+                      'Muntinlupa', 'Navotas', 'Paranaque', 'Pasay', 'Pasig', 'Pateros', 'Quezon',
+                      'San Juan', 'Taguig', 'Valenzuela']
+
+
+def _write_geojson(gdf, path):
+    with atomic_output(path) as tmp_path:
+        gdf.to_file(tmp_path, driver='GeoJSON')
+
+
+def _write_csv(df, path, index=False):
+    with atomic_output(path) as tmp_path:
+        df.to_csv(tmp_path, index=index)
+
+
+def _name_key(names):
+    return names.str.upper().str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def build_liquefaction_map(stage):
+    zones = []
+    for path in stage.inputs:
+        gdf = gpd.read_file(path)[['Name', 'geometry']]
+        gdf['potential'] = gdf['Name'].str[:2].map(POTENTIAL_NAMES)
+        zones.append(gdf)
+    liquefaction_map = gpd.GeoDataFrame(pd.concat(zones, ignore_index=True), crs=zones[0].crs)
+    _write_geojson(liquefaction_map[['Name', 'potential', 'geometry']], stage.outputs[0])
+
+
+def build_ncr_boundary_pop(stage):
+    population_path, adm3_path = stage.inputs[0], stage.inputs[1]
+
+    population = pd.read_csv(population_path, encoding='utf-8-sig', thousands=',')
+    population.columns = ['city', 'barangay', 'population']
+
+    #the nationwide barangay layer is read through a bounding box, not whole
+    adm3 = gpd.read_file(adm3_path, bbox=NCR_BBOX)
+    adm3 = adm3.loc[adm3['NAME_1'] == 'Metropolitan Manila'].reset_index(drop=True)
+    adm3['city'] = adm3['NAME_2'].replace(GADM_CITIES)
+
+    adm3['key'] = _name_key(adm3['city']) + '|' + _name_key(adm3['NAME_3'])
+    population['key'] = _name_key(population['city']) + '|' + _name_key(population['barangay'])
+
+    boundary = adm3.merge(population[['key', 'barangay', 'population']], on='key', how='inner')
+    boundary['region'] = boundary['NAME_1']
+    boundary['brgy_index'] = np.arange(len(boundary))
+    boundary['brgy_index_city'] = boundary['barangay'] + ' | (' + boundary['city'] + ')'
+
+    columns = ['region', 'city', 'barangay', 'population', 'brgy_index', 'brgy_index_city', 'geometry']
+    _write_geojson(boundary[columns].to_crs('EPSG:4326'), stage.outputs[0])
+
+
+def build_hospital_points(stage):
+    coords_path, boundary_path = stage.inputs
+
+    #hospital indices continue after the barangay indices, as RAAM needs unique ids
+    with open(boundary_path) as f:
+        n_barangays = len(json.load(f)['features'])
+
+    hospitals = pd.read_csv(coords_path, index_col=0, thousands=',')
+    lon_lat = hospitals['coordinates'].map(ast.literal_eval)
+    points = gpd.GeoDataFrame(
+        hospitals[['facility_name', 'service_capability', 'bed_capacity']].reset_index(drop=True),
+        geometry=[Point(lon, lat) for lon, lat in lon_lat],
+        crs='EPSG:4326')
+    points['hospital_index'] = n_barangays + np.arange(len(points))
+    _write_geojson(points, stage.outputs[0])
+
+
+def _bed_capacity(values):
+    #capacities of a thousand beds or more are written with a thousands separator
+    return pd.to_numeric(values.astype(str).str.replace(',', ''), errors='coerce').fillna(0).astype(int)
+
+
+def _zone_hits(hospitals, zones):
+    #(hospital, zone) pairs, one per zone a hospital lies in, in the zones' file order
+    hits = gpd.sjoin(hospitals, zones[['potential', 'geometry']].to_crs(hospitals.crs),
+                     how='inner', predicate='within')
+    return hits.sort_values(['hospital_index', 'index_right'])
+
+
+def build_ncr_hosp(stage):
+    hospitals_path, liquefaction_path = stage.inputs
+
+    hospitals = gpd.read_file(hospitals_path)
+    hospitals['bed_capacity'] = _bed_capacity(hospitals['bed_capacity'])
+    hits = _zone_hits(hospitals[['hospital_index', 'geometry']], gpd.read_file(liquefaction_path))
+
+    #zones were assigned layer by layer (High, Moderate, Low), so a hospital
+    #inside several zones keeps the last one, as in the shipped ncr_hosp
+    potential = hits.drop_duplicates('hospital_index', keep='last').set_index('hospital_index')['potential']
+
+    hospitals['potential'] = hospitals['hospital_index'].map(potential).fillna('No Potential')
+    columns = ['facility_name', 'service_capability', 'bed_capacity', 'hospital_index', 'potential', 'geometry']
+    _write_geojson(hospitals[columns], stage.outputs[0])
+
+
+def build_liquefaction_hospital_summary(stage):
+    hospitals_path, liquefaction_path = stage.inputs
+    hospitals = gpd.read_file(hospitals_path)
+
+    #a hospital counts (with its beds) once in every potential it lies in, as the
+    #liquefaction page's 74 hospitals and 11,919 beds do
+    columns = ['hospital_index', 'facility_name', 'service_capability', 'bed_capacity', 'geometry']
+    at_risk = (_zone_hits(hospitals[columns], gpd.read_file(liquefaction_path))
+               .drop_duplicates(['hospital_index', 'potential'])
+               .rename(columns={'potential': 'type'}))
+    order = list(POTENTIAL_NAMES.values())
+
+    counts = (at_risk.groupby(['type', 'service_capability'])['facility_name'].count().reset_index())
+    counts['type'] = pd.Categorical(counts['type'], order)
+    _write_csv(counts.sort_values(['type', 'service_capability']), stage.outputs[0])
+
+    capacity = at_risk.groupby('type')['bed_capacity'].sum().reindex(order).reset_index()
+    _write_csv(capacity, stage.outputs[1])
+
+
+def travel_pairs(row):
+    """(brgy_index, duration) pairs of a raw travel matrix row, unroutable pairs left out."""
+    #ids and durations are Python list reprs, with None where no route was found
+    brgy_ids = ast.literal_eval(row['brgy_index'])
+    durations = ast.literal_eval(row['duration'])
+    for brgy_index, duration in zip(brgy_ids, durations):
+        #durations come as one-element lists
+        duration = duration[0] if isinstance(duration, list) else duration
+        if duration is not None:
+            yield brgy_index, duration
+
+
+def build_travel_matrix(stage):
+    raw_path, hospitals_path = stage.inputs
+
+    hospitals = gpd.read_file(hospitals_path)
+    potential = dict(zip(hospitals['hospital_index'], hospitals['potential']))
+
+    #Each raw row holds one hospital and a batch of barangays. Rows are parsed
+    #and written one at a time so the whole matrix is never held in memory.
+    csv.field_size_limit(sys.maxsize)
+    with atomic_output(stage.outputs[0]) as tmp_path:
+        with open(raw_path, newline='') as src, open(tmp_path, 'w', newline='') as dst:
+            reader = csv.DictReader(src)
+            writer = csv.writer(dst)
+            writer.writerow(['', 'brgy_index', 'hospital_index', 'duration', 'potential'])
+            row_id = 0
+            for row in reader:
+                hospital_index = int(row['hosp_index'])
+                for brgy_index, duration in travel_pairs(row):
+                    writer.writerow([row_id, brgy_index, hospital_index, duration,
+                                     potential.get(hospital_index, 'No Potential')])
+                    row_id += 1
+
+
+def _impact_state(column, impact_type):
+    if impact_type == 'Economic Loss':
+        return 'Financial'
+    state = re.sub(r'\s*\(.*\)\s*$', '', column).strip()
+    return 'Life - threatening Injuries' if state == 'Life threatening Injuries' else state
+
+
+def read_impact_table(path):
+    """One PHIVOLCS impact table, NCR municipalities only, with numeric values."""
+    #the tables end with a SUM row, whose totals are written with thousands separators
+    table = pd.read_csv(path, encoding='utf-8-sig', thousands=',')
+    table = table.rename(columns={'Municipality': 'municipality'})
+    table = table.loc[(table['municipality'] != 'SUM') & table['municipality'].isin(NCR_MUNICIPALITIES)]
+    table = table.drop(columns=[c for c in table.columns if c.startswith('Area')])
+    values = table.drop(columns='municipality')
+    if not all(pd.api.types.is_numeric_dtype(dtype) for dtype in values.dtypes):
+        raise ValueError(f'{path}: non-numeric values in {list(values.select_dtypes(exclude="number").columns)}')
+    return table
+
+
+def build_earthquake_impact(stage):
+    frames = []
+    for path, (_, impact_type, rate) in zip(stage.inputs, IMPACT_FILES):
+        table = read_impact_table(path)
+        table = table.melt(id_vars='municipality', var_name='state', value_name='value')
+        table['state'] = [_impact_state(c, impact_type) for c in table['state']]
+        table['impact_type'] = impact_type
+        table['rate'] = rate
+        frames.append(table)
+
+    impact = pd.concat(frames, ignore_index=True)[['municipality', 'impact_type', 'state', 'rate', 'value']]
+    _write_csv(impact, stage.outputs[0], index=True)
+
+    total = impact.groupby(['municipality', 'impact_type', 'rate'], as_index=False, sort=False)['value'].sum()
+    _write_csv(total.round(2), stage.outputs[1])
+
+
+def build_earthquake_impact_gdf(stage):
+    total_path, adm2_path = stage.inputs[0], stage.inputs[1]
+
+    total = pd.read_csv(total_path)
+    adm2 = gpd.read_file(adm2_path, bbox=NCR_BBOX)
+    adm2 = adm2.loc[adm2['NAME_1'] == 'Metropolitan Manila']
+    adm2['municipality'] = adm2['NAME_2'].replace(GADM_CITIES).replace(IMPACT_MUNICIPALITIES)
+    adm2['municipality'] = adm2['municipality'].str.replace(r' City$', '', regex=True)
+
+    impact_gdf = adm2[['municipality', 'geometry']].merge(total, on='municipality', how='inner')
+    columns = ['municipality', 'impact_type', 'rate', 'value', 'geometry']
+    _write_geojson(impact_gdf[columns].to_crs('EPSG:4326'), stage.outputs[0])
+
+
+def build_liquefaction_exposure(stage):
+    from utils.exposure import liquefaction_exposure
+
+    boundary_path, liquefaction_path = stage.inputs
+    #each barangay's zone area counts under its highest class only
+    exposure = liquefaction_exposure(gpd.read_file(boundary_path), gpd.read_file(liquefaction_path))
+    _write_csv(exposure, stage.outputs[0])
+
+
+def build_fault_proximity(stage):
+    from utils.exposure import fault_proximity
+
+    boundary_path, hospitals_path, faults_path = stage.inputs
+    brgy_exposure, hosp_exposure = fault_proximity(gpd.read_file(boundary_path),
+                                                   gpd.read_file(hospitals_path),
+                                                   gpd.read_file(faults_path))
+    _write_csv(brgy_exposure, stage.outputs[0])
+    _write_csv(hosp_exposure, stage.outputs[1])
+
+
+def build_road_graph(stage):
+    from utils.routing import RoadGraph
+
+    graph = RoadGraph.from_osm(stage.inputs[0])
+    with atomic_output(stage.outputs[0]) as tmp_path:
+        graph.save(tmp_path)
+
+
+def build_travel_matrix_osm(stage):
+    from utils.routing import RoadGraph, travel_matrix
+
+    graph_path, boundary_path, hospitals_path = stage.inputs
+    matrix = travel_matrix(RoadGraph.load(graph_path), gpd.read_file(boundary_path), gpd.read_file(hospitals_path))
+    _write_csv(matrix, stage.outputs[0], index=True)
+
+
+def build_travel_hourly(stage):
+    from utils.hourly import build
+    from utils.routing import RoadGraph
+
+    graph_path, boundary_path, hospitals_path, matrix_path = stage.inputs
+    with atomic_output(stage.outputs[0]) as tensor_path, atomic_output(stage.outputs[1]) as index_path:
+        build(RoadGraph.load(graph_path), gpd.read_file(boundary_path), gpd.read_file(hospitals_path),
+              pd.read_csv(matrix_path), tensor_path, index_path)
+
+
+def build_travel_degraded(stage):
+    from utils.routing import RoadGraph
+    from utils.scenario import build
+
+    graph_path, liquefaction_path, boundary_path, hospitals_path = stage.inputs
+    with atomic_output(stage.outputs[0]) as tmp_path:
+        build(RoadGraph.load(graph_path), gpd.read_file(liquefaction_path), gpd.read_file(boundary_path),
+              gpd.read_file(hospitals_path), tmp_path)
+
+
+def build_liqf_roadways(stage):
+    from utils.roadways import extract_roadways
+
+    osm_path, liquefaction_path = stage.inputs
+    with atomic_output(stage.outputs[0]) as tmp_path:
+        lengths = extract_roadways(osm_path, gpd.read_file(liquefaction_path), tmp_path)
+    _write_csv(lengths, stage.outputs[1])
+
+
+def build_boundary_topology(stage):
+    from utils import topology
+
+    barangays, municipalities = (gpd.read_file(path) for path in stage.inputs)
+    boundaries = topology.encode_frames({topology.LAYERS[os.path.basename(stage.inputs[0])]: barangays,
+                                         topology.LAYERS[os.path.basename(stage.inputs[1])]: municipalities})
+    with atomic_output(stage.outputs[0]) as tmp_path:
+        topology.write(boundaries, tmp_path)
+
+
+def registry():
+    """Every stage with its declared inputs and outputs."""
+    return [
+        Stage('liquefaction_map',
+              [raw('liquefaction_hp.geojson'), raw('liquefaction_mp.geojson'), raw('liquefaction_lp.geojson')],
+              [analytics('liquefaction_map.geojson')],
+              build_liquefaction_map),
+        Stage('ncr_boundary_pop',
+              [raw('NCR_population.csv')] + shapefile('PHL_adm3'),
+              [analytics('ncr_boundary_pop.geojson')],
+              build_ncr_boundary_pop),
+        #hospital_coords.csv is v_activefacilities.csv geocoded with opencagedata,
+        #an online step that stays in the dataset collection notebook
+        Stage('hospital_points',
+              [transformed('hospital_coords.csv'), analytics('ncr_boundary_pop.geojson')],
+              [transformed('ncr_hosp.geojson')],
+              build_hospital_points),
+        Stage('ncr_hosp',
+              [transformed('ncr_hosp.geojson'), analytics('liquefaction_map.geojson')],
+              [analytics('ncr_hosp.geojson')],
+              build_ncr_hosp),
+        Stage('liquefaction_hospital_summary',
+              [analytics('ncr_hosp.geojson'), analytics('liquefaction_map.geojson')],
+              [analytics('liquefaction_potential_hospital.csv'), analytics('liquefaction_potential_capacity.csv')],
+              build_liquefaction_hospital_summary),
+        Stage('travel_matrix',
+              [raw('travel_matrix.csv'), analytics('ncr_hosp.geojson')],
+              [analytics('travel_matrix.csv')],
+              build_travel_matrix),
+        Stage('earthquake_impact',
+              [raw(name) for name, _, _ in IMPACT_FILES],
+              [analytics('earthquake_impact.csv'), analytics('earthquake_impact_total.csv')],
+              build_earthquake_impact),
+        Stage('earthquake_impact_gdf',
+              [analytics('earthquake_impact_total.csv')] + shapefile('PHL_adm2'),
+              [analytics('earthquake_impact_total_gdf.geojson')],
+              build_earthquake_impact_gdf),
+        #both boundary layers with shared borders stored once, read by the app in place of the GeoJSON
+        Stage('boundary_topology',
+              [analytics('ncr_boundary_pop.geojson'), analytics('earthquake_impact_total_gdf.geojson')],
+              [analytics('ncr_boundaries.topojson')],
+              build_boundary_topology),
+        Stage('liquefaction_exposure',
+              [analytics('ncr_boundary_pop.geojson'), analytics('liquefaction_map.geojson')],
+              [analytics('liquefaction_exposure.csv')],
+              build_liquefaction_exposure),
+        Stage('fault_proximity',
+              [analytics('ncr_boundary_pop.geojson'), analytics('ncr_hosp.geojson'),
+               analytics('fault_lines_ph.geojson')],
+              [analytics('fault_proximity_brgy.csv'), analytics('fault_proximity_hosp.csv')],
+              build_fault_proximity),
+        #offline alternative to the routing service behind raw/travel_matrix.csv,
+        #built when an OSM extract of Metro Manila is placed in data/raw
+        Stage('road_graph',
+              [raw('metro_manila.osm.bz2')],
+              [analytics('road_graph.npz')],
+              build_road_graph, optional=True),
+        Stage('travel_matrix_osm',
+              [analytics('road_graph.npz'), analytics('ncr_boundary_pop.geojson'), analytics('ncr_hosp.geojson')],
+              [analytics('travel_matrix_osm.csv')],
+              build_travel_matrix_osm, optional=True),
+        Stage('travel_hourly',
+              [analytics('road_graph.npz'), analytics('ncr_boundary_pop.geojson'), analytics('ncr_hosp.geojson'),
+               analytics('travel_matrix.csv')],
+              [analytics('travel_hourly.npy'), analytics('travel_hourly_index.npz')],
+              build_travel_hourly, optional=True),
+        Stage('travel_degraded',
+              [analytics('road_graph.npz'), analytics('liquefaction_map.geojson'),
+               analytics('ncr_boundary_pop.geojson'), analytics('ncr_hosp.geojson')],
+              [analytics('travel_degraded.npz')],
+              build_travel_degraded, optional=True),
+        Stage('liqf_roadways',
+              [raw('metro_manila.osm.bz2'), analytics('liquefaction_map.geojson')],
+              [analytics('liqf_roadways_gdf.geojson'), analytics('liqf_roadways_km.csv')],
+              build_liqf_roadways, optional=True),
+    ]
@@ -0,0 +1,569 @@
+"""Export every dashboard state as a static bundle that runs without Python.
+
+Run from the src folder:
+
+    python -m tools.export_static [--out ../data/export] [--jobs 4] [--year-step 10] [--minute-step 10]
+
+Each page's controls are enumerated over a finite grid (year ranges, impact
+and rate radios, liquefaction zone combinations by travel time, barangay by
+zones by travel time, ...). Every state is rendered through the app's own
+callbacks in parallel worker processes, and the outputs are written as
+content-addressed blobs: each trace and layout of a figure is stored once
+however many states share it. Open `index.html` in the output folder; the
+blobs are plain script files, so the bundle also works from a USB stick
+over file://.
+
+Controls not listed on a page keep their defaults (intact roads, free-flow
+travel times, RAAM scores rather than ensemble layers).
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from tools.payload_report import DEFAULT_INPUTS, post_update, split_outputs, update_payload
+
+#a page control: 'select' holds one of the option values, 'checklist' any subset of them
+Control = namedtuple('Control', ['name', 'label', 'kind', 'options', 'default'])
+
+#a callback rendered for every combination of its controls; `inputs(state)` gives
+#the callback's input values and the changed prop, `same(state)` states sure to render alike,
+#`extra(state)` outputs the callback only sends as progress
+View = namedtuple('View', ['callback', 'controls', 'inputs', 'same', 'extra'], defaults=(None, None))
+
+#clicking a point of `graph` sets `control` to the point's `field`
+Click = namedtuple('Click', ['graph', 'field', 'control'])
+
+Page = namedtuple('Page', ['path', 'title', 'controls', 'views', 'clicks'], defaults=((),))
+
+DEFAULT_OUT = os.path.join('..', 'data', 'export')
+
+ZONES = ['High Potential', 'Moderate Potential', 'Low Potential']
+
+
+def subsets(options):
+    return [list(combo) for r in range(len(options) + 1) for combo in itertools.combinations(options, r)]
+
+
+def select(name, label, values, default=None, labels=None):
+    labels = labels or [str(value) for value in values]
+    return Control(name, label, 'select', list(zip(labels, values)), values[0] if default is None else default)
+
+
+def checklist(name, label, values, default):
+    return Control(name, label, 'checklist', [(str(value), value) for value in values], default)
+
+
+def states(page, view):
+    controls = {control.name: control for control in page.controls}
+    domains = [[list(c) for c in subsets([v for _, v in controls[name].options])]
+               if controls[name].kind == 'checklist' else [v for _, v in controls[name].options]
+               for name in view.controls]
+    for values in itertools.product(*domains):
+        yield dict(zip(view.controls, values))
+
+
+def state_key(view, state):
+    #the same key is built by the player from JSON.stringify
+    return '|'.join(json.dumps(state[name], separators=(',', ':'), ensure_ascii=False) for name in view.controls)
+
+
+def build_pages(year_step, minute_step):
+    """Controls and callbacks of every page, with domains read from the current generation."""
+    pop_hosp = sys.modules['pages.pop_hosp'].dataset.current()
+    impact = sys.modules['pages.eq_impact'].dataset.current()
+    healthcare_page = sys.modules['pages.brgy_hospital']
+    healthcare = healthcare_page.dataset.current()
+    accessibility_page = sys.modules['pages.accessibility']
+    first_year, last_year = sys.modules['pages.eq_historical'].dataset.current().years
+
+    years = list(range(first_year, last_year, year_step)) + [last_year]
+    year_ranges = [[start, end] for start, end in itertools.combinations(years, 2)]
+    minutes = list(range(0, 61, minute_step))
+    default_minutes = min(minutes, key=lambda m: abs(m - 30))
+    municipalities = sorted(impact.earthquake_impact['municipality'].unique())
+    barangays = list(healthcare.ncr_boundary_pop['brgy_index_city'])
+    brgy_index = dict(zip(barangays, healthcare.ncr_boundary_pop['brgy_index']))
+
+    def reached(state):
+        #hospitals in reach only change at the travel times where one enters, so states between breakpoints share a render
+        reach = healthcare.reach_index.query(brgy_index[state['barangay']], state['minutes'], state['zones'])
+        return tuple(state['zones']), state['barangay'], tuple(reach.hospital_index.tolist())
+
+    return [
+        Page('/', 'Seismicity',
+             [select('years', 'Years', year_ranges, [first_year, last_year], [f'{a}-{b}' for a, b in year_ranges])],
+             [View('pages.eq_historical.update_map', ['years'],
+                   lambda s: ({'slider-year.value': s['years']}, 'slider-year.value'))]),
+        Page('/population-healthcare', 'Population and Healthcare',
+             [checklist('layers', 'Layers', ['Population', 'Hospitals', 'Fault Lines', 'Fault Proximity'],
+                        ['Population', 'Hospitals', 'Fault Lines']),
+              select('buffer', 'Fault buffer (km)', pop_hosp.buffers_km,
+                     pop_hosp.buffers_km[len(pop_hosp.buffers_km) // 2])],
+             [View('pages.pop_hosp.update_map', ['layers', 'buffer'],
+                   lambda s: ({'switches-input.value': s['layers'], 'buffer-radios.value': s['buffer']},
+                              'switches-input.value')),
+              View('pages.pop_hosp.update_fault_cards', ['buffer'],
+                   lambda s: ({'buffer-radios.value': s['buffer']}, 'buffer-radios.value'))]),
+        Page('/earthquake-impact', 'Earthquake Impact',
+             [select('impact', 'Impact', ['Building Damage', 'Casualties', 'Economic Loss']),
+              select('rate', 'Rate', ['total', 'normalized'], labels=['Total', 'Per Square KM']),
+              select('municipality', 'Municipality', municipalities, 'Manila')],
+             [View('pages.eq_impact.create_graph', ['impact', 'rate'],
+                   lambda s: ({'impact-radios.value': s['impact'], 'rate-radios.value': s['rate']},
+                              'impact-radios.value')),
+              View('pages.eq_impact.select_municipality', ['municipality', 'impact', 'rate'],
+                   lambda s: ({'bar-chart-total.clickData': {'points': [{'y': s['municipality']}]},
+                               'impact-radios.value': s['impact'], 'rate-radios.value': s['rate']},
+                              'bar-chart-total.clickData'))],
+             [Click('bar-chart-total', 'y', 'municipality'), Click('choropleth-map', 'location', 'municipality')]),
+        Page('/liquefaction-potential', 'Liquefaction Potential',
+             [select('tab', 'View', ['tab-1', 'tab-2', 'tab-3'],
+                     labels=['Liquefaction Map', 'Transport Networks Affected', 'Barangay Exposure']),
+              select('exposure', 'Exposure', ['All'] + ZONES, labels=['All Potentials'] + ZONES)],
+             [View('pages.liquefaction.switch_tab', ['tab'],
+                   lambda s: ({'tabs.active_tab': s['tab']}, 'tabs.active_tab')),
+              View('pages.liquefaction.display_exposure', ['exposure'],
+                   lambda s: ({'exposure-radios.value': s['exposure']}, 'exposure-radios.value'))]),
+        Page('/healthcare-access', 'Healthcare Access',
+             [checklist('zones', 'Liquefaction zones', ZONES, ['High Potential']),
+              select('barangay', 'Barangay', barangays, healthcare_page.default_barangay),
+              select('minutes', 'Travel time (min)', minutes, default_minutes)],
+             [View('pages.brgy_hospital.display_map', ['zones', 'barangay', 'minutes'],
+                   lambda s: ({'risk_type_dropdown.value': s['zones'], 'barangay_dropdown.value': s['barangay'],
+                               'my_slider.value': s['minutes']}, 'my_slider.value'),
+                   same=reached)]),
+        Page('/accessibility-score', 'Accessibility Scores',
+             [checklist('zones', 'Liquefaction zones', ZONES, ['High Potential']),
+              select('minutes', 'Travel time (min)', minutes, default_minutes),
+              select('level', 'Hospitals', list(accessibility_page.supply_levels))],
+             [View('pages.accessibility.display_map', ['zones', 'minutes', 'level'],
+                   lambda s: ({'risk_type_dropdown.value': s['zones'], 'my_slider.value': s['minutes'],
+                               'level_radios.value': s['level']}, 'my_slider.value'),
+                   extra=accessibility_map)]),
+    ]
+
+
+def accessibility_map(state):
+    #the score map is only sent as background progress; draw the converged one directly, from the cached solve
+    from utils import raam
+    page = sys.modules['pages.accessibility']
+    snapshot = page.dataset.current()
+    for problem, result in page.raam_results(snapshot, state['zones'], state['minutes'] * 60):
+        pass
+    frame = raam.result_frame(problem, result, 'raam_filtered', 'brgy_index')
+    figure = page.accessibility_figure(snapshot, frame, f"raam_filtered_{page.supply_levels[state['level']]}")
+    return {'accessi_map': {'figure': figure}}
+
+
+class BlobStore:
+    """Content-addressed JSON blobs written as `B("<hash>", <json>);` scripts."""
+
+    def __init__(self, directory, basemap=False):
+        self.directory = directory
+        self.basemap = basemap
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, name, value):
+        path = os.path.join(self.directory, f'{name}.js')
+        if os.path.exists(path):
+            return
+        text = f'B({json.dumps(name)},{json.dumps(value, separators=(",", ":"), ensure_ascii=False)});\n'
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def put(self, value):
+        text = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        name = hashlib.sha256(text.encode()).hexdigest()[:20]
+        self.write(name, value)
+        return {'$ref': name}
+
+    def pack(self, value):
+        """Store `value`, each figure trace and layout as a blob of its own."""
+        if isinstance(value, dict):
+            if isinstance(value.get('data'), list) and isinstance(value.get('layout'), dict):
+                return {'data': [self.put(trace) for trace in value['data']],
+                        'layout': self.put(self.offline_layout(value['layout']))}
+            return {key: self.pack(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.pack(item) for item in value]
+        return value
+
+    def offline_layout(self, layout):
+        #no access token leaves the server, and without a network the mapbox styles have no tiles
+        mapbox = layout.get('mapbox')
+        if not isinstance(mapbox, dict):
+            return layout
+        mapbox = {key: item for key, item in mapbox.items() if key != 'accesstoken'}
+        if not self.basemap:
+            mapbox['style'] = 'white-bg'
+        return dict(layout, mapbox=mapbox)
+
+
+def callbacks_by_name(app):
+    return {f"{spec['callback'].__module__}.{spec['callback'].__name__}": (output_key, spec)
+            for output_key, spec in app.callback_map.items() if 'callback' in spec}
+
+
+_client = None
+_store = None
+_callbacks = None
+
+
+def _init_worker(directory, basemap):
+    #workers are forked from the exporting process, with the app already loaded
+    global _client, _store, _callbacks
+    from app import app
+
+    _client = app.server.test_client()
+    _store = BlobStore(directory, basemap)
+    _callbacks = callbacks_by_name(app)
+
+
+def render(task):
+    """Outputs of one state as a packed blob reference, None if the callback failed; runs in a worker."""
+    from plotly.io.json import to_json_plotly
+
+    callback, path, inputs, changed, extra, state = task
+    output_key, spec = _callbacks[callback]
+    values = dict(DEFAULT_INPUTS, **{'_pages_location.pathname': path}, **inputs)
+    payload = update_payload(output_key, spec, values)
+    payload['changedPropIds'] = [changed]
+
+    #background callbacks are polled to the end by post_update; a 204 updates nothing
+    response = post_update(_client, payload, headers={})
+    if response.status_code >= 400:
+        return None
+    outputs = (response.get_json(silent=True) or {}).get('response', {}) if response.status_code == 200 else {}
+    if extra:
+        outputs.update(json.loads(to_json_plotly(extra(state))))
+    return _store.put(_store.pack(outputs))['$ref']
+
+
+def page_layout(app, client, store, path):
+    """Figures drawn by the page layout itself, which no callback sends."""
+    figures = []
+
+    def walk(component):
+        if isinstance(component, list):
+            for item in component:
+                walk(item)
+        elif isinstance(component, dict) and 'props' in component:
+            props = component['props']
+            if component.get('type') == 'Graph' and props.get('figure'):
+                figures.append(store.pack(props['figure']))
+            walk(props.get('children'))
+
+    for output_key, spec in app.callback_map.items():
+        if '_pages_content' in output_key:
+            values = dict(DEFAULT_INPUTS, **{'_pages_location.pathname': path})
+            response = post_update(client, update_payload(output_key, spec, values), headers={})
+            for output in split_outputs(output_key):
+                walk(response.get_json()['response'].get(output['id'], {}).get(output['property']))
+    return figures
+
+
+def export(out, jobs=None, year_step=10, minute_step=10, basemap=False):
+    import plotly.offline
+
+    #figures are packed as typed arrays only if the bundled plotly.js can read them
+    plotlyjs = plotly.offline.get_plotlyjs_version()
+    os.environ['BINARY_ARRAYS'] = '1' if tuple(int(d) for d in plotlyjs.split('.')[:3]) >= (2, 28, 0) else '0'
+    sys.path.insert(0, os.getcwd())
+    from app import app
+
+    data_dir = os.path.join(out, 'data')
+    store = BlobStore(data_dir, basemap)
+    client = app.server.test_client()
+    client.get('/')
+    callbacks = callbacks_by_name(app)
+
+    start = time.perf_counter()
+    manifest = {'pages': []}
+    report = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(data_dir, basemap)) as pool:
+        for page in build_pages(year_step, minute_step):
+            page_start = time.perf_counter()
+            page_entry = {'path': page.path, 'title': page.title,
+                          'controls': [control._asdict() for control in page.controls],
+                          'clicks': [click._asdict() for click in page.clicks],
+                          'static': page_layout(app, client, store, page.path),
+                          'views': []}
+            for view in page.views:
+                output_key, _ = callbacks[view.callback]
+                keys, tasks, task_of = [], [], {}
+                for state in states(page, view):
+                    same = view.same(state) if view.same else state_key(view, state)
+                    if same not in task_of:
+                        task_of[same] = len(tasks)
+                        inputs, changed = view.inputs(state)
+                        tasks.append((view.callback, page.path, inputs, changed, view.extra, state))
+                    keys.append((state_key(view, state), task_of[same]))
+
+                rendered = list(pool.map(render, tasks, chunksize=max(1, len(tasks) // (8 * (jobs or os.cpu_count())))))
+                #states whose render failed are left out; the player shows them as not exported
+                index = {key: rendered[i] for key, i in keys if rendered[i]}
+                page_entry['views'].append({'controls': view.controls,
+                                            'outputs': [output['id'] for output in split_outputs(output_key)],
+                                            'index': store.put(index)['$ref']})
+                report.append({'page': page.path, 'callback': view.callback, 'states': len(keys),
+                               'rendered': len(tasks), 'unique': len(set(rendered) - {None}),
+                               'failed': rendered.count(None)})
+            manifest['pages'].append(page_entry)
+            print(f'{page.path:<26}{time.perf_counter() - page_start:>8.1f}s')
+
+    store.write('manifest', manifest)
+    with open(os.path.join(out, 'plotly.min.js'), 'w', encoding='utf-8') as f:
+        f.write(plotly.offline.get_plotlyjs())
+    with open(os.path.join(out, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(PLAYER_HTML)
+
+    files = [os.path.join(root, name) for root, _, names in os.walk(out) for name in names]
+    summary = {'seconds': time.perf_counter() - start, 'files': len(files),
+               'bytes': sum(os.path.getsize(path) for path in files), 'views': report}
+    with open(os.path.join(out, 'report.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def print_report(summary):
+    header = f"{'page':<26}{'callback':<42}{'states':>9}{'rendered':>10}{'unique':>9}{'failed':>8}"
+    print(header)
+    print('-' * len(header))
+    for row in summary['views']:
+        print(f"{row['page']:<26}{row['callback']:<42}{row['states']:>9,}{row['rendered']:>10,}{row['unique']:>9,}{row['failed']:>8,}")
+    print(f"\nbuilt in {summary['seconds']:.1f}s: {summary['files']:,} files, {summary['bytes'] / 1e6:.1f} MB")
+
+
+PLAYER_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>The Big One PH</title>
+<script src="plotly.min.js"></script>
+<style>
+body {font-family: "Josefin Sans", sans-serif; margin: 0;}
+nav {background: #1d1a1a; padding: 10px;}
+nav a {color: #fff; margin-right: 18px; cursor: pointer;}
+#title {font-family: Cardo, serif; font-weight: 400; padding: 0 10px;}
+#controls {padding: 0 10px;}
+#controls fieldset {display: inline-block; border: none; margin-right: 12px;}
+.pane {padding: 10px;}
+</style>
+</head>
+<body>
+<nav id="nav"></nav>
+<h1 id="title"></h1>
+<div id="controls"></div>
+<div id="outputs"></div>
+<script>
+var blobs = {}, waiting = {}, manifest, page, state = {};
+
+function B(name, value) {
+  blobs[name] = value;
+  (waiting[name] || []).forEach(function (done) { done(value); });
+  delete waiting[name];
+}
+
+function load(name) {
+  if (name in blobs) return Promise.resolve(blobs[name]);
+  return new Promise(function (done) {
+    if (!waiting[name]) {
+      waiting[name] = [];
+      var script = document.createElement('script');
+      script.src = 'data/' + name + '.js';
+      document.head.appendChild(script);
+    }
+    waiting[name].push(done);
+  });
+}
+
+function resolve(value) {
+  if (Array.isArray(value)) return Promise.all(value.map(resolve));
+  if (value && typeof value === 'object') {
+    if ('$ref' in value) return load(value.$ref).then(resolve);
+    var keys = Object.keys(value);
+    return Promise.all(keys.map(function (k) { return resolve(value[k]); })).then(function (parts) {
+      var out = {};
+      keys.forEach(function (k, i) { out[k] = parts[i]; });
+      return out;
+    });
+  }
+  return Promise.resolve(value);
+}
+
+function plot(div, figure) {
+  Plotly.react(div, figure.data, figure.layout, {responsive: true});
+}
+
+function component(value) {
+  if (value === null || value === undefined) return document.createTextNode('');
+  if (Array.isArray(value)) {
+    var fragment = document.createDocumentFragment();
+    value.forEach(function (item) { fragment.appendChild(component(item)); });
+    return fragment;
+  }
+  if (typeof value !== 'object') return document.createTextNode(String(value));
+  var props = value.props || {};
+  if (value.type === 'Graph') {
+    var div = document.createElement('div');
+    if (props.figure) setTimeout(function () { plot(div, props.figure); });
+    return div;
+  }
+  var html = value.namespace === 'dash_html_components';
+  var el = document.createElement(html ? value.type.toLowerCase() : 'div');
+  if (props.className) el.className = props.className;
+  Object.keys(props.style || {}).forEach(function (k) {
+    if (k.indexOf('-') >= 0) el.style.setProperty(k, props.style[k]); else el.style[k] = props.style[k];
+  });
+  el.appendChild(component(props.children));
+  return el;
+}
+
+function key(view) {
+  return view.controls.map(function (name) { return JSON.stringify(state[name]); }).join('|');
+}
+
+function show(view) {
+  load(view.index).then(function (index) {
+    var name = index[key(view)];
+    if (!name) {
+      view.outputs.forEach(function (id) { pane(id).textContent = 'Not exported'; });
+      return;
+    }
+    return load(name).then(resolve).then(function (response) {
+      Object.keys(response).forEach(function (id) {
+        Object.keys(response[id]).forEach(function (prop) {
+          var div = pane(id), value = response[id][prop];
+          if (prop === 'figure') {
+            div.textContent = '';
+            plot(div, value);
+            bind(div, id);
+          } else {
+            div.textContent = '';
+            div.appendChild(component(value));
+          }
+        });
+      });
+    });
+  });
+}
+
+function pane(id) {
+  var div = document.getElementById('out-' + id);
+  if (!div) {
+    div = document.createElement('div');
+    div.id = 'out-' + id;
+    div.className = 'pane';
+    document.getElementById('outputs').appendChild(div);
+  }
+  return div;
+}
+
+function bind(div, id) {
+  if (div.bound) return;
+  page.clicks.forEach(function (click) {
+    if (click.graph !== id) return;
+    div.bound = true;
+    div.on('plotly_click', function (event) {
+      state[click.control] = event.points[0][click.field];
+      var control = document.getElementById('control-' + click.control);
+      control.value = page.controls.filter(function (c) { return c.name === click.control; })[0].options
+        .findIndex(function (option) { return JSON.stringify(option[1]) === JSON.stringify(state[click.control]); });
+      update();
+    });
+  });
+}
+
+function update() {
+  page.views.forEach(show);
+}
+
+function controlElement(control) {
+  var fieldset = document.createElement('fieldset');
+  var legend = document.createElement('legend');
+  legend.textContent = control.label;
+  fieldset.appendChild(legend);
+  state[control.name] = control.default;
+  if (control.kind === 'select') {
+    var select = document.createElement('select');
+    select.id = 'control-' + control.name;
+    control.options.forEach(function (option, i) {
+      var el = document.createElement('option');
+      el.value = i;
+      el.textContent = option[0];
+      if (JSON.stringify(option[1]) === JSON.stringify(control.default)) el.selected = true;
+      select.appendChild(el);
+    });
+    select.onchange = function () { state[control.name] = control.options[select.value][1]; update(); };
+    fieldset.appendChild(select);
+  } else {
+    var boxes = control.options.map(function (option) {
+      var label = document.createElement('label'), box = document.createElement('input');
+      box.type = 'checkbox';
+      box.checked = control.default.indexOf(option[1]) >= 0;
+      box.onchange = function () {
+        state[control.name] = control.options.filter(function (o, i) { return boxes[i].checked; })
+          .map(function (o) { return o[1]; });
+        update();
+      };
+      label.appendChild(box);
+      label.appendChild(document.createTextNode(' ' + option[0] + ' '));
+      fieldset.appendChild(label);
+      return box;
+    });
+  }
+  return fieldset;
+}
+
+function openPage(entry) {
+  page = entry;
+  state = {};
+  document.getElementById('title').textContent = page.title;
+  var controls = document.getElementById('controls'), outputs = document.getElementById('outputs');
+  controls.textContent = '';
+  outputs.textContent = '';
+  page.controls.forEach(function (control) { controls.appendChild(controlElement(control)); });
+  page.static.forEach(function (figure, i) {
+    var div = pane('static-' + i);
+    resolve(figure).then(function (value) { plot(div, value); });
+  });
+  page.views.forEach(function (view) { view.outputs.forEach(pane); });
+  update();
+}
+
+load('manifest').then(function (value) {
+  manifest = value;
+  var nav = document.getElementById('nav');
+  manifest.pages.forEach(function (entry) {
+    var link = document.createElement('a');
+    link.textContent = entry.title;
+    link.onclick = function () { openPage(entry); };
+    nav.appendChild(link);
+  });
+  openPage(manifest.pages[0]);
+});
+</script>
+</body>
+</html>
+"""
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', default=DEFAULT_OUT, help='bundle folder')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes')
+    parser.add_argument('--year-step', type=int, default=10, help='years between year range stops')
+    parser.add_argument('--minute-step', type=int, default=10, help='minutes between travel time stops')
+    parser.add_argument('--basemap', action='store_true', help='keep the mapbox basemap (needs a network)')
+    args = parser.parse_args()
+
+    print_report(export(args.out, args.jobs, args.year_step, args.minute_step, args.basemap))
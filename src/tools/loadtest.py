@@ -0,0 +1,313 @@
+"""Replay scripted dashboard sessions against a running server and report callback latency.
+
+Start the app the way it is deployed, then run from the src folder:
+
+    gunicorn --chdir src app:server --workers 4 --threads 2
+    python -m tools.loadtest --label w4-t2 [--url http://127.0.0.1:8000] [--users 1,2,4,8,16] [--duration 60]
+    python -m tools.loadtest --compare ../reports/loadtest/w2-t1.json ../reports/loadtest/w4-t2.json
+
+Each virtual user loops over the sessions below: it opens a page, fires the
+callbacks the browser fires on load, then drags sliders, toggles switches and
+clicks municipalities, posting to `_dash-update-component` with a pause
+between steps. Every concurrency level runs for `--duration` seconds and the
+per-callback p50/p95/p99 latency, throughput and error rate are written to
+`../reports/loadtest/<label>.json`.
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import namedtuple
+
+from tools.payload_report import DEFAULT_INPUTS, job_of, pending, split_outputs, update_payload
+
+#a slider dragged through several positions, each released like a mouseup
+Drag = namedtuple('Drag', ['prop', 'positions'])
+
+#text typed into a searchable dropdown, one search per keystroke
+Typing = namedtuple('Typing', ['prop', 'text'])
+
+#(page path, steps); each step sets one "<component id>.<property>" to a value
+SESSIONS = {
+    'seismicity': ('/', [
+        Drag('slider-year.value', [[1900, 2023], [1930, 2023], [1960, 2023], [1990, 2023]]),
+        Drag('slider-year.value', [[1990, 2015], [1990, 2000]]),
+        Drag('slider-year.value', [[1900, 2023]]),
+    ]),
+    'impact': ('/earthquake-impact', [
+        ('bar-chart-total.clickData', {'points': [{'y': 'Quezon'}]}),
+        ('impact-radios.value', 'Economic Loss'),
+        ('choropleth-map.clickData', {'points': [{'location': 'Manila'}]}),
+        ('rate-radios.value', 'normalized'),
+        ('choropleth-map.clickData', {'points': [{'location': 'Marikina'}]}),
+        ('bar-chart-total.clickData', {'points': [{'y': 'Pasig'}]}),
+    ]),
+    'healthcare': ('/healthcare-access', [
+        Drag('my_slider.value', [25, 20, 15]),
+        ('risk_type_dropdown.value', ['High Potential', 'Moderate Potential']),
+        Typing('barangay_dropdown.search_value', 'manila 1'),
+        ('barangay_dropdown.value', 'Barangay 1 | (Manila)'),
+        Drag('my_slider.value', [20, 30, 45]),
+        ('risk_type_dropdown.value', ['High Potential']),
+    ]),
+    'accessibility': ('/accessibility-score', [
+        Drag('my_slider.value', [35, 40]),
+        ('risk_type_dropdown.value', ['High Potential', 'Moderate Potential']),
+        ('level_radios.value', 'Level 3'),
+        Drag('my_slider.value', [30]),
+        ('risk_type_dropdown.value', ['High Potential']),
+    ]),
+}
+
+#share of users on each session, roughly the traffic of each page
+SESSION_WEIGHTS = {'seismicity': 4, 'impact': 3, 'healthcare': 2, 'accessibility': 1}
+
+#seconds between steps; a drag sends its values this many times faster
+THINK_SECONDS = 2.0
+DRAG_SPEEDUP = 8
+
+REPORT_DIR = os.path.join('..', 'reports', 'loadtest')
+
+PERCENTILES = (50, 95, 99)
+
+
+class Client:
+    """Posts callbacks like the browser does, following background callbacks until they finish."""
+
+    def __init__(self, url, timeout=300):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers={
+            'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, body, encoding = response.status, response.read(), response.headers.get('Content-Encoding')
+        except urllib.error.HTTPError as error:
+            status, body, encoding = error.code, error.read(), error.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        return status, body
+
+    def update(self, payload):
+        url = '/_dash-update-component'
+        status, body = self.request(url, payload)
+        #a background callback answers 200 with its job; the latency recorded is up to the job's outputs
+        job = job_of(status, body)
+        if job is None:
+            return status, body
+
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            time.sleep(0.2)
+            status, body = self.request(f"{url}?cacheKey={job['cacheKey']}&job={job['job']}", payload)
+            if not pending(status, body):
+                return status, body
+        raise TimeoutError(f"background job {job['job']} did not finish")
+
+
+def load_callbacks(client):
+    """Server-side callbacks from the app's dependency list, keyed by output."""
+    status, body = client.request('/_dash-dependencies')
+    if status != 200:
+        raise RuntimeError(f'/_dash-dependencies returned {status}')
+    callbacks = {}
+    for spec in json.loads(body):
+        #clientside and pattern-matching callbacks are not posted by these sessions
+        if spec.get('clientside_function') or '{' in spec['output']:
+            continue
+        callbacks[spec['output']] = spec
+    return callbacks
+
+
+def callback_name(output_key):
+    return ', '.join(f"{output['id']}.{output['property']}" for output in split_outputs(output_key))
+
+
+class Recorder:
+    """Latency and outcome of every callback, shared by the users of one level."""
+
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(name, []).append((seconds, ok))
+
+
+class User:
+    """One browser tab: the values of its page's components and the callbacks they fire."""
+
+    def __init__(self, client, callbacks, recorder, rng):
+        self.client = client
+        self.callbacks = callbacks
+        self.recorder = recorder
+        self.rng = rng
+
+    def fire(self, output_key, changed):
+        payload = update_payload(output_key, self.callbacks[output_key], self.values)
+        payload['changedPropIds'] = [changed] if changed else []
+        start = time.perf_counter()
+        try:
+            status, body = self.client.update(payload)
+            ok = status < 400
+        except Exception:
+            status, body, ok = None, b'', False
+        self.recorder.add(callback_name(output_key), time.perf_counter() - start, ok)
+        return body if ok else b''
+
+    def open_page(self, path):
+        self.values = dict(DEFAULT_INPUTS, **{'_pages_location.pathname': path})
+        body = b''
+        for output_key in self.callbacks:
+            if '_pages_content' in output_key:
+                body = self.fire(output_key, '_pages_location.pathname')
+        self.ids = set(re.findall(r'"id":\s*"([^"]+)"', body.decode('utf-8', 'replace')))
+
+        #the callbacks the browser fires once the layout is rendered
+        for output_key, spec in self.callbacks.items():
+            if not spec.get('prevent_initial_call') and self.on_page(output_key):
+                self.fire(output_key, None)
+
+    def on_page(self, output_key):
+        return all(output['id'] in self.ids for output in split_outputs(output_key))
+
+    def set(self, prop, value):
+        self.values[prop] = value
+        for output_key, spec in self.callbacks.items():
+            inputs = {f"{item['id']}.{item['property']}" for item in spec['inputs']}
+            if prop in inputs and self.on_page(output_key):
+                self.fire(output_key, prop)
+
+    def think(self, seconds):
+        time.sleep(self.rng.uniform(0.5, 1.5) * seconds)
+
+    def run_session(self, name):
+        path, steps = SESSIONS[name]
+        self.open_page(path)
+        for step in steps:
+            self.think(THINK_SECONDS)
+            if isinstance(step, Drag):
+                for i, position in enumerate(step.positions):
+                    if i:
+                        self.think(THINK_SECONDS / DRAG_SPEEDUP)
+                    self.set(step.prop, position)
+            elif isinstance(step, Typing):
+                for i in range(1, len(step.text) + 1):
+                    if i > 1:
+                        self.think(THINK_SECONDS / DRAG_SPEEDUP)
+                    self.set(step.prop, step.text[:i])
+            else:
+                self.set(*step)
+
+
+def run_level(client, callbacks, users, duration, seed=0):
+    recorder = Recorder()
+    names = list(SESSION_WEIGHTS)
+    weights = [SESSION_WEIGHTS[name] for name in names]
+    deadline = time.time() + duration
+
+    def loop(i):
+        rng = random.Random(seed * 1000 + i)
+        user = User(client, callbacks, recorder, rng)
+        while time.time() < deadline:
+            user.run_session(rng.choices(names, weights)[0])
+
+    threads = [threading.Thread(target=loop, args=(i,), daemon=True) for i in range(users)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(recorder.samples, time.time() - start)
+
+
+def percentile(values, q):
+    #nearest rank
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summarize(samples, elapsed):
+    rows = {}
+    every = [record for records in samples.values() for record in records]
+    for name, records in sorted(samples.items()) + ([('all callbacks', every)] if every else []):
+        latencies = [seconds for seconds, _ in records]
+        errors = sum(1 for _, ok in records if not ok)
+        rows[name] = {'requests': len(records),
+                      'throughput': len(records) / elapsed,
+                      'error_rate': errors / len(records),
+                      **{f'p{q}_ms': 1000 * percentile(latencies, q) for q in PERCENTILES}}
+    return rows
+
+
+def print_level(users, rows):
+    header = f"{'users':>5}  {'callback':<60}{'req':>7}{'req/s':>8}{'err':>7}" + ''.join(f"{f'p{q} ms':>10}" for q in PERCENTILES)
+    print(header)
+    print('-' * len(header))
+    for name, row in rows.items():
+        print(f"{users:>5}  {name[:59]:<60}{row['requests']:>7}{row['throughput']:>8.2f}{row['error_rate']:>7.1%}"
+              + ''.join(f"{row[f'p{q}_ms']:>10.0f}" for q in PERCENTILES))
+    print()
+
+
+def compare(paths):
+    """p95 and throughput of each callback and level, one column per saved run."""
+    runs = []
+    for path in paths:
+        with open(path) as f:
+            runs.append(json.load(f))
+    keys = sorted({(int(users), name) for run in runs for users, rows in run['levels'].items() for name in rows})
+
+    header = f"{'users':>5}  {'callback':<50}" + ''.join(f"{run['label'][:20]:>22}" for run in runs)
+    print(header)
+    print(f"{'':>57}" + ''.join(f"{'p95 ms / req/s':>22}" for _ in runs))
+    print('-' * len(header))
+    for users, name in keys:
+        cells = []
+        for run in runs:
+            row = run['levels'].get(str(users), {}).get(name)
+            cells.append(f"{row['p95_ms']:>12.0f} / {row['throughput']:>6.2f}" if row else f"{'-':>22}")
+        print(f"{users:>5}  {name[:49]:<50}" + ''.join(f"{cell:>22}" for cell in cells))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='server to load')
+    parser.add_argument('--users', default='1,2,4,8,16', help='comma-separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=60, help='seconds per level')
+    parser.add_argument('--label', help='name of the server configuration, e.g. w4-t2')
+    parser.add_argument('--out', help=f'results file (default {REPORT_DIR}/<label>.json)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', nargs='+', metavar='RESULTS', help='compare saved results instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        raise SystemExit
+
+    client = Client(args.url)
+    callbacks = load_callbacks(client)
+    label = args.label or time.strftime('%Y%m%d-%H%M%S')
+    results = {'label': label, 'url': args.url, 'duration': args.duration,
+               'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'levels': {}}
+    for users in [int(n) for n in args.users.split(',')]:
+        rows = run_level(client, callbacks, users, args.duration, args.seed)
+        results['levels'][str(users)] = rows
+        print_level(users, rows)
+
+    out = args.out or os.path.join(REPORT_DIR, f'{label}.json')
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'wrote {out}')
@@ -0,0 +1,203 @@
+"""Byte counts of each page's initial layout and callback responses.
+
+Run from the src folder:
+
+    python -m tools.payload_report [--json ../reports/payload_sizes.json]
+
+The app is loaded twice in subprocesses, once with COMPACT_FIGURES=0 (plain
+plotly JSON, the "before") and once with the encoding layer enabled. Every
+response is fetched uncompressed, gzip and brotli.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+#input values used to fire each callback, keyed by "<component id>.<property>"
+DEFAULT_INPUTS = {
+    '_pages_location.pathname': None,
+    '_pages_location.search': '',
+    'slider-year.value': [1900, 2023],
+    'switches-input.value': ['Population', 'Hospitals', 'Fault Lines'],
+    'buffer-radios.value': 5,
+    'impact-radios.value': 'Building Damage',
+    'rate-radios.value': 'total',
+    'bar-chart-total.clickData': None,
+    'choropleth-map.clickData': None,
+    'tabs.active_tab': 'tab-1',
+    'exposure-radios.value': 'All',
+    'risk_type_dropdown.value': ['High Potential'],
+    'my_slider.value': 30,
+    'road_scenario.value': False,
+    'level_radios.value': 'All Hospitals',
+    'hour_dropdown.value': 'free',
+    'map_layer.value': 'Score',
+    'barangay_dropdown.value': 'Barangay 100 | (Caloocan)',
+    'surge_zones.value': ['High Potential'],
+    'surge_roads.value': False,
+    'surge_baseline.value': 70,
+    'surge_hour.value': 24,
+}
+
+ENCODINGS = ('identity', 'gzip', 'br')
+
+
+def split_outputs(output_key):
+    #multi-output callbacks are keyed as "..a.prop...b.prop.."
+    if output_key.startswith('..'):
+        parts = output_key[2:-2].split('...')
+    else:
+        parts = [output_key]
+    return [dict(zip(('id', 'property'), part.rsplit('.', 1))) for part in parts]
+
+
+def update_payload(output_key, spec, values):
+    outputs = split_outputs(output_key)
+    inputs = [{**item, 'value': values.get(f"{item['id']}.{item['property']}")}
+              for item in spec['inputs']]
+    state = [{**item, 'value': values.get(f"{item['id']}.{item['property']}")}
+             for item in spec.get('state', [])]
+    return {
+        'output': output_key,
+        'outputs': outputs if len(outputs) > 1 else outputs[0],
+        'inputs': inputs,
+        'changedPropIds': [f"{inputs[0]['id']}.{inputs[0]['property']}"] if inputs else [],
+        'state': state,
+    }
+
+
+def _body(status, data):
+    if status != 200 or not data:
+        return {}
+    try:
+        body = json.loads(data)
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def job_of(status, data):
+    """The {cacheKey, job} a background callback answers with, or None for a plain response."""
+    body = _body(status, data)
+    return body if 'cacheKey' in body else None
+
+
+def pending(status, data):
+    """Whether a poll of a background job answered before the job finished."""
+    return status == 200 and 'response' not in _body(status, data)
+
+
+def post_update(client, payload, headers, timeout=300):
+    """POST a callback, polling background callbacks until their job finishes.
+
+    A background callback answers 200 with the job's cacheKey instead of the
+    outputs; polls answer 200 without a 'response' until the job is done,
+    then with the outputs (or 204 when it updates nothing).
+    """
+    url = '/_dash-update-component'
+    response = client.post(url, json=payload, headers=headers)
+    job = job_of(response.status_code, response.get_data())
+    if job is None:
+        return response
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(0.2)
+        response = client.post(f"{url}?cacheKey={job['cacheKey']}&job={job['job']}",
+                               json=payload, headers=headers)
+        if not pending(response.status_code, response.get_data()):
+            return response
+    raise TimeoutError(f"background job {job['job']} did not finish")
+
+
+def response_sizes(client, payload):
+    sizes = {}
+    for encoding in ENCODINGS:
+        response = post_update(client, payload, headers={'Accept-Encoding': encoding})
+        if response.status_code >= 400:
+            raise RuntimeError(f"{payload['output']} returned {response.status_code}")
+        sizes[encoding] = len(response.get_data())
+    return sizes
+
+
+def measure():
+    #imported lazily so the parent process never loads the data
+    sys.path.insert(0, os.getcwd())
+    import dash
+    from plotly.io.json import to_json_plotly
+    from app import app
+
+    client = app.server.test_client()
+    client.get('/')
+
+    results = {}
+    for page in dash.page_registry.values():
+        values = dict(DEFAULT_INPUTS, **{'_pages_location.pathname': page['path']})
+        page_results = {}
+
+        layout = page['layout']() if callable(page['layout']) else page['layout']
+        ids = set(re.findall(r'"id":\s*"([^"]+)"', to_json_plotly(layout)))
+        ids.update(('_pages_content', '_pages_store'))
+
+        for output_key, spec in app.callback_map.items():
+            outputs = split_outputs(output_key)
+            if not all(output['id'] in ids for output in outputs):
+                continue
+            if output_key.startswith('..') and '_pages_content' in output_key:
+                name = 'initial layout'
+            else:
+                name = spec['callback'].__name__ if 'callback' in spec else output_key
+            payload = update_payload(output_key, spec, values)
+            page_results[name] = response_sizes(client, payload)
+        results[page['path']] = page_results
+    return results
+
+
+def run_variant(compact):
+    env = dict(os.environ, COMPACT_FIGURES='1' if compact else '0')
+    output = subprocess.run([sys.executable, '-m', 'tools.payload_report', '--measure'],
+                            env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(before, after):
+    rows = []
+    for path, callbacks in after.items():
+        for name, sizes in callbacks.items():
+            base = before.get(path, {}).get(name, {})
+            rows.append({'page': path, 'response': name,
+                         'before': base.get('identity'),
+                         'after': sizes['identity'],
+                         'after_gzip': sizes['gzip'],
+                         'after_br': sizes['br']})
+    return rows
+
+
+def print_table(rows):
+    header = f"{'page':<26}{'response':<24}{'before':>12}{'after':>12}{'gzip':>12}{'br':>12}{'ratio':>8}"
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        ratio = row['before'] / row['after_br'] if row['before'] and row['after_br'] else float('nan')
+        print(f"{row['page']:<26}{row['response']:<24}{row['before'] or 0:>12,}{row['after']:>12,}"
+              f"{row['after_gzip']:>12,}{row['after_br']:>12,}{ratio:>7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--json', help='also write the rows to this file')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure()))
+        sys.exit(0)
+
+    rows = report(run_variant(compact=False), run_variant(compact=True))
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
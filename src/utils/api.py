@@ -0,0 +1,271 @@
+"""Read-only JSON API over the dashboard's accessibility scores and reachable hospitals.
+
+    GET /api/v1/accessibility?potentials=High Potential,Low Potential&tau=30
+    GET /api/v1/barangays/<brgy_index>/hospitals?potentials=High Potential&minutes=30
+    GET /api/v1/locate?lat=14.5995&lon=120.9842
+    POST /api/v1/locate  {"lat": [...], "lon": [...]}
+
+They take `roads=1` for damaged roads in the selected zones, `hour=0..23`
+for the hourly travel times, `fields=a,b` to pick the fields of each item
+and `offset`/`limit` to page through them; locate answers every point at
+once, with the barangays they fall in listed once each. Answers come from the same
+computations as the pages (the RAAM solution cache and singleflight, the
+reach indexes of the generation), so a query the dashboard already ran is
+not run again.
+
+A response depends only on the generation of the artifacts and the query,
+so its ETag is derived from those before anything is computed: a request
+with a matching If-None-Match gets a 304 straight away, and Cache-Control
+lets clients and a reverse proxy reuse responses for API_MAX_AGE seconds.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from flask import Response, jsonify, request
+
+from utils import datastore
+from utils import hourly
+from utils import scenario
+from utils.exposure import POTENTIALS
+
+PREFIX = '/api/v1'
+
+#seconds clients and proxies may reuse a response; a new generation changes every ETag
+MAX_AGE = int(os.environ.get('API_MAX_AGE', 300))
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+#same range as the travel-time sliders, so cached solutions are shared with the dashboard
+MAX_MINUTES = 60
+
+#points resolved per locate request, and nearest hospitals listed per barangay
+MAX_POINTS = 100000
+NEAREST_HOSPITALS = 3
+
+ACCESSIBILITY_FIELDS = ['brgy_index', 'barangay', 'city', 'population',
+                        'score_all_hospitals', 'score_level_2_and_3', 'score_level_3']
+HOSPITAL_FIELDS = ['hospital_index', 'facility_name', 'service_capability', 'bed_capacity',
+                   'potential', 'duration_minutes', 'lat', 'lon']
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _potentials():
+    values = [v.strip() for v in request.args.get('potentials', '').split(',') if v.strip()]
+    unknown = sorted(set(values) - set(POTENTIALS))
+    if unknown:
+        raise QueryError(f'unknown potentials {unknown}, expected some of {POTENTIALS}')
+    return sorted(set(values))
+
+
+def _integer(name, default, low, high):
+    value = request.args.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise QueryError(f'{name} must be an integer')
+    if not low <= value <= high:
+        raise QueryError(f'{name} must be between {low} and {high}')
+    return value
+
+
+def _hour():
+    if request.args.get('hour') in (None, '', hourly.FREE_FLOW):
+        return None
+    return hourly.selected_hour(_integer('hour', None, 0, hourly.HOURS - 1))
+
+
+def _fields(available):
+    fields = [v.strip() for v in request.args.get('fields', '').split(',') if v.strip()] or available
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise QueryError(f'unknown fields {unknown}, expected some of {available}')
+    return fields
+
+
+def _etag():
+    #the answer is a function of the generation and the query, known before computing it
+    query = sorted((key, value) for key, value in request.args.items(multi=True))
+    payload = json.dumps([datastore.version(), request.path, query])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def _not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}'
+    return response
+
+
+def _page(items, fields, etag):
+    offset = _integer('offset', 0, 0, len(items))
+    limit = _integer('limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+    page = [{field: item[field] for field in fields} for item in items[offset:offset + limit]]
+    response = jsonify({'generation': datastore.version(),
+                        'total': len(items),
+                        'offset': offset,
+                        'limit': limit,
+                        'items': page})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}'
+    return response
+
+
+def _records(frame):
+    #plain Python values; categoricals and numpy scalars don't go through json as is
+    return json.loads(frame.to_json(orient='records'))
+
+
+def accessibility_items(excluded_potentials, tau, damaged_roads, hour):
+    from pages import accessibility
+
+    snapshot = accessibility.dataset.current()
+    scores = accessibility.solve_raam(excluded_potentials, tau * 60, 'score', damaged_roads, hour)
+    #one column per supply level, renamed after the level; the frame is shared, so it is not modified
+    names = [f'score_{level.lower().replace(" ", "_")}' for level in accessibility.supply_levels]
+    scores = scores.rename(columns=dict(zip(scores.columns, names)))
+    brgy = snapshot.ncr_boundary_pop.set_index('brgy_index')[['barangay', 'city', 'population']]
+    #barangays without travel times are listed with null scores
+    return _records(brgy.join(scores, how='left').reset_index().round(6))
+
+
+def _hospital_records(snapshot):
+    hospitals = snapshot.ncr_hosp.drop_duplicates('hospital_index').set_index('hospital_index')
+    hospitals = hospitals.assign(lat=hospitals.geometry.y.round(6), lon=hospitals.geometry.x.round(6))
+    columns = [field for field in HOSPITAL_FIELDS if field not in ('hospital_index', 'duration_minutes')]
+    return {record.pop('hospital_index'): record for record in _records(hospitals[columns].reset_index())}
+
+
+def _reachable(reach, records, count=None):
+    return [dict(records[hospital_index], hospital_index=hospital_index, duration_minutes=round(duration / 60, 2))
+            for hospital_index, duration in zip(reach.hospital_index[:count].tolist(), reach.duration[:count].tolist())]
+
+
+def hospital_items(brgy_index, excluded_potentials, minutes, damaged_roads, hour):
+    from pages import brgy_hospital
+
+    snapshot = brgy_hospital.dataset.current()
+    if not (snapshot.ncr_boundary_pop['brgy_index'] == brgy_index).any():
+        raise KeyError(brgy_index)
+    #barangays without travel times reach no hospital
+    reach = (brgy_hospital.get_reach_index(snapshot, excluded_potentials, damaged_roads, hour)
+             .query(brgy_index, minutes, excluded_potentials))
+    return _reachable(reach, _hospital_records(snapshot))
+
+
+def locate_items(lon, lat, excluded_potentials, tau, minutes, damaged_roads, hour, count):
+    """Barangay and liquefaction zone of every point, and the scores and nearest hospitals of each barangay."""
+    from pages import brgy_hospital
+
+    snapshot = brgy_hospital.dataset.current()
+    location = snapshot.barangay_locator.locate(lon, lat)
+
+    items = [{'lat': y, 'lon': x, 'brgy_index': b if b >= 0 else None, 'liquefaction_potential': p}
+             for x, y, b, p in zip(lon.tolist(), lat.tolist(), location.brgy_index.tolist(),
+                                   location.potential.tolist())]
+
+    found = np.unique(location.brgy_index[location.brgy_index >= 0]).tolist()
+    barangays = {}
+    if found:
+        scores = {record['brgy_index']: record
+                  for record in accessibility_items(excluded_potentials, tau, damaged_roads, hour)}
+        reach_index = brgy_hospital.get_reach_index(snapshot, excluded_potentials, damaged_roads, hour)
+        records = _hospital_records(snapshot)
+        for brgy_index in found:
+            reach = reach_index.query(brgy_index, minutes, excluded_potentials)
+            hospitals = _reachable(reach, records, count)
+            barangays[str(brgy_index)] = dict(scores.get(brgy_index, {'brgy_index': brgy_index}),
+                                              hospitals=hospitals)
+    return items, barangays
+
+
+def accessibility_view():
+    etag = _etag()
+    if etag in request.if_none_match:
+        return _not_modified(etag)
+    excluded_potentials = _potentials()
+    tau = _integer('tau', 30, 0, MAX_MINUTES)
+    fields = _fields(ACCESSIBILITY_FIELDS)
+    damaged_roads = request.args.get('roads') == '1' and scenario.available()
+    items = accessibility_items(excluded_potentials, tau, damaged_roads, _hour())
+    return _page(items, fields, etag)
+
+
+def hospitals_view(brgy_index):
+    etag = _etag()
+    if etag in request.if_none_match:
+        return _not_modified(etag)
+    excluded_potentials = _potentials()
+    minutes = _integer('minutes', 30, 0, MAX_MINUTES)
+    fields = _fields(HOSPITAL_FIELDS)
+    damaged_roads = request.args.get('roads') == '1' and scenario.available()
+    try:
+        items = hospital_items(brgy_index, excluded_potentials, minutes, damaged_roads, _hour())
+    except KeyError:
+        response = jsonify({'error': f'unknown barangay {brgy_index}'})
+        response.status_code = 404
+        return response
+    return _page(items, fields, etag)
+
+
+def _coordinates(lat, lon):
+    if lat is None or lon is None:
+        raise QueryError('lat and lon are required')
+    try:
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+    except (TypeError, ValueError):
+        raise QueryError('lat and lon must be numbers or lists of numbers')
+    if lat.ndim != 1 or lat.shape != lon.shape or not len(lat):
+        raise QueryError('lat and lon must have the same number of values')
+    if len(lat) > MAX_POINTS:
+        raise QueryError(f'at most {MAX_POINTS} points per request')
+    if not (np.isfinite(lat).all() and np.isfinite(lon).all()):
+        raise QueryError('lat and lon must be finite')
+    return lat, lon
+
+
+def locate_view():
+    etag = None
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        lat, lon = _coordinates(body.get('lat'), body.get('lon'))
+    else:
+        etag = _etag()
+        if etag in request.if_none_match:
+            return _not_modified(etag)
+        lat, lon = _coordinates(request.args.get('lat'), request.args.get('lon'))
+    excluded_potentials = _potentials()
+    tau = _integer('tau', 30, 0, MAX_MINUTES)
+    minutes = _integer('minutes', 30, 0, MAX_MINUTES)
+    count = _integer('hospitals', NEAREST_HOSPITALS, 0, MAX_LIMIT)
+    damaged_roads = request.args.get('roads') == '1' and scenario.available()
+    items, barangays = locate_items(lon, lat, excluded_potentials, tau, minutes, damaged_roads, _hour(), count)
+
+    response = jsonify({'generation': datastore.version(),
+                        'total': len(items),
+                        'items': items,
+                        'barangays': barangays})
+    #batches are posted and not cached; single points are cached like the other endpoints
+    if etag is not None:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}'
+    return response
+
+
+def _bad_request(error):
+    response = jsonify({'error': str(error)})
+    response.status_code = 400
+    return response
+
+
+def init_api(server, prefix=PREFIX):
+    server.add_url_rule(f'{prefix}/accessibility', 'api_accessibility', accessibility_view)
+    server.add_url_rule(f'{prefix}/barangays/<int:brgy_index>/hospitals', 'api_hospitals', hospitals_view)
+    server.add_url_rule(f'{prefix}/locate', 'api_locate', locate_view, methods=['GET', 'POST'])
+    server.register_error_handler(QueryError, _bad_request)
@@ -0,0 +1,298 @@
+"""Earthquake catalog as a year-partitioned Parquet store, grown one export at a time.
+
+Drop USGS or PHIVOLCS CSV exports in data/raw/catalog and run from the src folder:
+
+    python -m utils.catalog [--inbox ../data/raw/catalog] [--dry-run]
+
+Only files not seen before are read. Their events are kept to the catalog's
+scope (M5.0 and above within 500 km of Metro Manila), events matching one
+already stored within the time, distance and magnitude tolerances are
+dropped (the same earthquake in both agencies' exports, or overlapping
+exports), and the rest are appended as a new file in each year's
+partition. The yearly counts are updated from the appended events only and
+the rate table is recomputed from them, so the history is never read again
+except for the years the new events fall in.
+The first run seeds the store from earthquake_data.csv.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.stats import poisson
+
+from pipeline.core import atomic_output
+from utils.exposure import ANALYTICS_DIR
+
+CATALOG_NAME = 'earthquake_catalog'
+CATALOG_DIR = os.path.join(ANALYTICS_DIR, CATALOG_NAME)
+INGESTED = os.path.join(CATALOG_DIR, '_ingested.json')
+SEED = os.path.join(ANALYTICS_DIR, 'earthquake_data.csv')
+INBOX = '../data/raw/catalog'
+YEARLY_COUNTS = os.path.join(ANALYTICS_DIR, 'eq_yearly_counts.csv')
+RATES = os.path.join(ANALYTICS_DIR, 'eq_rate_df.csv')
+
+#columns of earthquake_data.csv, in the order the Seismicity page's hover labels expect
+COLUMNS = ['latitude', 'longitude', 'mag', 'magType', 'time', 'place', 'depth', 'mag_group', 'date']
+
+#catalog scope: significant earthquakes around the Seismicity map's center
+MIN_MAGNITUDE = 5.0
+CENTER = (14.5826, 120.9787)
+RADIUS_KM = 500
+EARTH_RADIUS_KM = 6371
+
+#two reports are the same earthquake if this close in time, epicenter and magnitude
+TIME_TOLERANCE_SECONDS = 60
+DISTANCE_TOLERANCE_KM = 50
+MAGNITUDE_TOLERANCE = 0.5
+
+#PHIVOLCS exports are in Philippine time, USGS exports in UTC
+LOCAL_TIMEZONE = 'Asia/Manila'
+
+#yearly rate over the years from this one; with the 2023 snapshot it gives the shipped 8.76 a year
+RATE_START_YEAR = 1902
+MAX_EVENTS_PER_YEAR = 15
+
+#export headers, lowercased and without units in parentheses, first match wins
+ALIASES = {'time': ('time', 'date - time', 'date-time', 'datetime', 'date_time', 'origin time'),
+           'latitude': ('latitude', 'lat'),
+           'longitude': ('longitude', 'lon', 'long'),
+           'depth': ('depth',),
+           'mag': ('mag', 'magnitude'),
+           'magType': ('magtype', 'mag type', 'magnitude type'),
+           'place': ('place', 'location', 'region')}
+
+
+def mag_group(mag):
+    whole = np.clip(np.floor(mag), 5, 9).astype(int)
+    return pd.Series([f'{m}.0-{m}.9' for m in whole], index=getattr(mag, 'index', None))
+
+
+def year_range(events):
+    """Slider range of the catalog: from the decade of the first event to the year of the last."""
+    years = events['time'].dt.year
+    return int(years.min()) // 10 * 10, int(years.max())
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(h))
+
+
+def _to_datetime(values, **kwargs):
+    times = pd.to_datetime(values, errors='coerce', **kwargs)
+    #pandas 2 infers one format from the first value, so times with and without
+    #fractional seconds in the same export are parsed again one by one
+    missed = times.isna() & values.notna()
+    if missed.any():
+        times = times.astype(object)
+        times[missed] = [pd.to_datetime(value, errors='coerce', **kwargs) for value in values[missed]]
+        times = pd.to_datetime(times, **kwargs)
+    return times
+
+
+def parse_times(values, local=False):
+    """UTC times of a column of catalog times; `local` ones without an offset are Philippine time."""
+    values = values.astype(str).str.replace(r'\s+-\s+', ' ', regex=True)
+    if not local:
+        return _to_datetime(values, utc=True)
+    times = _to_datetime(values)
+    if times.dt.tz is None:
+        times = times.dt.tz_localize(LOCAL_TIMEZONE, ambiguous='NaT', nonexistent='NaT')
+    return times.dt.tz_convert('UTC')
+
+
+def read_export(path):
+    """Events of a catalog export in the columns of earthquake_data.csv, unparseable rows dropped."""
+    raw = pd.read_csv(path)
+    headers = {re.sub(r'\s*\(.*?\)', '', column).strip().lower(): column for column in raw.columns}
+    if 'type' in headers:
+        raw = raw.loc[raw[headers['type']].astype(str).str.lower() == 'earthquake']
+
+    columns = {}
+    for name, aliases in ALIASES.items():
+        found = next((headers[alias] for alias in aliases if alias in headers), None)
+        columns[name] = raw[found] if found is not None else pd.Series(np.nan, index=raw.index)
+
+    local = 'philippine' in str(next((headers[a] for a in ALIASES['time'] if a in headers), '')).lower()
+    events = pd.DataFrame({
+        'latitude': pd.to_numeric(columns['latitude'], errors='coerce'),
+        'longitude': pd.to_numeric(columns['longitude'], errors='coerce'),
+        'mag': pd.to_numeric(columns['mag'], errors='coerce').round(1),
+        #text columns typed as strings, so a file without them stores strings like the others
+        'magType': columns['magType'].astype('string'),
+        'time': parse_times(columns['time'], local),
+        'place': columns['place'].astype('string'),
+        'depth': pd.to_numeric(columns['depth'], errors='coerce'),
+    })
+    events = events.dropna(subset=['latitude', 'longitude', 'mag', 'time']).reset_index(drop=True)
+    events['mag_group'] = mag_group(events['mag'])
+    events['date'] = events['time'].dt.strftime('%Y-%b-%d')
+    return events[COLUMNS]
+
+
+def in_scope(events):
+    distance = _haversine_km(CENTER[0], CENTER[1], events['latitude'].to_numpy(), events['longitude'].to_numpy())
+    return events.loc[(events['mag'].to_numpy() >= MIN_MAGNITUDE) & (distance <= RADIUS_KM)]
+
+
+def _keys(events):
+    return (events['time'].astype('int64').to_numpy() / 1e9, events['latitude'].to_numpy(),
+            events['longitude'].to_numpy(), events['mag'].to_numpy())
+
+
+def _window_pairs(times, reference_times, tolerance):
+    """(event, reference) positions within `tolerance` seconds of each other; reference_times sorted."""
+    lo = np.searchsorted(reference_times, times - tolerance, side='left')
+    hi = np.searchsorted(reference_times, times + tolerance, side='right')
+    counts = hi - lo
+    events = np.repeat(np.arange(len(times)), counts)
+    starts = np.cumsum(counts) - counts
+    references = np.arange(counts.sum()) - np.repeat(starts, counts) + np.repeat(lo, counts)
+    return events, references
+
+
+def _same(a, b, pairs_a, pairs_b):
+    _, lat_a, lon_a, mag_a = a
+    _, lat_b, lon_b, mag_b = b
+    return ((np.abs(mag_a[pairs_a] - mag_b[pairs_b]) <= MAGNITUDE_TOLERANCE) &
+            (_haversine_km(lat_a[pairs_a], lon_a[pairs_a], lat_b[pairs_b], lon_b[pairs_b]) <= DISTANCE_TOLERANCE_KM))
+
+
+def deduplicate(events, stored):
+    """`events` without those matching a stored event, and how many were dropped.
+
+    Rows of one export are taken as distinct earthquakes, as the agency lists
+    them: aftershocks can come seconds apart and a few kilometers away.
+    """
+    events = events.sort_values('time', ignore_index=True)
+    duplicate = np.zeros(len(events), dtype=bool)
+    if len(stored):
+        keys = _keys(events)
+        stored_keys = _keys(stored.sort_values('time', ignore_index=True))
+        e, r = _window_pairs(keys[0], stored_keys[0], TIME_TOLERANCE_SECONDS)
+        duplicate[e[_same(keys, stored_keys, e, r)]] = True
+    return events.loc[~duplicate].reset_index(drop=True), int(duplicate.sum())
+
+
+def _partition(year, directory=CATALOG_DIR):
+    return os.path.join(directory, f'year={year}')
+
+
+def stored_events(years, directory=CATALOG_DIR):
+    """Stored events of the given years, only the columns compared for duplicates."""
+    frames = [pd.read_parquet(_partition(year, directory), columns=['time', 'latitude', 'longitude', 'mag'])
+              for year in sorted(set(years)) if os.path.isdir(_partition(year, directory))]
+    if not frames:
+        return pd.DataFrame({'time': pd.Series(dtype='datetime64[ns, UTC]'), 'latitude': [], 'longitude': [],
+                             'mag': []})
+    return pd.concat(frames, ignore_index=True)
+
+
+def append(events, source, directory=CATALOG_DIR):
+    """Write the events as one new file per year partition."""
+    batch = f'{time.time_ns():x}'
+    events = events.assign(source=os.path.basename(source))
+    for year, part in events.groupby(events['time'].dt.year):
+        with atomic_output(os.path.join(_partition(year, directory), f'part-{batch}.parquet')) as tmp_path:
+            part.to_parquet(tmp_path, index=False)
+
+
+def update_counts(events, path=YEARLY_COUNTS):
+    """Yearly counts per magnitude group, with the appended events added."""
+    added = events.groupby([events['time'].dt.year.rename('year'),
+                            events['mag_group'].astype(str)]).size().rename('count')
+    if os.path.exists(path):
+        added = pd.read_csv(path, index_col=['year', 'mag_group'])['count'].add(added, fill_value=0)
+    counts = added.astype(int).sort_index().reset_index()
+    with atomic_output(path) as tmp_path:
+        counts.to_csv(tmp_path, index=False)
+    return counts
+
+
+def recount(directory=CATALOG_DIR, path=YEARLY_COUNTS):
+    """Yearly counts rebuilt from the whole store, after an interrupted ingestion."""
+    if os.path.exists(path):
+        os.remove(path)
+    return update_counts(pd.read_parquet(directory, columns=['time', 'mag_group']), path)
+
+
+def rate_table(counts, start_year=RATE_START_YEAR, max_events=MAX_EVENTS_PER_YEAR):
+    """Poisson probabilities of 0..max_events significant earthquakes in a year."""
+    last_year = int(counts['year'].max())
+    rate = counts.loc[counts['year'] >= start_year, 'count'].sum() / (last_year - start_year + 1)
+    no_eq = np.arange(max_events + 1)
+    return pd.DataFrame({'no_eq': no_eq, 'p': poisson.pmf(no_eq, rate)})
+
+
+def write_rates(counts, path=RATES):
+    with atomic_output(path) as tmp_path:
+        rate_table(counts).to_csv(tmp_path, index=False)
+
+
+def _sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _ingested(path=INGESTED):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def ingest(paths, dry_run=False):
+    """Append the events of every file not ingested before; returns the number appended."""
+    ingested = _ingested()
+    seen = set(ingested.values())
+    appended = 0
+    for path in paths:
+        digest = _sha1(path)
+        if digest in seen:
+            continue
+        events = read_export(path)
+        scoped = in_scope(events)
+        new, duplicates = deduplicate(scoped, stored_events(np.concatenate([
+            scoped['time'].dt.year.to_numpy() + offset for offset in (-1, 0, 1)])))
+        print(f'{os.path.basename(path)}: {len(events):,} events, {len(events) - len(scoped):,} out of scope, '
+              f'{duplicates:,} duplicates, {len(new):,} new')
+        if dry_run:
+            continue
+        if len(new):
+            append(new, path)
+            write_rates(update_counts(new))
+        ingested[os.path.basename(path)] = digest
+        seen.add(digest)
+        os.makedirs(CATALOG_DIR, exist_ok=True)
+        with atomic_output(INGESTED) as tmp_path, open(tmp_path, 'w') as f:
+            json.dump(ingested, f, indent=2)
+        appended += len(new)
+    return appended
+
+
+if __name__ == '__main__':
+    from utils.datastore import publish
+
+    parser = argparse.ArgumentParser(description='Append new earthquake catalog exports to the catalog store.')
+    parser.add_argument('--inbox', default=INBOX, help='folder of USGS or PHIVOLCS CSV exports')
+    parser.add_argument('--dry-run', action='store_true', help='only report what each file would add')
+    parser.add_argument('--recount', action='store_true', help='rebuild the yearly counts from the whole store')
+    args = parser.parse_args()
+
+    if args.recount and os.path.isdir(CATALOG_DIR):
+        write_rates(recount())
+    #the frozen snapshot is the first file of a new store
+    paths = [SEED] if not os.path.exists(INGESTED) else []
+    if os.path.isdir(args.inbox):
+        paths += sorted(os.path.join(args.inbox, name) for name in os.listdir(args.inbox) if name.endswith('.csv'))
+
+    appended = ingest(paths, dry_run=args.dry_run)
+    #running app workers load the grown catalog as one new generation
+    if appended or args.recount:
+        print(f'published generation {publish()}')
@@ -0,0 +1,230 @@
+"""Analytics artifacts loaded as versioned generations, swapped in without restarting workers.
+
+A writer publishes a generation by rewriting data/analytics/GENERATION once
+every artifact is in place (the pipeline does it after a run that rebuilt
+something; `python -m utils.datastore --publish` does it after a manual
+copy). Each worker polls that file from a thread, loads the data of every
+registered page for the new generation while the old one keeps serving,
+then swaps a single reference. Every request is pinned to the generation
+current when it started, so it never sees two. Caches derived from the
+data live in the generation or are keyed by its version.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+import geopandas as gpd
+
+from utils.exposure import ANALYTICS_DIR
+from utils import schema
+from utils import topology
+
+GENERATION_FILE = os.path.join(ANALYTICS_DIR, 'GENERATION')
+
+#seconds between checks of the generation file
+POLL_SECONDS = float(os.environ.get('DATASTORE_POLL', 5))
+
+#version of the artifacts before anything was published
+INITIAL_VERSION = '0'
+
+logger = logging.getLogger(__name__)
+
+
+class Reader:
+    """Reads artifacts of one generation by file name, with the types declared in utils.schema."""
+
+    def __init__(self, directory=ANALYTICS_DIR):
+        self.directory = directory
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def csv(self, name, **kwargs):
+        kwargs.setdefault('dtype', schema.csv_dtypes(name))
+        return schema.apply(name, pd.read_csv(self.path(name), **kwargs))
+
+    def parquet(self, name, **kwargs):
+        return schema.apply(name, pd.read_parquet(self.path(name), **kwargs))
+
+    def geojson(self, name):
+        #boundary layers come from their shared-arc topology when it is at least as new
+        layer = topology.LAYERS.get(name)
+        topology_path = self.path(topology.BOUNDARIES_FILE)
+        if layer and os.path.exists(topology_path) and (
+                not self.exists(name) or os.path.getmtime(topology_path) >= os.path.getmtime(self.path(name))):
+            return schema.apply(name, topology.decode_frame(topology.read(topology_path), layer))
+        return schema.apply(name, gpd.read_file(self.path(name), driver='GeoJSON'))
+
+
+class Generation:
+    """Version and the data of every registered page, loaded from the same artifacts."""
+
+    def __init__(self, version, data=None):
+        self.version = version
+        self.data = data if data is not None else {}
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+
+class Dataset:
+    """A page's handle on its data; `current()` is the data of the request's generation."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def current(self):
+        generation = current()
+        if self.name not in generation.data:
+            #a page registered after its generation was loaded
+            with _lock:
+                if self.name not in generation.data:
+                    generation.data[self.name] = _load(self.name, generation.version)
+        return generation[self.name]
+
+
+_loaders = {}
+_swap_hooks = []
+_lock = threading.Lock()
+_current = None
+_pinned = threading.local()
+_watcher_pid = None
+
+
+def read_version(path=GENERATION_FILE):
+    try:
+        with open(path) as f:
+            return f.read().strip() or INITIAL_VERSION
+    except OSError:
+        return INITIAL_VERSION
+
+
+def publish(path=GENERATION_FILE):
+    """Mark the artifacts on disk as a new generation and return its version."""
+    version = f'{time.time_ns():x}'
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.GENERATION.', dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        f.write(version + '\n')
+    os.replace(tmp_path, path)
+    return version
+
+
+def _load(name, version):
+    data = SimpleNamespace(**_loaders[name](Reader()))
+    data.version = version
+    return data
+
+
+def register(name, loader):
+    """Load a page's data with `loader(read)`, now and for every later generation.
+
+    `loader` returns a dict of frames, prebuilt figures and empty caches;
+    they are read back as attributes of `Dataset.current()`, along with
+    the generation's `version`.
+    """
+    _loaders[name] = loader
+    dataset = Dataset(name)
+    dataset.current()
+    return dataset
+
+
+def on_swap(hook):
+    """Call `hook(old_version, new_version)` after each swap, to drop derived caches."""
+    _swap_hooks.append(hook)
+    return hook
+
+
+def current():
+    """The generation pinned to this request, else the latest one loaded."""
+    global _current
+    generation = getattr(_pinned, 'generation', None)
+    if generation is not None:
+        return generation
+    if _current is None:
+        with _lock:
+            if _current is None:
+                _current = Generation(read_version())
+    return _current
+
+
+def version():
+    return current().version
+
+
+def refresh(version=None):
+    """Load a generation in full, then make it current in a single assignment."""
+    global _current
+    version = version or read_version()
+    while True:
+        data = {name: _load(name, version) for name in list(_loaders)}
+        #a generation published while loading may have replaced some files; load it instead
+        latest = read_version()
+        if latest == version:
+            break
+        version = latest
+
+    old = _current
+    _current = Generation(version, data)
+    logger.info('analytics generation %s is live', version)
+    for hook in _swap_hooks:
+        hook(old.version if old else None, version)
+    return _current
+
+
+def _watch(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            latest = read_version()
+            if latest != current().version:
+                refresh(latest)
+        except Exception:
+            #the old generation keeps serving; the load is retried on the next poll
+            logger.exception('loading analytics generation failed')
+
+
+def _start_watcher(interval=POLL_SECONDS):
+    #one watcher per worker process, started after gunicorn forks; background jobs stay pinned
+    global _watcher_pid
+    if _watcher_pid == os.getpid() or multiprocessing.current_process().daemon or interval <= 0:
+        return
+    with _lock:
+        if _watcher_pid != os.getpid():
+            _watcher_pid = os.getpid()
+            threading.Thread(target=_watch, args=(interval,), name='datastore-watcher', daemon=True).start()
+
+
+def init_datastore(server):
+    """Pin every request to the generation current when it arrives, and watch for new ones."""
+    @server.before_request
+    def pin_generation():
+        _start_watcher()
+        _pinned.generation = None
+        _pinned.generation = current()
+
+    @server.teardown_request
+    def unpin_generation(error=None):
+        _pinned.generation = None
+
+    server.add_url_rule('/_stats/generation', 'datastore_generation',
+                        lambda: {'version': version(), 'published': read_version()})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publish the artifacts in data/analytics as a new generation.')
+    parser.add_argument('--publish', action='store_true', help='write a new GENERATION marker')
+    args = parser.parse_args()
+    if args.publish:
+        print(f'published generation {publish()}')
+    else:
+        print(f'current generation {read_version()}')
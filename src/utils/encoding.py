@@ -0,0 +1,163 @@
+import base64
+import json
+import os
+
+import numpy as np
+import geopandas as gpd
+import shapely
+import plotly.graph_objects as go
+from flask_compress import Compress
+
+#trace attributes holding coordinates or numeric series
+COORD_KEYS = ('lat', 'lon')
+NUMERIC_KEYS = ('x', 'y', 'z')
+
+#5 decimal places is ~1 meter, finer than anything drawn on the maps
+COORD_DECIMALS = 5
+
+#arrays shorter than this are cheaper as plain JSON
+MIN_BINARY_LENGTH = 32
+
+#responses smaller than this (bytes) are sent uncompressed
+COMPRESS_THRESHOLD = 1024
+
+#plotly.js understands {dtype, bdata} typed arrays from 2.28.0 onwards
+BINARY_MIN_PLOTLYJS = (2, 28, 0)
+
+DTYPES = {'f4': '<f4', 'f8': '<f8', 'i1': '<i1', 'u1': '<u1', 'i2': '<i2',
+          'u2': '<u2', 'i4': '<i4', 'u4': '<u4'}
+
+
+def plotlyjs_version():
+    """Version of the plotly.js bundle shipped with dash-core-components."""
+    from dash import dcc
+
+    info_path = os.path.join(os.path.dirname(dcc.__file__), 'package-info.json')
+    try:
+        with open(info_path) as f:
+            info = json.load(f)
+    except OSError:
+        return None
+
+    dependencies = info.get('dependencies', {})
+    version = dependencies.get('plotly.js-dist-min') or dependencies.get('plotly.js')
+    if not version:
+        return None
+    digits = version.lstrip('^~=v').split('-')[0].split('.')
+    try:
+        return tuple(int(d) for d in digits)
+    except ValueError:
+        return None
+
+
+def binary_arrays_supported():
+    #BINARY_ARRAYS=0/1 overrides detection, e.g. when serving a newer plotly.js
+    override = os.environ.get('BINARY_ARRAYS')
+    if override is not None:
+        return override == '1'
+    version = plotlyjs_version()
+    return version is not None and version >= BINARY_MIN_PLOTLYJS
+
+
+BINARY_ARRAYS = binary_arrays_supported()
+ENABLED = os.environ.get('COMPACT_FIGURES', '1') == '1'
+
+
+def _as_numeric(values):
+    #None and NaN both become NaN, which plotly draws as a gap just like null
+    if isinstance(values, dict) or values is None:
+        return None
+    try:
+        arr = np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        return None
+    if arr.ndim != 1:
+        return None
+    return arr
+
+
+def _smallest_dtype(arr, coords):
+    if coords:
+        return 'f4'
+    finite = arr[np.isfinite(arr)]
+    if len(finite) == len(arr) and np.all(finite == np.round(finite)):
+        lo, hi = (finite.min(), finite.max()) if len(finite) else (0, 0)
+        for dtype in ('u1', 'i1', 'u2', 'i2', 'u4', 'i4'):
+            info = np.iinfo(DTYPES[dtype])
+            if info.min <= lo and hi <= info.max:
+                return dtype
+    return 'f8'
+
+
+def typed_array(arr, dtype):
+    """Plotly typed-array spec for a 1-D numeric array."""
+    data = np.ascontiguousarray(arr, dtype=DTYPES[dtype])
+    return {'dtype': dtype, 'bdata': base64.b64encode(data.tobytes()).decode('ascii')}
+
+
+def encode_array(values, coords=False):
+    arr = _as_numeric(values)
+    if arr is None:
+        return values
+
+    if BINARY_ARRAYS and len(arr) >= MIN_BINARY_LENGTH:
+        return typed_array(arr, _smallest_dtype(arr, coords))
+
+    if not coords:
+        return values
+
+    rounded = np.round(arr, COORD_DECIMALS)
+    return [None if np.isnan(v) else v for v in rounded.tolist()]
+
+
+def encode_trace(trace):
+    trace = dict(trace)
+    for key in COORD_KEYS:
+        if key in trace:
+            trace[key] = encode_array(trace[key], coords=True)
+    for key in NUMERIC_KEYS:
+        if key in trace:
+            trace[key] = encode_array(trace[key])
+    return trace
+
+
+def encode_figure(fig):
+    """Figure dict with coordinate arrays rounded or packed as typed arrays.
+
+    The result can be returned from a callback or passed to dcc.Graph as is.
+    """
+    if not ENABLED:
+        return fig
+
+    if isinstance(fig, go.Figure):
+        fig = fig.to_plotly_json()
+
+    return {'data': [encode_trace(trace) for trace in fig.get('data', [])],
+            'layout': fig.get('layout', {})}
+
+
+def compact_geojson(gdf, properties=(), decimals=COORD_DECIMALS):
+    """GeoJSON dict of a GeoDataFrame with rounded coordinates.
+
+    Only the listed properties are kept; the feature ids follow the index.
+    """
+    if not ENABLED:
+        return json.loads(gdf.to_json())
+
+    geoms = shapely.transform(np.asarray(gdf.geometry.values),
+                              lambda coords: np.round(coords, decimals))
+    compact = gpd.GeoDataFrame(gdf[list(properties)], geometry=geoms, crs=gdf.crs)
+    return json.loads(compact.to_json(show_bbox=False))
+
+
+def init_compression(server, threshold=COMPRESS_THRESHOLD):
+    """gzip/brotli compression of layout, callback and asset responses."""
+    server.config.update(
+        COMPRESS_ALGORITHM=['br', 'gzip'],
+        COMPRESS_MIN_SIZE=threshold,
+        COMPRESS_LEVEL=6,
+        COMPRESS_BR_LEVEL=5,
+        COMPRESS_MIMETYPES=['application/json', 'text/html', 'text/css',
+                            'application/javascript', 'text/javascript'],
+    )
+    Compress(server)
@@ -0,0 +1,109 @@
+"""RAAM scores under uncertain post-earthquake travel times.
+
+Every ensemble member multiplies the travel times by log-normal factors
+with mean 1: one shared by all trips from a barangay (local congestion) and
+one per barangay-hospital pair. Members are solved in batches along the
+RAAM batch axis, continuing from the unperturbed solution at the last step
+of its schedule, and the batches are spread across a process pool.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from utils import raam
+
+#about 0.12 s per member serially on the app data, so around 6 s for the ensemble
+N_MEMBERS = 50
+
+#log-normal sigma of the barangay factor and of the pair factor
+SIGMA_BARANGAY = 0.25
+SIGMA_PAIR = 0.2
+
+#members per task sent to the process pool
+BATCH_SIZE = 10
+
+#cycles per member after the unperturbed solution's; more cycles at the small final step barely move the spread
+MEMBER_CYCLES = 30
+
+#worst share of barangays used for the rank stability measure
+WORST_SHARE = 0.1
+
+PERCENTILES = (5, 50, 95)
+
+EnsembleSettings = namedtuple('EnsembleSettings', ['members', 'sigma_barangay', 'sigma_pair', 'seed'])
+DEFAULT_SETTINGS = EnsembleSettings(N_MEMBERS, SIGMA_BARANGAY, SIGMA_PAIR, 0)
+
+
+def lognormal(rng, sigma, shape):
+    #mean-one multipliers, so the ensemble is centered on the free-flow estimate
+    return np.exp(sigma * rng.standard_normal(shape) - sigma ** 2 / 2)
+
+
+def _solve_batch(task):
+    demand, supply, cost, allocation, start_cycle, tau, seed, n, sigma_barangay, sigma_pair = task
+    rng = np.random.default_rng(seed)
+    n_demand, n_supply = cost.shape
+    factors = lognormal(rng, sigma_barangay, (n, n_demand, 1)) * lognormal(rng, sigma_pair, (n, n_demand, n_supply))
+
+    problem = raam.RaamProblem(demand, np.repeat(supply[None], n, axis=0), cost[None] * factors)
+    result = raam.solve(problem, tau, allocation=np.repeat(allocation[None], n, axis=0),
+                        start_cycle=start_cycle, max_cycles=MEMBER_CYCLES)
+    return result.scores
+
+
+def run_ensemble(problem, result, tau, row=0, settings=DEFAULT_SETTINGS, jobs=None, log=None):
+    """Scores of every member, shape (members, barangays).
+
+    Each batch draws from its own seed, so the ensemble is the same however
+    the batches are spread across processes.
+    """
+    allocation = np.asarray(result.allocation[row], dtype=np.float64)
+    seeds = np.random.SeedSequence(settings.seed).spawn((settings.members + BATCH_SIZE - 1) // BATCH_SIZE)
+
+    tasks = []
+    for i, seed in enumerate(seeds):
+        n = min(BATCH_SIZE, settings.members - i * BATCH_SIZE)
+        tasks.append((problem.demand, problem.supply[row], problem.cost, allocation, result.cycle, tau,
+                      seed, n, settings.sigma_barangay, settings.sigma_pair))
+
+    scores = []
+    for start in range(0, len(tasks), 4):
+        scores.extend(raam.map_batches(_solve_batch, tasks[start:start + 4], jobs))
+        if log is not None:
+            log(min(settings.members, (start + 4) * BATCH_SIZE), settings.members)
+    return np.vstack(scores)
+
+
+def summarize(scores, demand_ids, index_name='brgy_index', worst_share=WORST_SHARE):
+    """Per-barangay score percentiles and rank stability across members.
+
+    `worst_frequency` is the share of members in which a barangay is among
+    the worst served; `rank_spread` is the width of its 5-95% rank range.
+    """
+    summary = pd.DataFrame(index=pd.Index(demand_ids, name=index_name))
+    with np.errstate(invalid='ignore'):
+        for p, values in zip(PERCENTILES, np.nanpercentile(scores, PERCENTILES, axis=0)):
+            summary[f'score_p{p}'] = values
+    summary['score_spread'] = summary[f'score_p{PERCENTILES[-1]}'] - summary[f'score_p{PERCENTILES[0]}']
+
+    #rank 1 is the worst served barangay of a member
+    ranks = pd.DataFrame(scores.T).rank(ascending=False, na_option='keep').to_numpy().T
+    n_worst = max(1, int(np.isfinite(scores[0]).sum() * worst_share))
+    low, high = np.nanpercentile(ranks, [5, 95], axis=0)
+    summary['rank_p5'] = low
+    summary['rank_p95'] = high
+    summary['rank_spread'] = high - low
+    summary['worst_frequency'] = (ranks <= n_worst).mean(axis=0)
+    return summary
+
+
+def cached_summary(store, scenario, tau, problem, result, row=0, settings=DEFAULT_SETTINGS, jobs=None, log=None):
+    """Ensemble summary for a scenario, travel time and supply row, computed once and kept in the store."""
+    key = ('ensemble', scenario, tau, row, tuple(settings))
+    summary = store.get(key, retry=True)
+    if summary is None:
+        scores = run_ensemble(problem, result, tau, row, settings, jobs, log)
+        summary = summarize(scores, problem.demand_ids)
+        store.set(key, summary, retry=True)
+    return summary
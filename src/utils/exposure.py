@@ -0,0 +1,227 @@
+"""Exposure of barangays and hospitals to geologic hazards.
+
+Run from the src folder to (re)build the artifacts:
+
+    python -m utils.exposure liquefaction [--benchmark]
+    python -m utils.exposure faults [--buffers 1 5 10]
+"""
+import argparse
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+ANALYTICS_DIR = '../data/analytics'
+LIQUEFACTION_EXPOSURE = os.path.join(ANALYTICS_DIR, 'liquefaction_exposure.csv')
+FAULT_PROXIMITY_BRGY = os.path.join(ANALYTICS_DIR, 'fault_proximity_brgy.csv')
+FAULT_PROXIMITY_HOSP = os.path.join(ANALYTICS_DIR, 'fault_proximity_hosp.csv')
+
+#UTM zone 51N, meters, covers Metro Manila
+PROJECTED_CRS = 'EPSG:32651'
+
+POTENTIALS = ['High Potential', 'Moderate Potential', 'Low Potential']
+
+#distances from the nearest fault, in km, reported as exposure buffers
+FAULT_BUFFERS_KM = (1, 5, 10)
+
+
+def _projected(gdf):
+    gdf = gdf.to_crs(PROJECTED_CRS)
+    return gdf.set_geometry(shapely.make_valid(np.asarray(gdf.geometry.values)))
+
+
+def exclusive_zones(liquefaction_map, crs='EPSG:4326'):
+    """One part per row, each class minus the higher ones so no area is counted twice."""
+    zones = liquefaction_map.to_crs(crs)
+    dissolved = zones[['potential', 'geometry']].dissolve('potential').geometry
+    parts, covered = [], None
+    for potential in POTENTIALS:
+        if potential not in dissolved.index:
+            continue
+        geom = shapely.make_valid(dissolved[potential])
+        if covered is not None:
+            geom = shapely.difference(geom, covered)
+        covered = geom if covered is None else shapely.union(covered, geom)
+        parts.append(gpd.GeoDataFrame({'potential': [potential]}, geometry=[geom], crs=crs))
+    return pd.concat(parts).explode(index_parts=False).reset_index(drop=True)
+
+
+def liquefaction_exposure(ncr_boundary_pop, liquefaction_map):
+    """Area fraction and population at risk of each barangay, per liquefaction class.
+
+    Area in zones of several classes counts under the highest one only, so a
+    barangay's classes add up to its area in any zone. Population is assumed
+    evenly spread within a barangay, so the population at risk is the
+    population times the area fraction.
+    """
+    brgy = _projected(ncr_boundary_pop).reset_index(drop=True)
+
+    #split into parts so the tree's bounding boxes stay tight
+    zones = exclusive_zones(liquefaction_map, PROJECTED_CRS)
+
+    brgy_geoms = np.asarray(brgy.geometry.values)
+    zone_geoms = np.asarray(zones.geometry.values)
+
+    tree = shapely.STRtree(zone_geoms)
+    brgy_pos, zone_pos = tree.query(brgy_geoms, predicate='intersects')
+    overlap = shapely.area(shapely.intersection(brgy_geoms[brgy_pos], zone_geoms[zone_pos]))
+
+    exposed = (pd.DataFrame({'row': brgy_pos,
+                             'potential': zones['potential'].to_numpy()[zone_pos],
+                             'area': overlap})
+               .groupby(['row', 'potential'])['area'].sum()
+               .unstack(fill_value=0.0)
+               .reindex(index=range(len(brgy)), columns=POTENTIALS, fill_value=0.0))
+
+    brgy_area = shapely.area(brgy_geoms)
+    fraction = exposed.div(np.where(brgy_area > 0, brgy_area, np.nan), axis=0).clip(upper=1).fillna(0)
+
+    exposure = pd.concat({
+        'exposed_area_km2': exposed / 1e6,
+        'area_fraction': fraction,
+        'population_at_risk': fraction.mul(brgy['population'].to_numpy(), axis=0),
+    }, axis=1).stack().reset_index(level=1).rename(columns={'level_1': 'potential'})
+
+    exposure = brgy[['brgy_index', 'barangay', 'city', 'population']].join(exposure)
+    return exposure.reset_index(drop=True)[['brgy_index', 'barangay', 'city', 'population', 'potential',
+                                            'exposed_area_km2', 'area_fraction', 'population_at_risk']]
+
+
+def naive_liquefaction_exposure(ncr_boundary_pop, liquefaction_map):
+    """Same table through gpd.overlay, kept as the benchmark baseline."""
+    brgy = _projected(ncr_boundary_pop)
+    zones = exclusive_zones(liquefaction_map, PROJECTED_CRS)
+    brgy['brgy_area'] = brgy.area
+
+    pieces = gpd.overlay(brgy, zones, how='intersection')
+    pieces['exposed_area_km2'] = pieces.area / 1e6
+    pieces['area_fraction'] = (pieces.area / pieces['brgy_area']).clip(upper=1)
+    pieces['population_at_risk'] = pieces['area_fraction'] * pieces['population']
+    #zones may come with categorical potentials; only the pairs that overlap are kept
+    return pieces.groupby(['brgy_index', 'potential'], observed=True)[['exposed_area_km2', 'area_fraction',
+                                                                      'population_at_risk']].sum()
+
+
+def load_liquefaction_exposure(ncr_boundary_pop, liquefaction_map, path=LIQUEFACTION_EXPOSURE):
+    """Read the cached artifact, computing and writing it the first time."""
+    if os.path.exists(path):
+        return pd.read_csv(path)
+    exposure = liquefaction_exposure(ncr_boundary_pop, liquefaction_map)
+    exposure.to_csv(path, index=False)
+    return exposure
+
+
+def _nearest_fault(tree, geoms, fault_names):
+    #one bulk query for all inputs; ties resolve to a single segment
+    (input_pos, fault_pos), distances = tree.query_nearest(geoms, return_distance=True, all_matches=False)
+    order = np.argsort(input_pos)
+    return distances[order] / 1000, fault_names[fault_pos[order]]
+
+
+def fault_proximity(ncr_boundary_pop, ncr_hosp, fault_lines_ph, buffers_km=FAULT_BUFFERS_KM):
+    """Distance of barangays and hospitals to the nearest fault segment.
+
+    Returns a barangay table (polygon and centroid distance, population
+    inside each buffer) and a hospital table (distance, within each buffer).
+    """
+    faults = _projected(fault_lines_ph).explode(index_parts=False).reset_index(drop=True)
+    fault_geoms = np.asarray(faults.geometry.values)
+    fault_names = faults['name'].to_numpy()
+    tree = shapely.STRtree(fault_geoms)
+
+    brgy = _projected(ncr_boundary_pop).reset_index(drop=True)
+    brgy_geoms = np.asarray(brgy.geometry.values)
+    brgy_area = shapely.area(brgy_geoms)
+
+    brgy_exposure = brgy[['brgy_index', 'barangay', 'city', 'population']].copy()
+    brgy_exposure['fault_distance_km'], brgy_exposure['nearest_fault'] = _nearest_fault(tree, brgy_geoms, fault_names)
+    brgy_exposure['centroid_fault_distance_km'], _ = _nearest_fault(tree, shapely.centroid(brgy_geoms), fault_names)
+
+    hosp = _projected(ncr_hosp).reset_index(drop=True)
+    hosp_exposure = hosp[['hospital_index', 'facility_name', 'service_capability', 'bed_capacity']].copy()
+    hosp_exposure['fault_distance_km'], hosp_exposure['nearest_fault'] = _nearest_fault(
+        tree, np.asarray(hosp.geometry.values), fault_names)
+
+    for km in buffers_km:
+        #population inside the buffer, by area share of each barangay it touches
+        near = np.flatnonzero(brgy_exposure['fault_distance_km'].to_numpy() <= km)
+        extent = shapely.buffer(shapely.box(*shapely.total_bounds(brgy_geoms[near])), km * 1000)
+        zone = shapely.union_all(shapely.buffer(fault_geoms[tree.query(extent)], km * 1000))
+
+        inside = np.zeros(len(brgy))
+        inside[near] = shapely.area(shapely.intersection(brgy_geoms[near], zone))
+        fraction = np.clip(inside / np.where(brgy_area > 0, brgy_area, np.nan), 0, 1)
+
+        brgy_exposure[f'within_{km}km'] = brgy_exposure['fault_distance_km'] <= km
+        brgy_exposure[f'population_within_{km}km'] = np.nan_to_num(fraction) * brgy_exposure['population']
+        hosp_exposure[f'within_{km}km'] = hosp_exposure['fault_distance_km'] <= km
+
+    return brgy_exposure, hosp_exposure
+
+
+def fault_buffers(fault_proximity_df):
+    """Buffer distances (km) present in a fault proximity table."""
+    matches = (re.match(r'within_(\d+)km$', column) for column in fault_proximity_df.columns)
+    return sorted(int(match.group(1)) for match in matches if match)
+
+
+def load_fault_proximity(ncr_boundary_pop, ncr_hosp, fault_lines_ph,
+                         brgy_path=FAULT_PROXIMITY_BRGY, hosp_path=FAULT_PROXIMITY_HOSP):
+    """Read the cached artifacts, computing and writing them the first time."""
+    if os.path.exists(brgy_path) and os.path.exists(hosp_path):
+        return pd.read_csv(brgy_path), pd.read_csv(hosp_path)
+    brgy_exposure, hosp_exposure = fault_proximity(ncr_boundary_pop, ncr_hosp, fault_lines_ph)
+    brgy_exposure.to_csv(brgy_path, index=False)
+    hosp_exposure.to_csv(hosp_path, index=False)
+    return brgy_exposure, hosp_exposure
+
+
+def benchmark(ncr_boundary_pop, liquefaction_map, repeat=3):
+    timings = {}
+    for name, fn in [('strtree', liquefaction_exposure), ('gpd.overlay', naive_liquefaction_exposure)]:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn(ncr_boundary_pop, liquefaction_map)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = (best, result)
+
+    fast = timings['strtree'][1].set_index(['brgy_index', 'potential'])
+    slow = timings['gpd.overlay'][1]
+    difference = (fast.loc[slow.index, 'population_at_risk'] - slow['population_at_risk']).abs().max()
+
+    for name, (seconds, _) in timings.items():
+        print(f'{name:<12} {seconds * 1000:10.1f} ms')
+    print(f"speedup      {timings['gpd.overlay'][0] / timings['strtree'][0]:10.1f}x")
+    print(f'max population difference {difference:.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build hazard exposure artifacts.')
+    parser.add_argument('layer', choices=['liquefaction', 'faults'])
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare against a naive gpd.overlay before writing')
+    parser.add_argument('--buffers', type=int, nargs='+', default=list(FAULT_BUFFERS_KM),
+                        help='fault buffer distances in km')
+    args = parser.parse_args()
+
+    ncr_boundary_pop = gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_boundary_pop.geojson'))
+
+    if args.layer == 'liquefaction':
+        liquefaction_map = gpd.read_file(os.path.join(ANALYTICS_DIR, 'liquefaction_map.geojson'))
+        if args.benchmark:
+            benchmark(ncr_boundary_pop, liquefaction_map)
+        liquefaction_exposure(ncr_boundary_pop, liquefaction_map).to_csv(LIQUEFACTION_EXPOSURE, index=False)
+        print(f'wrote {LIQUEFACTION_EXPOSURE}')
+
+    elif args.layer == 'faults':
+        ncr_hosp = gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_hosp.geojson'))
+        fault_lines_ph = gpd.read_file(os.path.join(ANALYTICS_DIR, 'fault_lines_ph.geojson'))
+        brgy_exposure, hosp_exposure = fault_proximity(ncr_boundary_pop, ncr_hosp, fault_lines_ph, args.buffers)
+        brgy_exposure.to_csv(FAULT_PROXIMITY_BRGY, index=False)
+        hosp_exposure.to_csv(FAULT_PROXIMITY_HOSP, index=False)
+        print(f'wrote {FAULT_PROXIMITY_BRGY} and {FAULT_PROXIMITY_HOSP}')
@@ -0,0 +1,168 @@
+"""Barangay to hospital travel times by hour of day, stored as a memory-mapped tensor.
+
+The tensor is (hour, barangay, hospital) float32 in a .npy file, hour-major
+so every hour is one contiguous slice that is read without loading the
+rest. Each hour routes the road graph with edges slowed by that hour's
+congestion, and the travel matrix durations are scaled by the routed
+slowdown, the same way the damaged-road scenario scales them.
+
+Run from the src folder after the road graph is built:
+
+    python -m utils.hourly [--jobs 4]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from utils import datastore
+from utils.exposure import ANALYTICS_DIR
+from utils.routing import ROAD_GRAPH, RoadGraph, _points, haversine, travel_times
+
+TRAVEL_HOURLY = os.path.join(ANALYTICS_DIR, 'travel_hourly.npy')
+TRAVEL_HOURLY_INDEX = os.path.join(ANALYTICS_DIR, 'travel_hourly_index.npz')
+
+HOURS = 24
+
+#travel time over free flow on arterials, by hour; Metro Manila peaks around 7-8 a.m. and 5-7 p.m.
+CONGESTION = np.array([1.0, 1.0, 1.0, 1.0, 1.05, 1.2, 1.8, 2.4, 2.5, 2.1, 1.8, 1.8,
+                       1.8, 1.8, 1.9, 2.0, 2.3, 2.7, 2.8, 2.5, 2.0, 1.6, 1.3, 1.1])
+
+#share of the arterial slowdown felt by roads at or above each free-flow speed, km/h
+CLASS_SHARES = [(50, 1.0), (30, 0.75), (0, 0.5)]
+
+
+def edge_factors(graph, hour):
+    """Travel time multiplier of every edge at an hour, from the edge's free-flow speed."""
+    meters = haversine(graph.lon[graph.tail], graph.lat[graph.tail], graph.lon[graph.head], graph.lat[graph.head])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.nan_to_num(meters / graph.seconds * 3.6)
+    share = np.select([speed >= floor for floor, _ in CLASS_SHARES], [s for _, s in CLASS_SHARES])
+    return 1 + share * (CONGESTION[hour] - 1)
+
+
+def dense_durations(travel_matrix, brgy_ids, hospital_ids):
+    #fastest listed duration of each pair, inf where the pair is not listed
+    b = pd.Index(brgy_ids).get_indexer(travel_matrix['brgy_index'])
+    h = pd.Index(hospital_ids).get_indexer(travel_matrix['hospital_index'])
+    known = (b >= 0) & (h >= 0)
+    dense = np.full((len(brgy_ids), len(hospital_ids)), np.inf)
+    np.minimum.at(dense, (b[known], h[known]), travel_matrix['duration'].to_numpy(dtype=np.float64)[known])
+    return dense
+
+
+def build(graph, ncr_boundary_pop, ncr_hosp, travel_matrix, path=TRAVEL_HOURLY, index_path=TRAVEL_HOURLY_INDEX,
+          jobs=None, log=print):
+    """Write the hourly tensor one hour at a time, so memory holds a single slice."""
+    brgy_ids = ncr_boundary_pop['brgy_index'].to_numpy()
+    hospital_ids = ncr_hosp['hospital_index'].to_numpy()
+    brgy_lon, brgy_lat = _points(ncr_boundary_pop)
+    hosp_lon, hosp_lat = _points(ncr_hosp)
+    free = dense_durations(travel_matrix, brgy_ids, hospital_ids)
+
+    routed_free = travel_times(graph, brgy_lon, brgy_lat, hosp_lon, hosp_lat, jobs)
+    tensor = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(HOURS,) + free.shape)
+    for hour in range(HOURS):
+        routed = travel_times(graph, brgy_lon, brgy_lat, hosp_lon, hosp_lat, jobs,
+                              seconds=graph.seconds * edge_factors(graph, hour))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(np.isfinite(routed_free), routed / routed_free, 1.0)
+        tensor[hour] = free * ratio
+        log(f'hour {hour:02d}: median slowdown {np.nanmedian(ratio):.2f}')
+    tensor.flush()
+    del tensor
+
+    np.savez(index_path, brgy_index=brgy_ids, hospital_index=hospital_ids, free=free.astype(np.float32))
+
+
+class HourlyTravel:
+    """Read-only view of the hourly tensor."""
+
+    def __init__(self, path=TRAVEL_HOURLY, index_path=TRAVEL_HOURLY_INDEX):
+        self.tensor = np.load(path, mmap_mode='r')
+        with np.load(index_path) as index:
+            self.brgy_pos = pd.Index(index['brgy_index'])
+            self.hospital_pos = pd.Index(index['hospital_index'])
+            self.free = index['free']
+
+    def hour(self, hour):
+        """Durations at an hour, a view of the mapped file; pages are read on access."""
+        return self.tensor[hour]
+
+    def travel_matrix(self, base, hour):
+        """`base` (free-flow or damaged, travel matrix schema) slowed by an hour's congestion.
+
+        Each pair is scaled by its hourly duration over its free-flow one, so
+        damage and congestion compound; pairs not in the tensor are kept as is.
+        """
+        b = self.brgy_pos.get_indexer(base['brgy_index'])
+        h = self.hospital_pos.get_indexer(base['hospital_index'])
+        known = (b >= 0) & (h >= 0)
+        factor = np.ones(len(base))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = self.hour(hour)[b[known], h[known]] / self.free[b[known], h[known]]
+        factor[known] = np.where(np.isfinite(ratio), ratio, 1.0)
+        return base.assign(duration=base['duration'] * factor)
+
+
+#value of the hour control for the free-flow travel matrix
+FREE_FLOW = 'free'
+
+
+def hour_options():
+    return [{'label': 'Free flow', 'value': FREE_FLOW}] + [{'label': f'{h:02d}:00', 'value': h} for h in range(HOURS)]
+
+
+def selected_hour(value):
+    """Hour of the hour control, None for free flow or when the tensor is not built."""
+    return None if value in (None, FREE_FLOW) or not available() else int(value)
+
+
+_hourly = None
+_matrices = {}
+
+
+@datastore.on_swap
+def _reset(old_version, new_version):
+    #a new generation may come with a rebuilt tensor; the old mapping stays valid until dropped
+    global _hourly
+    _hourly = None
+    for key in [k for k in _matrices if k[0] != new_version]:
+        del _matrices[key]
+
+
+def available(path=TRAVEL_HOURLY, index_path=TRAVEL_HOURLY_INDEX):
+    return os.path.exists(path) and os.path.exists(index_path)
+
+
+def hourly_travel_matrix(base, hour, scenario=None):
+    """Travel matrix at an hour, kept per worker for each (generation, scenario, hour)."""
+    global _hourly
+    key = (datastore.version(), scenario, hour)
+    if key not in _matrices:
+        if _hourly is None:
+            _hourly = HourlyTravel()
+        _matrices[key] = _hourly.travel_matrix(base, hour)
+    return _matrices[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the hourly travel time tensor.')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes')
+    args = parser.parse_args()
+
+    ncr_boundary_pop = gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_boundary_pop.geojson'))
+    ncr_hosp = gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_hosp.geojson'))
+    travel_matrix = pd.read_csv(os.path.join(ANALYTICS_DIR, 'travel_matrix.csv'))
+
+    start = time.perf_counter()
+    build(RoadGraph.load(ROAD_GRAPH), ncr_boundary_pop, ncr_hosp, travel_matrix, jobs=args.jobs)
+    print(f'wrote {TRAVEL_HOURLY} in {time.perf_counter() - start:.1f}s')
+
+    hourly = HourlyTravel()
+    start = time.perf_counter()
+    durations = np.array(hourly.hour(18))
+    print(f'read one hour ({durations.nbytes / 1e6:.1f} MB) in {1000 * (time.perf_counter() - start):.1f}ms')
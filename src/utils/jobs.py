@@ -0,0 +1,17 @@
+import os
+
+import diskcache
+from dash import DiskcacheManager
+
+#disk-backed job store shared by every gunicorn worker, no broker required
+JOB_STORE = os.environ.get('JOB_STORE', '../data/cache/jobs')
+
+#finished results are only read once by the polling browser
+RESULT_EXPIRE = 10 * 60
+
+job_cache = diskcache.Cache(JOB_STORE)
+
+#Each background callback runs in its own process. When the same browser
+#session fires the callback again, Dash sends the id of the unfinished job
+#along with the new request and the manager terminates it.
+background_callback_manager = DiskcacheManager(job_cache, expire=RESULT_EXPIRE)
@@ -0,0 +1,98 @@
+"""Barangay and liquefaction zone of GPS coordinates, for batches of points.
+
+Candidates come from one bulk STRtree query of the points against the
+barangay (or zone) bounding boxes; the exact test then runs on all
+candidate pairs at once against prepared polygons. A point on a shared
+border goes to the barangay listed first, a point in overlapping zones to
+the highest potential.
+
+Run from the src folder to time a batch of random points over Metro Manila:
+
+    python -m utils.locate [--points 100000]
+"""
+import argparse
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from utils.exposure import ANALYTICS_DIR, POTENTIALS
+
+#brgy_index of each point (-1 outside every barangay), potential of its zone (None outside the zones)
+Location = namedtuple('Location', ['brgy_index', 'potential'])
+
+
+class BarangayLocator:
+    """Prebuilt STRtrees over the barangay boundaries and the liquefaction zones."""
+
+    def __init__(self, ncr_boundary_pop, liquefaction_map):
+        boundary = ncr_boundary_pop.to_crs('EPSG:4326')
+        self.brgy_ids = boundary['brgy_index'].to_numpy()
+        self.brgy_geoms = np.asarray(boundary.geometry.values)
+        self.brgy_tree = shapely.STRtree(self.brgy_geoms)
+
+        zones = liquefaction_map.to_crs('EPSG:4326')
+        self.zone_geoms = np.asarray(zones.geometry.values)
+        self.zone_tree = shapely.STRtree(self.zone_geoms)
+        self.zone_potentials = np.asarray(zones['potential'].astype(object))
+        #High before Moderate before Low; anything else last
+        rank = pd.Index(POTENTIALS).get_indexer(self.zone_potentials)
+        self.zone_rank = np.where(rank >= 0, rank, len(POTENTIALS))
+
+        #the polygons are tested against many points each
+        shapely.prepare(self.brgy_geoms)
+        shapely.prepare(self.zone_geoms)
+
+    @staticmethod
+    def _matches(tree, geoms, points, lon, lat, rank=None):
+        #(point, polygon) pairs whose boxes overlap, kept if the point is inside or on the edge
+        point_pos, geom_pos = tree.query(points)
+        inside = shapely.intersects_xy(geoms[geom_pos], lon[point_pos], lat[point_pos])
+        point_pos, geom_pos = point_pos[inside], geom_pos[inside]
+        #first polygon per point, by rank then position
+        order = np.lexsort((geom_pos, rank[geom_pos] if rank is not None else geom_pos, point_pos))
+        point_pos, geom_pos = point_pos[order], geom_pos[order]
+        points_found, first = np.unique(point_pos, return_index=True)
+        return points_found, geom_pos[first]
+
+    def locate(self, lon, lat):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        points = shapely.points(lon, lat)
+
+        brgy_index = np.full(len(lon), -1, dtype=np.int64)
+        found, brgy_pos = self._matches(self.brgy_tree, self.brgy_geoms, points, lon, lat)
+        brgy_index[found] = self.brgy_ids[brgy_pos]
+
+        potential = np.full(len(lon), None, dtype=object)
+        found, zone_pos = self._matches(self.zone_tree, self.zone_geoms, points, lon, lat, self.zone_rank)
+        potential[found] = self.zone_potentials[zone_pos]
+        return Location(brgy_index=brgy_index, potential=potential)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time barangay lookups of random points.')
+    parser.add_argument('--points', type=int, default=100000)
+    args = parser.parse_args()
+
+    ncr_boundary_pop = gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_boundary_pop.geojson'))
+    liquefaction_map = gpd.read_file(os.path.join(ANALYTICS_DIR, 'liquefaction_map.geojson'))
+
+    start = time.perf_counter()
+    locator = BarangayLocator(ncr_boundary_pop, liquefaction_map)
+    build = time.perf_counter() - start
+
+    rng = np.random.default_rng(0)
+    x0, y0, x1, y1 = ncr_boundary_pop.total_bounds
+    lon, lat = rng.uniform(x0, x1, args.points), rng.uniform(y0, y1, args.points)
+
+    start = time.perf_counter()
+    location = locator.locate(lon, lat)
+    elapsed = time.perf_counter() - start
+    print(f'built in {build:.3f}s; {args.points:,} points in {elapsed:.3f}s '
+          f'({(location.brgy_index >= 0).sum():,} in a barangay, '
+          f'{pd.notna(location.potential).sum():,} in a liquefaction zone)')
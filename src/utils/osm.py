@@ -0,0 +1,103 @@
+"""Streaming reader for OpenStreetMap XML extracts."""
+import bz2
+import gzip
+from xml.etree.ElementTree import iterparse
+
+#highway types a car can drive on, with a default speed in km/h
+ROAD_SPEEDS = {
+    'motorway': 80, 'motorway_link': 50,
+    'trunk': 60, 'trunk_link': 40,
+    'primary': 40, 'primary_link': 30,
+    'secondary': 35, 'secondary_link': 25,
+    'tertiary': 30, 'tertiary_link': 20,
+    'unclassified': 25, 'residential': 20,
+    'living_street': 10, 'service': 15,
+}
+
+
+def _open(path):
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _elements(path, tags):
+    #the root is emptied after every top-level element, so memory stays flat however large the extract
+    with _open(path) as f:
+        context = iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end':
+                continue
+            if elem.tag in tags:
+                yield elem
+            if elem.tag in ('node', 'way', 'relation'):
+                root.clear()
+
+
+def _tags(elem):
+    return {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+
+
+def _refs(elem):
+    return [int(nd.get('ref')) for nd in elem.iter('nd')]
+
+
+def iter_ways(path, keep=lambda tags: 'highway' in tags):
+    """Yield (way id, node ids, tags) of the ways whose tags pass `keep`."""
+    for elem in _elements(path, ('way',)):
+        tags = _tags(elem)
+        if keep(tags):
+            yield int(elem.get('id')), _refs(elem), tags
+
+
+def iter_nodes(path, wanted=None):
+    """Yield (node id, lon, lat), only for ids in `wanted` when given."""
+    for elem in _elements(path, ('node',)):
+        node_id = int(elem.get('id'))
+        if wanted is None or node_id in wanted:
+            yield node_id, float(elem.get('lon')), float(elem.get('lat'))
+
+
+def iter_elements(path, keep_node, keep_way):
+    """Yield ('node', id, lon, lat) and ('way', id, node ids, tags) in file order, in one pass.
+
+    OSM files list every node before the ways, so a caller can collect the
+    node coordinates it needs before the first way arrives.
+    """
+    for elem in _elements(path, ('node', 'way')):
+        if elem.tag == 'node':
+            lon, lat = float(elem.get('lon')), float(elem.get('lat'))
+            if keep_node(lon, lat):
+                yield 'node', int(elem.get('id')), lon, lat
+        else:
+            tags = _tags(elem)
+            if keep_way(tags):
+                yield 'way', int(elem.get('id')), _refs(elem), tags
+
+
+def is_road(tags):
+    return tags.get('highway') in ROAD_SPEEDS and tags.get('access') not in ('private', 'no')
+
+
+def road_speed(tags):
+    """Speed in km/h from maxspeed when it is a plain number, else the highway default."""
+    value = tags.get('maxspeed', '').split(' ')
+    if value[0].isdigit():
+        return float(value[0]) * (1.609 if value[-1] == 'mph' else 1)
+    return float(ROAD_SPEEDS[tags['highway']])
+
+
+def oneway(tags):
+    """1 for forward only, -1 for reverse only, 0 for both directions."""
+    value = tags.get('oneway')
+    if value in ('yes', 'true', '1'):
+        return 1
+    if value == '-1':
+        return -1
+    if value is None and (tags.get('highway') in ('motorway', 'motorway_link')
+                          or tags.get('junction') == 'roundabout'):
+        return 1
+    return 0
@@ -0,0 +1,368 @@
+"""Rational Agent Access Model (RAAM) solved with numpy.
+
+Follows the access package's RAAM: every barangay starts at its nearest
+hospital, then each cycle moves people from the hospital that costs it most
+to the one that costs it least, where cost is travel time over tau plus
+hospital load over beds scaled by rho (population per bed). The move is the
+one that equalizes the two hospitals' costs, capped at a share of the
+barangay's population that starts at `initial_step` and halves every
+`half_life` cycles down to `min_step`; for the first `limit_initial` cycles
+no hospital takes more newcomers than its scaled beds.
+
+Solutions are kept with a leading batch axis (one row per supply column,
+each solved on its own), and can be produced progressively: `iterate` yields intermediate results,
+and a solution cached for a nearby tau is used as the starting point.
+
+Run from the src folder to time the first coarse result, the converged
+solve and the access package on the app's data:
+
+    python -m utils.raam [--tau 30]
+"""
+import argparse
+import multiprocessing
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+MAX_CYCLES = 150
+INITIAL_STEP = 0.2
+MIN_STEP = 0.005
+HALF_LIFE = 50
+LIMIT_INITIAL = 20
+
+#relative gap between a barangay's worst and best hospital cost below which the solve stops
+TOLERANCE = 1e-3
+
+#a warm start skips the large early steps
+WARM_START_CYCLE = HALF_LIFE
+
+RaamResult = namedtuple('RaamResult', ['scores', 'allocation', 'cycle', 'gap', 'converged'])
+
+
+class RaamProblem:
+    """Demand, supply (one row per supply column) and a dense travel cost matrix.
+
+    The cost matrix is (demand, supply), shared by every row, or
+    (rows, demand, supply) when rows differ in travel times too.
+    """
+
+    def __init__(self, demand, supply, cost, demand_ids=None, supply_ids=None, supply_names=None):
+        self.demand = np.asarray(demand, dtype=np.float64)
+        self.supply = np.atleast_2d(np.asarray(supply, dtype=np.float64))
+        self.cost = np.asarray(cost, dtype=np.float64)
+        self.demand_ids = np.arange(len(self.demand)) if demand_ids is None else np.asarray(demand_ids)
+        self.supply_ids = np.arange(self.supply.shape[1]) if supply_ids is None else np.asarray(supply_ids)
+        self.supply_names = list(supply_names) if supply_names else [f'supply_{k}' for k in range(len(self.supply))]
+
+    @classmethod
+    def from_frames(cls, demand_df, demand_index, demand_value, supply_df, supply_index, supply_values,
+                    cost_df, cost_origin, cost_dest, cost_name):
+        """Problem from the same frames and column names the access package takes."""
+        supply_values = [supply_values] if isinstance(supply_values, str) else list(supply_values)
+        demand_ids = demand_df[demand_index].to_numpy()
+        supply_ids = supply_df[supply_index].to_numpy()
+
+        d = pd.Index(demand_ids).get_indexer(cost_df[cost_origin])
+        s = pd.Index(supply_ids).get_indexer(cost_df[cost_dest])
+        known = (d >= 0) & (s >= 0)
+        cost = np.full((len(demand_ids), len(supply_ids)), np.inf)
+        np.minimum.at(cost, (d[known], s[known]), cost_df[cost_name].to_numpy(dtype=np.float64)[known])
+
+        supply = supply_df[supply_values].fillna(0).to_numpy(dtype=np.float64).T
+        return cls(demand_df[demand_value].to_numpy(dtype=np.float64), supply, cost,
+                   demand_ids, supply_ids, supply_values)
+
+    @property
+    def batch_cost(self):
+        return self.cost if self.cost.ndim == 3 else self.cost[None]
+
+    def available(self):
+        #(K, D, S): a pair is usable if it is routable and the hospital has supply of that kind
+        return np.isfinite(self.batch_cost) & (self.supply > 0)[:, None, :]
+
+    def row(self, k):
+        """The problem of supply row k alone."""
+        return RaamProblem(self.demand, self.supply[k], self.cost if self.cost.ndim == 2 else self.cost[k],
+                           self.demand_ids, self.supply_ids, [self.supply_names[k]])
+
+    def rho(self):
+        #population per unit of supply, one per row, as access defaults it
+        with np.errstate(divide='ignore'):
+            return self.demand.sum() / self.supply.sum(axis=1)
+
+    def initial_allocation(self):
+        travel = np.where(self.available(), self.batch_cost, np.inf)
+        nearest = travel.argmin(axis=2)
+        k, d = np.nonzero(np.isfinite(travel.min(axis=2)) & (self.demand > 0)[None])
+        allocation = np.zeros(travel.shape)
+        allocation[k, d, nearest[k, d]] = self.demand[d]
+        return allocation
+
+
+def step_size(cycle, initial_step=INITIAL_STEP, min_step=MIN_STEP, half_life=HALF_LIFE):
+    return max(initial_step * 0.5 ** (cycle / half_life), min_step)
+
+
+def _scores(problem, allocation, assigned, travel, congestion):
+    #population-weighted cost of the hospitals each barangay uses; travel and congestion are 0 where unused
+    weighted = (np.einsum('kds,kds->kd', allocation, np.broadcast_to(travel, allocation.shape))
+                + np.einsum('kds,ks->kd', allocation, congestion))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(assigned > 0, weighted / problem.demand[None], np.nan)
+
+
+def iterate(problem, tau, rho=None, allocation=None, **kwargs):
+    """Yield a RaamResult after `first_report` cycles, then every `report_every`, and a last one.
+
+    A row stops moving once its gap is below `tolerance` or no one moves any
+    more, and its solve ends then or after `max_cycles`. Rows don't interact,
+    so each is solved on its own and the results are stacked: one row's
+    arrays stay in cache, a whole batch's don't, and the batched loop was
+    slower than one solve per row.
+    """
+    rho = problem.rho() if rho is None else rho
+    rho = np.broadcast_to(np.asarray(rho, dtype=np.float64), (len(problem.supply),))
+    if len(problem.supply) == 1:
+        yield from _iterate(problem, tau, rho, allocation, **kwargs)
+        return
+
+    rows = [_iterate(problem.row(k), tau, rho[k:k + 1], None if allocation is None else allocation[k:k + 1],
+                     **kwargs) for k in range(len(problem.supply))]
+    latest = [None] * len(rows)
+    while True:
+        #every row reports at the same cycles until it stops; a stopped row keeps its last result
+        advanced = False
+        for k, row in enumerate(rows):
+            result = next(row, None)
+            if result is not None:
+                latest[k], advanced = result, True
+        if not advanced:
+            return
+        yield RaamResult(np.concatenate([result.scores for result in latest]),
+                         np.concatenate([result.allocation for result in latest]),
+                         max(result.cycle for result in latest),
+                         max(result.gap for result in latest),
+                         all(result.converged for result in latest))
+
+
+def _iterate(problem, tau, rho, allocation=None, start_cycle=0, max_cycles=MAX_CYCLES,
+             initial_step=INITIAL_STEP, min_step=MIN_STEP, half_life=HALF_LIFE, limit_initial=LIMIT_INITIAL,
+             tolerance=TOLERANCE, first_report=None, report_every=10):
+    tau = max(float(tau), 1.0)
+    allocation = problem.initial_allocation() if allocation is None else allocation.astype(np.float64)
+    first_report = report_every if first_report is None else first_report
+
+    #supply in people, and travel in units of tau; neither changes between cycles
+    capacity = problem.supply * rho[:, None]
+    available = problem.available()
+    travel = np.where(available, problem.batch_cost / tau, np.inf)
+    finite_travel = np.where(available, travel, 0)
+    n_rows, n_demand, _ = allocation.shape
+    k, d = np.indices((n_rows, n_demand))
+    t = k if travel.shape[0] > 1 else np.zeros_like(k)
+    settled = np.zeros(n_rows, dtype=bool)
+    priced = None
+    for cycle in range(start_cycle, start_cycle + max_cycles + 1):
+        load = allocation.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            congestion = np.where(capacity > 0, load / capacity, 0)
+        total = travel + np.where(capacity > 0, congestion, np.inf)[:, None, :]
+        worst = np.where(allocation > 0, total, -np.inf).argmax(axis=2)
+        best = total.argmin(axis=2)
+        assigned = allocation.sum(axis=2)
+        active = assigned > 0
+        with np.errstate(invalid='ignore'):
+            difference = np.where(active, total[k, d, worst] - total[k, d, best], 0)
+
+        #as in access, the allocation is priced at the costs that prompted its last moves
+        scores = _scores(problem, allocation, assigned, finite_travel, congestion if priced is None else priced)
+        priced = congestion
+        weight = np.where(active, problem.demand[None], 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gap = np.nan_to_num((weight * difference).sum(axis=1) / np.nansum(weight * scores, axis=1))
+
+        elapsed = cycle - start_cycle
+        settled |= gap < tolerance
+        converged = bool(settled.all())
+        last = converged or elapsed == max_cycles
+        if last or elapsed == first_report or (elapsed > first_report and elapsed % report_every == 0):
+            yield RaamResult(scores, allocation.copy(), cycle, float(gap.max()), converged)
+        if last:
+            return
+
+        #people at the best hospital that equalize its cost with the worst's, given everyone else there
+        cap_best, cap_worst = capacity[k, best], capacity[k, worst]
+        at_best, at_worst = allocation[k, d, best], allocation[k, d, worst]
+        others_best, others_worst = load[k, best] - at_best, load[k, worst] - at_worst
+        moving = active & (best != worst) & ~settled[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            target = (cap_best * cap_worst / (cap_best + cap_worst)) * (
+                travel[t, d, worst] - travel[t, d, best]
+                + (at_best + at_worst + others_worst) / cap_worst - others_best / cap_best)
+            move = np.where(moving, np.clip(target - at_best, -at_best, at_worst), 0)
+        #whole people, at most the step's share of the barangay
+        step = step_size(cycle, initial_step, min_step, half_life)
+        move = np.trunc(np.minimum(move, step * problem.demand[None]))
+
+        #early on, no hospital takes more newcomers than its capacity
+        if cycle < limit_initial:
+            arrivals = np.zeros(load.shape)
+            np.add.at(arrivals, (k, best), move)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scale = np.maximum(np.nan_to_num(arrivals / capacity), 1)
+            move = np.round(move / scale[k, best])
+
+        #rows where no one moves have reached access's fixed point
+        settled |= ~(move != 0).any(axis=1)
+        allocation[k, d, worst] -= move
+        allocation[k, d, best] += move
+
+
+def map_batches(fn, tasks, jobs=None):
+    """fn over tasks in a process pool, or in this process when a pool can't or needn't be used."""
+    #a daemonic process (a pool worker) cannot start a pool of its own; Dash's background
+    #jobs run in ordinary (non-daemon) processes started by DiskcacheManager, so they can
+    if jobs == 1 or len(tasks) <= 1 or multiprocessing.current_process().daemon:
+        return [fn(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(fn, tasks))
+
+
+def solve(problem, tau, **kwargs):
+    """Run to convergence (or max_cycles) and return the last RaamResult."""
+    for result in iterate(problem, tau, report_every=MAX_CYCLES + 1, **kwargs):
+        pass
+    return result
+
+
+class RaamCache:
+    """Solutions per scenario and tau, kept in a diskcache store shared by workers."""
+
+    def __init__(self, store, namespace='raam'):
+        self.store = store
+        self.namespace = namespace
+
+    def _taus_key(self, scenario):
+        return (self.namespace, 'taus', scenario)
+
+    def get(self, scenario, tau):
+        return self.store.get((self.namespace, scenario, tau), retry=True)
+
+    def nearest(self, scenario, tau):
+        """Cached solution with the closest tau, or None."""
+        taus = self.store.get(self._taus_key(scenario), default=[], retry=True)
+        if not taus:
+            return None
+        return self.get(scenario, min(taus, key=lambda cached: abs(cached - tau)))
+
+    def put(self, scenario, tau, result):
+        #allocations are stored as float32 to keep entries around a megabyte
+        self.store.set((self.namespace, scenario, tau),
+                       result._replace(allocation=result.allocation.astype(np.float32)), retry=True)
+        with self.store.transact(retry=True):
+            taus = self.store.get(self._taus_key(scenario), default=[])
+            if tau not in taus:
+                self.store.set(self._taus_key(scenario), sorted(taus + [tau]))
+
+
+def progressive(problem, tau, cache=None, scenario=None, **kwargs):
+    """Like `iterate`, starting from the cached solution for the nearest tau.
+
+    An exact cached solution is yielded at once; the final result is cached.
+    """
+    if cache is not None:
+        cached = cache.get(scenario, tau)
+        if cached is not None:
+            yield cached
+            return
+        warm = cache.nearest(scenario, tau)
+        if warm is not None:
+            kwargs.setdefault('allocation', warm.allocation)
+            kwargs.setdefault('start_cycle', WARM_START_CYCLE)
+            #and ends at the same cycle, and step, as a cold solve
+            kwargs.setdefault('max_cycles', MAX_CYCLES - WARM_START_CYCLE)
+
+    for result in iterate(problem, tau, **kwargs):
+        yield result
+    if cache is not None:
+        cache.put(scenario, tau, result)
+
+
+def result_frame(problem, result, name, index_name=None):
+    """Scores as a DataFrame like Access.access_df: one `{name}_{supply}` column per supply row."""
+    return pd.DataFrame({f'{name}_{supply_name}': result.scores[k]
+                         for k, supply_name in enumerate(problem.supply_names)},
+                        index=pd.Index(problem.demand_ids, name=index_name))
+
+
+if __name__ == '__main__':
+    import geopandas as gpd
+    from access import Access
+
+    parser = argparse.ArgumentParser(description='Time RAAM solves on the app data.')
+    parser.add_argument('--tau', type=int, default=30, help='travel time in minutes')
+    args = parser.parse_args()
+
+    ncr_boundary_pop = gpd.read_file('../data/analytics/ncr_boundary_pop.geojson')
+    ncr_hosp = gpd.read_file('../data/analytics/ncr_hosp.geojson')
+    travel_matrix = pd.read_csv('../data/analytics/travel_matrix.csv')
+    tau = args.tau * 60
+
+    start = time.perf_counter()
+    problem = RaamProblem.from_frames(ncr_boundary_pop, 'brgy_index', 'population', ncr_hosp, 'hospital_index',
+                                      'bed_capacity', travel_matrix, 'brgy_index', 'hospital_index', 'duration')
+    setup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    first = next(iterate(problem, tau, first_report=5))
+    first_paint = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = solve(problem, tau)
+    full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    warm = solve(problem, tau + 60, allocation=result.allocation, start_cycle=WARM_START_CYCLE,
+                 max_cycles=MAX_CYCLES - WARM_START_CYCLE)
+    warm_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    access = Access(demand_df=ncr_boundary_pop, demand_index='brgy_index', demand_value='population',
+                    supply_df=ncr_hosp, supply_index='hospital_index', supply_value='bed_capacity',
+                    cost_df=travel_matrix, cost_origin='brgy_index', cost_dest='hospital_index',
+                    cost_name='duration')
+    access.raam(name='raam', tau=tau)
+    reference = time.perf_counter() - start
+
+    ours = pd.Series(result.scores[0], index=problem.demand_ids)
+    theirs = access.access_df['raam_bed_capacity'].reindex(problem.demand_ids)
+    print(f'setup              {setup * 1000:8.1f} ms')
+    print(f'first result       {first_paint * 1000:8.1f} ms  (cycle {first.cycle}, gap {first.gap:.2%})')
+    print(f'full solve         {full * 1000:8.1f} ms  ({result.cycle} cycles, gap {result.gap:.2%})')
+    print(f'warm start tau+1m  {warm_time * 1000:8.1f} ms  ({warm.cycle - WARM_START_CYCLE} cycles)')
+    print(f'access package     {reference * 1000:8.1f} ms')
+    print(f'rank correlation with access: {ours.corr(theirs, method="spearman"):.3f}, '
+          f'median {ours.median():.4f} vs {theirs.median():.4f}, largest difference {(ours - theirs).abs().max():.2e}')
+
+    #beds by level solved as one problem (rows solved in turn) against one problem per level
+    level_3 = ncr_hosp['service_capability'] == 'Level 3'
+    ncr_hosp['beds_level_2_up'] = ncr_hosp['bed_capacity'].where(level_3 | (ncr_hosp['service_capability'] == 'Level 2'), 0)
+    ncr_hosp['beds_level_3'] = ncr_hosp['bed_capacity'].where(level_3, 0)
+    levels = ['bed_capacity', 'beds_level_2_up', 'beds_level_3']
+
+    start = time.perf_counter()
+    batched = RaamProblem.from_frames(ncr_boundary_pop, 'brgy_index', 'population', ncr_hosp, 'hospital_index',
+                                      levels, travel_matrix, 'brgy_index', 'hospital_index', 'duration')
+    solve(batched, tau)
+    batched_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for level in levels:
+        single = RaamProblem.from_frames(ncr_boundary_pop, 'brgy_index', 'population', ncr_hosp, 'hospital_index',
+                                         level, travel_matrix, 'brgy_index', 'hospital_index', 'duration')
+        solve(single, tau)
+    separate_time = time.perf_counter() - start
+    print(f'{len(levels)} levels as one problem {batched_time * 1000:8.1f} ms, as separate problems {separate_time * 1000:8.1f} ms')
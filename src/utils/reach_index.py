@@ -0,0 +1,92 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+Reach = namedtuple('Reach', ['hospital_index', 'hospital_count', 'bed_capacity', 'level_counts', 'duration'])
+
+
+class ReachIndex:
+    """Hospitals of every barangay sorted by travel time, with running totals.
+
+    Rows of the travel matrix are stored barangay by barangay (CSR layout),
+    each barangay's slice sorted by duration. Prefix sums of bed capacity and
+    hospital counts per liquefaction potential (and per service level) turn
+    "hospitals reachable in under N minutes outside potentials P" into one
+    binary search and a few subtractions. Potentials are those of the travel
+    matrix rows, which the zone selectors name; barangays without travel
+    times reach no hospital.
+    """
+
+    def __init__(self, travel_matrix, ncr_hosp):
+        hospitals = ncr_hosp.drop_duplicates('hospital_index').set_index('hospital_index')
+        self.hospital_ids = hospitals.index.to_numpy()
+        self.levels = sorted(pd.unique(hospitals['service_capability']))
+
+        level_code = pd.Index(self.levels).get_indexer(hospitals['service_capability'])
+        beds = hospitals['bed_capacity'].fillna(0).to_numpy(dtype=np.int64)
+
+        #one row per barangay-hospital pair, the fastest route if listed twice
+        pairs = (travel_matrix[['brgy_index', 'hospital_index', 'duration', 'potential']]
+                 .sort_values('duration')
+                 .drop_duplicates(['brgy_index', 'hospital_index']))
+        pairs = pairs.loc[pairs['hospital_index'].isin(self.hospital_ids)]
+
+        self.brgy_ids = np.unique(pairs['brgy_index'].to_numpy())
+        brgy_pos = np.searchsorted(self.brgy_ids, pairs['brgy_index'].to_numpy())
+        hosp_pos = pd.Index(self.hospital_ids).get_indexer(pairs['hospital_index'])
+        durations = pairs['duration'].to_numpy(dtype=np.float64)
+        potential = pairs['potential'].astype(object).to_numpy()
+        self.potentials = list(pd.unique(potential))
+        potential_code = pd.Index(self.potentials).get_indexer(potential)
+
+        order = np.lexsort((durations, brgy_pos))
+        self.durations = durations[order]
+        self.hospitals = hosp_pos[order].astype(np.int32)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(brgy_pos, minlength=len(self.brgy_ids)))])
+
+        #prefix sums over the whole array; a barangay's totals are differences within its slice
+        n_potentials, n_levels = len(self.potentials), len(self.levels)
+        row_potential = potential_code[order]
+        row_level = level_code[self.hospitals]
+
+        bed_rows = np.zeros((len(order) + 1, n_potentials), dtype=np.int64)
+        bed_rows[np.arange(1, len(order) + 1), row_potential] = beds[self.hospitals]
+        self.bed_prefix = np.cumsum(bed_rows, axis=0, dtype=np.int64)
+
+        count_rows = np.zeros((len(order) + 1, n_potentials, n_levels), dtype=np.int32)
+        count_rows[np.arange(1, len(order) + 1), row_potential, row_level] = 1
+        self.count_prefix = np.cumsum(count_rows, axis=0, dtype=np.int32)
+
+        self.row_potential = row_potential
+
+    def _slice(self, brgy_index, seconds):
+        b = np.searchsorted(self.brgy_ids, brgy_index)
+        if b == len(self.brgy_ids) or self.brgy_ids[b] != brgy_index:
+            #no travel times, so an empty slice
+            return 0, 0
+        lo, hi = self.offsets[b], self.offsets[b + 1]
+        #strictly faster than the threshold, like duration/60 < minutes
+        k = lo + np.searchsorted(self.durations[lo:hi], seconds, side='left')
+        return lo, k
+
+    def _kept(self, excluded_potentials):
+        return np.array([p not in excluded_potentials for p in self.potentials])
+
+    def query(self, brgy_index, minutes, excluded_potentials=()):
+        """Hospitals a barangay reaches in under `minutes` outside the excluded potentials, nearest first."""
+        lo, k = self._slice(brgy_index, minutes * 60)
+        kept = self._kept(excluded_potentials)
+
+        bed_capacity = int((self.bed_prefix[k] - self.bed_prefix[lo])[kept].sum())
+        by_level = (self.count_prefix[k] - self.count_prefix[lo])[kept].sum(axis=0)
+
+        rows = np.arange(lo, k)
+        rows = rows[kept[self.row_potential[rows]]]
+        hospital_index = self.hospital_ids[self.hospitals[rows]]
+
+        return Reach(hospital_index=hospital_index,
+                     hospital_count=int(by_level.sum()),
+                     bed_capacity=bed_capacity,
+                     level_counts=dict(zip(self.levels, by_level.tolist())),
+                     duration=self.durations[rows])
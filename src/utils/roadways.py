@@ -0,0 +1,165 @@
+"""Roads lying on liquefiable areas, extracted from an OpenStreetMap extract.
+
+Run from the src folder:
+
+    python -m utils.roadways ../data/raw/metro_manila.osm.bz2
+"""
+import argparse
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from utils import osm
+from utils.exposure import ANALYTICS_DIR, POTENTIALS, PROJECTED_CRS, exclusive_zones
+
+LIQF_ROADWAYS = os.path.join(ANALYTICS_DIR, 'liqf_roadways_gdf.geojson')
+LIQF_ROADWAYS_KM = os.path.join(ANALYTICS_DIR, 'liqf_roadways_km.csv')
+
+#road classes drawn on the Liquefaction Potential page; links count as their road
+ROADWAY_TYPES = ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'unclassified', 'residential']
+
+#ways clipped per batch
+CHUNK_SIZE = 20000
+
+#margin around the zones, in degrees, within which node coordinates are kept
+BBOX_MARGIN = 0.02
+
+
+def roadway_type(tags):
+    highway = tags.get('highway', '')
+    highway = highway[:-len('_link')] if highway.endswith('_link') else highway
+    return highway if highway in ROADWAY_TYPES else None
+
+
+class _FeatureWriter:
+    #GeoJSON written one feature at a time, never held as a whole
+    def __init__(self, f):
+        self.f = f
+        self.first = True
+        f.write('{"type": "FeatureCollection", "crs": {"type": "name", "properties": '
+                '{"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}}, "features": [\n')
+
+    def write(self, properties, geometry):
+        feature = {'type': 'Feature', 'properties': properties, 'geometry': json.loads(shapely.to_geojson(geometry))}
+        self.f.write(('' if self.first else ',\n') + json.dumps(feature))
+        self.first = False
+
+    def close(self):
+        self.f.write('\n]}\n')
+
+
+def _lines_only(geom):
+    #a road touching a zone's edge leaves points next to the clipped lines
+    if shapely.get_type_id(geom) in (1, 5):
+        return geom
+    parts = [part for part in shapely.get_parts(geom) if shapely.get_type_id(part) == 1]
+    return shapely.multilinestrings(parts) if parts else None
+
+
+def _clip_chunk(ways, zone_geoms, zone_potential, tree, writer, lengths):
+    if not ways:
+        return 0
+    runs = [coords for _, _, coords in ways]
+    lines = shapely.linestrings(np.concatenate(runs),
+                                indices=np.repeat(np.arange(len(runs)), [len(run) for run in runs]))
+    way_pos, zone_pos = tree.query(lines, predicate='intersects')
+    if not len(way_pos):
+        return 0
+    pieces = np.array([_lines_only(piece) for piece in shapely.intersection(lines[way_pos], zone_geoms[zone_pos])],
+                      dtype=object)
+    km = gpd.GeoSeries(pieces, crs='EPSG:4326').to_crs(PROJECTED_CRS).length.to_numpy() / 1000
+
+    written = 0
+    for way, zone, piece, piece_km in zip(way_pos, zone_pos, pieces, km):
+        if piece is None or piece_km <= 0:
+            continue
+        way_id, highway_type, _ = ways[way]
+        potential = zone_potential[zone]
+        writer.write({'@osmId': f'way/{way_id}', 'type': highway_type, 'potential': potential,
+                      'length_km': round(float(piece_km), 4)}, piece)
+        lengths[potential, highway_type] += piece_km
+        written += 1
+    return written
+
+
+def extract_roadways(osm_path, liquefaction_map, output, chunk_size=CHUNK_SIZE, log=print):
+    """Clip the extract's roads to the liquefaction classes and write them as GeoJSON.
+
+    The extract is read in one streaming pass. Only nodes near the zones are
+    kept, and ways are clipped and written in batches of `chunk_size`, so
+    memory depends on the zones' extent and the batch size, not on the
+    extract. Returns the km of road per class and road type.
+    """
+    zones = exclusive_zones(liquefaction_map)
+    zone_geoms = np.asarray(zones.geometry.values)
+    zone_potential = zones['potential'].to_numpy()
+    tree = shapely.STRtree(zone_geoms)
+
+    min_lon, min_lat, max_lon, max_lat = shapely.total_bounds(zone_geoms)
+    min_lon, min_lat = min_lon - BBOX_MARGIN, min_lat - BBOX_MARGIN
+    max_lon, max_lat = max_lon + BBOX_MARGIN, max_lat + BBOX_MARGIN
+
+    def near_zones(lon, lat):
+        return min_lon <= lon <= max_lon and min_lat <= lat <= max_lat
+
+    coords = {}
+    chunk = []
+    lengths = defaultdict(float)
+    n_ways = n_pieces = 0
+
+    with open(output, 'w') as f:
+        writer = _FeatureWriter(f)
+        for element in osm.iter_elements(osm_path, near_zones, roadway_type):
+            if element[0] == 'node':
+                _, node_id, lon, lat = element
+                coords[node_id] = (lon, lat)
+                continue
+
+            _, way_id, refs, tags = element
+            #ways leaving the zones' extent keep their runs of known nodes
+            run = []
+            for ref in refs + [None]:
+                if ref in coords:
+                    run.append(coords[ref])
+                    continue
+                if len(run) >= 2:
+                    chunk.append((way_id, roadway_type(tags), run))
+                run = []
+
+            if len(chunk) >= chunk_size:
+                n_ways += len(chunk)
+                n_pieces += _clip_chunk(chunk, zone_geoms, zone_potential, tree, writer, lengths)
+                chunk = []
+                log(f'{n_ways} ways read, {n_pieces} pieces on liquefiable areas')
+
+        n_ways += len(chunk)
+        n_pieces += _clip_chunk(chunk, zone_geoms, zone_potential, tree, writer, lengths)
+        writer.close()
+
+    log(f'{n_ways} ways read, {n_pieces} pieces on liquefiable areas')
+    return roadway_lengths(lengths)
+
+
+def roadway_lengths(lengths):
+    """Long table of km per class and road type, every combination listed."""
+    index = pd.MultiIndex.from_product([POTENTIALS, ROADWAY_TYPES], names=['potential', 'type'])
+    km = pd.Series(dict(lengths), dtype=float).reindex(index, fill_value=0.0)
+    return km.round(3).rename('length_km').reset_index()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract roads lying on liquefiable areas.')
+    parser.add_argument('osm', help='OSM XML extract (.osm, .osm.bz2 or .osm.gz)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='ways clipped per batch')
+    args = parser.parse_args()
+
+    liquefaction_map = gpd.read_file(os.path.join(ANALYTICS_DIR, 'liquefaction_map.geojson'))
+    lengths = extract_roadways(args.osm, liquefaction_map, LIQF_ROADWAYS, args.chunk_size)
+    lengths.to_csv(LIQF_ROADWAYS_KM, index=False)
+    print(lengths.pivot(index='type', columns='potential', values='length_km').loc[ROADWAY_TYPES, POTENTIALS])
+    print(f'wrote {LIQF_ROADWAYS} and {LIQF_ROADWAYS_KM}')
@@ -0,0 +1,265 @@
+"""Offline barangay to hospital travel times over an OpenStreetMap road graph.
+
+Run from the src folder:
+
+    python -m utils.routing --osm ../data/raw/metro_manila.osm.bz2
+    python -m utils.routing --synthetic
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.spatial import cKDTree
+
+from utils import osm
+from utils.exposure import ANALYTICS_DIR, PROJECTED_CRS
+
+TRAVEL_MATRIX_OSM = os.path.join(ANALYTICS_DIR, 'travel_matrix_osm.csv')
+ROAD_GRAPH = os.path.join(ANALYTICS_DIR, 'road_graph.npz')
+
+#straight-line speed from a centroid or hospital to its snapped road node, km/h
+ACCESS_SPEED = 10
+
+#hospitals per Dijkstra task sent to a worker
+CHUNK_SIZE = 8
+
+EARTH_RADIUS = 6371008.8
+
+#Metro Manila, lon/lat
+NCR_BBOX = (120.90, 14.35, 121.15, 14.78)
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    """Great-circle distance in meters."""
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def _local_xy(lon, lat):
+    #equirectangular meters, accurate enough for nearest-node lookups within a city
+    lat0 = np.radians(14.6)
+    return np.column_stack([np.radians(lon) * EARTH_RADIUS * np.cos(lat0), np.radians(lat) * EARTH_RADIUS])
+
+
+class RoadGraph:
+    """Directed road graph: node coordinates and edges weighted by travel seconds."""
+
+    def __init__(self, lon, lat, tail, head, seconds, node_ids=None):
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.tail = np.asarray(tail, dtype=np.int32)
+        self.head = np.asarray(head, dtype=np.int32)
+        self.seconds = np.asarray(seconds, dtype=np.float64)
+        self.node_ids = np.arange(len(self.lon)) if node_ids is None else np.asarray(node_ids)
+        self._tree = None
+
+    @property
+    def n_nodes(self):
+        return len(self.lon)
+
+    def matrix(self, seconds=None):
+        """Sparse adjacency matrix; parallel edges keep the fastest."""
+        seconds = self.seconds if seconds is None else seconds
+        usable = np.isfinite(seconds)
+        tail, head, seconds = self.tail[usable], self.head[usable], seconds[usable]
+
+        #csr_matrix adds duplicate entries up, so only the fastest edge of each pair is kept
+        order = np.lexsort((seconds, head, tail))
+        tail, head, seconds = tail[order], head[order], seconds[order]
+        first = np.ones(len(tail), dtype=bool)
+        first[1:] = (tail[1:] != tail[:-1]) | (head[1:] != head[:-1])
+        return csr_matrix((seconds[first], (tail[first], head[first])), shape=(self.n_nodes, self.n_nodes))
+
+    def _snap_tree(self):
+        #snapping only to the largest strongly connected part avoids dead-end islands
+        if self._tree is None:
+            _, labels = connected_components(self.matrix(), directed=True, connection='strong')
+            self._snap_nodes = np.flatnonzero(labels == np.bincount(labels).argmax())
+            self._tree = cKDTree(_local_xy(self.lon[self._snap_nodes], self.lat[self._snap_nodes]))
+        return self._tree
+
+    def snap(self, lon, lat):
+        """Nearest routable node of each point, and the distance to it in meters."""
+        distance, pos = self._snap_tree().query(_local_xy(np.asarray(lon), np.asarray(lat)))
+        return self._snap_nodes[pos], distance
+
+    @classmethod
+    def from_osm(cls, path):
+        """Road graph of an OSM XML extract, read in two streaming passes."""
+        tails, heads, speeds, directions = [], [], [], []
+        for _, refs, tags in osm.iter_ways(path, osm.is_road):
+            speed, direction = osm.road_speed(tags), osm.oneway(tags)
+            tails.extend(refs[:-1])
+            heads.extend(refs[1:])
+            speeds.extend([speed] * (len(refs) - 1))
+            directions.extend([direction] * (len(refs) - 1))
+
+        tails, heads = np.array(tails, dtype=np.int64), np.array(heads, dtype=np.int64)
+        wanted = set(np.unique(np.concatenate([tails, heads])).tolist())
+        coords = {node_id: (lon, lat) for node_id, lon, lat in osm.iter_nodes(path, wanted)}
+
+        node_ids = np.array(sorted(coords), dtype=np.int64)
+        lon = np.array([coords[i][0] for i in node_ids])
+        lat = np.array([coords[i][1] for i in node_ids])
+
+        #ways clipped at the extract's edge reference nodes that are not in it
+        present = np.isin(tails, node_ids) & np.isin(heads, node_ids)
+        tail = np.searchsorted(node_ids, tails[present])
+        head = np.searchsorted(node_ids, heads[present])
+        speeds = np.array(speeds)[present]
+        directions = np.array(directions)[present]
+
+        seconds = haversine(lon[tail], lat[tail], lon[head], lat[head]) / (speeds / 3.6)
+        forward, backward = directions >= 0, directions <= 0
+        return cls(lon, lat,
+                   np.concatenate([tail[forward], head[backward]]),
+                   np.concatenate([head[forward], tail[backward]]),
+                   np.concatenate([seconds[forward], seconds[backward]]),
+                   node_ids)
+
+    def save(self, path):
+        np.savez(path, lon=self.lon, lat=self.lat, tail=self.tail, head=self.head,
+                 seconds=self.seconds, node_ids=self.node_ids)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['lon'], data['lat'], data['tail'], data['head'], data['seconds'], data['node_ids'])
+
+
+def synthetic_graph(rows=40, cols=40, bbox=NCR_BBOX, seed=0):
+    """Jittered grid of two-way streets with faster avenues, for tests and benchmarks."""
+    rng = np.random.default_rng(seed)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    grid_lon, grid_lat = np.meshgrid(np.linspace(min_lon, max_lon, cols), np.linspace(min_lat, max_lat, rows))
+    step = (max_lon - min_lon) / cols
+    lon = grid_lon.ravel() + rng.uniform(-0.2, 0.2, rows * cols) * step
+    lat = grid_lat.ravel() + rng.uniform(-0.2, 0.2, rows * cols) * step
+
+    node = np.arange(rows * cols).reshape(rows, cols)
+    tail = np.concatenate([node[:, :-1].ravel(), node[:-1, :].ravel()])
+    head = np.concatenate([node[:, 1:].ravel(), node[1:, :].ravel()])
+
+    #every fifth row and column is an avenue
+    avenue = (np.concatenate([np.repeat(np.arange(rows) % 5 == 0, cols - 1),
+                              np.tile(np.arange(cols) % 5 == 0, rows - 1)]))
+    speed = np.where(avenue, 40.0, 20.0) / 3.6
+    seconds = haversine(lon[tail], lat[tail], lon[head], lat[head]) / speed
+
+    return RoadGraph(lon, lat, np.concatenate([tail, head]), np.concatenate([head, tail]),
+                     np.concatenate([seconds, seconds]))
+
+
+_worker_graph = None
+
+
+def _init_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _dijkstra_chunk(task):
+    sources, predecessors = task
+    return dijkstra(_worker_graph, directed=True, indices=sources, return_predecessors=predecessors)
+
+
+def shortest_trees(matrix, sources, jobs=None, predecessors=False):
+    """Travel seconds from every node to each source node, shape (sources, nodes).
+
+    Dijkstra runs forward from the sources on the reversed graph, so one run
+    per hospital covers every barangay. Hospitals are split across processes.
+    With `predecessors`, also returns each tree as the next node on the way
+    to the source (-9999 where there is none).
+    """
+    reverse = matrix.T.tocsr()
+    sources = np.asarray(sources)
+    tasks = [(sources[i:i + CHUNK_SIZE], predecessors) for i in range(0, len(sources), CHUNK_SIZE)]
+    #a daemonic process (a pool worker) cannot start a pool of its own, so it runs the chunks itself
+    if jobs == 1 or len(tasks) <= 1 or multiprocessing.current_process().daemon:
+        _init_worker(reverse)
+        results = [_dijkstra_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(reverse,)) as pool:
+            results = list(pool.map(_dijkstra_chunk, tasks))
+
+    if predecessors:
+        return (np.vstack([times for times, _ in results]),
+                np.vstack([pred for _, pred in results]).astype(np.int32))
+    return np.vstack(results)
+
+
+def _points(gdf):
+    #barangays are routed from their centroid, computed in meters
+    points = gdf.geometry
+    if not (points.geom_type == 'Point').all():
+        points = points.to_crs(PROJECTED_CRS).centroid.to_crs('EPSG:4326')
+    else:
+        points = points.to_crs('EPSG:4326')
+    return points.x.to_numpy(), points.y.to_numpy()
+
+
+def travel_times(graph, brgy_lon, brgy_lat, hosp_lon, hosp_lat, jobs=None, seconds=None):
+    """Barangay by hospital matrix of travel seconds, inf where unreachable."""
+    brgy_nodes, brgy_gap = graph.snap(brgy_lon, brgy_lat)
+    hosp_nodes, hosp_gap = graph.snap(hosp_lon, hosp_lat)
+
+    #hospitals snapped to the same node share one Dijkstra run
+    unique_nodes, inverse = np.unique(hosp_nodes, return_inverse=True)
+    times = shortest_trees(graph.matrix(seconds), unique_nodes, jobs)
+
+    access = (brgy_gap[:, None] + hosp_gap[None, :]) / (ACCESS_SPEED / 3.6)
+    return times[inverse][:, brgy_nodes].T + access
+
+
+def travel_matrix(graph, ncr_boundary_pop, ncr_hosp, jobs=None, seconds=None):
+    """Travel times in the schema of data/analytics/travel_matrix.csv."""
+    brgy_lon, brgy_lat = _points(ncr_boundary_pop)
+    hosp_lon, hosp_lat = _points(ncr_hosp)
+    durations = travel_times(graph, brgy_lon, brgy_lat, hosp_lon, hosp_lat, jobs, seconds)
+
+    brgy_pos, hosp_pos = np.nonzero(np.isfinite(durations))
+    return pd.DataFrame({
+        'brgy_index': ncr_boundary_pop['brgy_index'].to_numpy()[brgy_pos],
+        'hospital_index': ncr_hosp['hospital_index'].to_numpy()[hosp_pos],
+        'duration': durations[brgy_pos, hosp_pos].round(1),
+        'potential': ncr_hosp['potential'].to_numpy()[hosp_pos],
+    })
+
+
+def load_road_graph(osm_path=None, path=ROAD_GRAPH):
+    """Read the cached graph, building it from the OSM extract the first time."""
+    if os.path.exists(path) and osm_path is None:
+        return RoadGraph.load(path)
+    graph = RoadGraph.from_osm(osm_path)
+    graph.save(path)
+    return graph
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute barangay to hospital travel times offline.')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--osm', help='OSM XML extract (.osm, .osm.bz2 or .osm.gz) to build the graph from')
+    source.add_argument('--synthetic', action='store_true', help='use a synthetic grid instead of OSM')
+    parser.add_argument('--output', default=TRAVEL_MATRIX_OSM)
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    graph = synthetic_graph() if args.synthetic else load_road_graph(args.osm)
+    print(f'graph: {graph.n_nodes} nodes, {len(graph.tail)} edges in {time.perf_counter() - start:.1f}s')
+
+    ncr_boundary_pop = gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_boundary_pop.geojson'))
+    ncr_hosp = gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_hosp.geojson'))
+
+    start = time.perf_counter()
+    matrix = travel_matrix(graph, ncr_boundary_pop, ncr_hosp, args.jobs)
+    matrix.to_csv(args.output)
+    print(f'{len(matrix)} barangay-hospital pairs in {time.perf_counter() - start:.1f}s, wrote {args.output}')
@@ -0,0 +1,201 @@
+"""Travel times with roads in liquefaction zones damaged.
+
+Road segments crossing a selected liquefaction class are closed (High
+Potential) or slowed (Moderate, Low). Only the hospitals whose shortest-path
+trees used a damaged segment are routed again; the others keep their
+undamaged times, which stay optimal since damage only makes roads slower.
+
+Routing runs offline: the damaged/undamaged ratio of every barangay-hospital
+pair is written for each combination of classes, and the app only scales
+the travel matrix by it. Run from the src folder after the road graph is
+built:
+
+    python -m utils.scenario [--jobs 4]
+"""
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from utils.exposure import ANALYTICS_DIR
+from utils.routing import CHUNK_SIZE, ROAD_GRAPH, RoadGraph, _points, shortest_trees
+from utils import datastore
+
+TRAVEL_DEGRADED = os.path.join(ANALYTICS_DIR, 'travel_degraded.npz')
+
+#travel time multiplier of a damaged segment, per liquefaction class; inf closes the road
+DAMAGE_FACTORS = {'High Potential': np.inf, 'Moderate Potential': 3.0, 'Low Potential': 1.5}
+
+POTENTIALS = list(DAMAGE_FACTORS)
+
+#every non-empty set of classes, each in POTENTIALS order
+COMBINATIONS = [combination for n in range(1, len(POTENTIALS) + 1)
+                for combination in itertools.combinations(POTENTIALS, n)]
+
+
+def edge_potentials(graph, liquefaction_map):
+    """Highest liquefaction class each road segment crosses, '' when none."""
+    segments = shapely.linestrings(np.stack([
+        np.column_stack([graph.lon[graph.tail], graph.lat[graph.tail]]),
+        np.column_stack([graph.lon[graph.head], graph.lat[graph.head]]),
+    ], axis=1))
+
+    zones = liquefaction_map.to_crs('EPSG:4326')
+    zone_geoms = np.asarray(zones.geometry.values)
+    zone_rank = pd.Index(POTENTIALS).get_indexer(zones['potential'])
+
+    edge_pos, zone_pos = shapely.STRtree(zone_geoms).query(segments, predicate='intersects')
+    rank = np.full(len(segments), len(POTENTIALS))
+    np.minimum.at(rank, edge_pos, zone_rank[zone_pos])
+    return np.array(POTENTIALS + [''], dtype=object)[rank]
+
+
+class RoadScenarios:
+    """Undamaged routing trees of every hospital, and the damaged travel times derived from them."""
+
+    def __init__(self, graph, liquefaction_map, ncr_boundary_pop, ncr_hosp, jobs=None):
+        self.graph = graph
+        self.jobs = jobs
+        self.edge_potential = edge_potentials(graph, liquefaction_map)
+
+        brgy_lon, brgy_lat = _points(ncr_boundary_pop)
+        hosp_lon, hosp_lat = _points(ncr_hosp)
+        self.brgy_nodes, _ = graph.snap(brgy_lon, brgy_lat)
+        hosp_nodes, _ = graph.snap(hosp_lon, hosp_lat)
+        self.sources, self.hosp_source = np.unique(hosp_nodes, return_inverse=True)
+
+        #Trees are kept only as "does source s route through segment e", for the
+        #segments some liquefaction class can damage. Sources are routed a batch
+        #at a time, so full (sources, nodes) predecessor arrays are never held.
+        self.zone_edges = np.flatnonzero(self.edge_potential != '')
+        matrix = graph.matrix()
+        batch = CHUNK_SIZE * (jobs or os.cpu_count() or 1)
+        times, uses_edge = [], []
+        for i in range(0, len(self.sources), batch):
+            tree_times, predecessors = shortest_trees(matrix, self.sources[i:i + batch], jobs, predecessors=True)
+            times.append(tree_times[:, self.brgy_nodes])
+            #on the reversed graph a tree reaches `tail` through `head` when tail -> head leads to the hospital
+            uses_edge.append(predecessors[:, graph.tail[self.zone_edges]] == graph.head[self.zone_edges])
+        self.times = np.vstack(times)
+        self.uses_edge = np.vstack(uses_edge)
+
+    def damaged_seconds(self, potentials):
+        factors = np.ones(len(self.edge_potential))
+        for potential in potentials:
+            factors[self.edge_potential == potential] = DAMAGE_FACTORS[potential]
+        return self.graph.seconds * factors
+
+    def affected_sources(self, potentials):
+        """Sources whose tree uses a segment damaged under these classes."""
+        damaged = np.isin(self.edge_potential[self.zone_edges], list(potentials))
+        return np.flatnonzero(self.uses_edge[:, damaged].any(axis=1))
+
+    def degraded_times(self, potentials):
+        """Travel seconds from each barangay node to each source with the roads damaged."""
+        times = self.times.copy()
+        affected = self.affected_sources(potentials)
+        if len(affected):
+            matrix = self.graph.matrix(self.damaged_seconds(potentials))
+            times[affected] = shortest_trees(matrix, self.sources[affected], self.jobs)[:, self.brgy_nodes]
+        return times, len(affected)
+
+    def ratio(self, potentials):
+        """Damaged over undamaged seconds, (barangay, hospital), and the number of hospitals rerouted.
+
+        Pairs the road graph cannot route keep a ratio of 1, pairs it no
+        longer can get inf.
+        """
+        times, rerouted = self.degraded_times(potentials)
+        base = self.times[self.hosp_source].T
+        degraded = times[self.hosp_source].T
+        ratio = np.ones_like(base)
+        routed = np.isfinite(base) & (base > 0)
+        ratio[routed] = degraded[routed] / base[routed]
+        ratio[np.isfinite(base) & ~np.isfinite(degraded)] = np.inf
+        return ratio, rerouted
+
+
+def build(graph, liquefaction_map, ncr_boundary_pop, ncr_hosp, path=TRAVEL_DEGRADED, jobs=None, log=print):
+    """Write the ratio of every combination of classes, stacked in COMBINATIONS order."""
+    scenarios = RoadScenarios(graph, liquefaction_map, ncr_boundary_pop, ncr_hosp, jobs)
+    ratios = np.empty((len(COMBINATIONS), len(ncr_boundary_pop), len(ncr_hosp)), dtype=np.float32)
+    for i, combination in enumerate(COMBINATIONS):
+        ratios[i], rerouted = scenarios.ratio(combination)
+        log(f"{' + '.join(combination)}: {rerouted} of {len(scenarios.sources)} hospital nodes rerouted")
+    np.savez(path, ratio=ratios, brgy_index=ncr_boundary_pop['brgy_index'].to_numpy(),
+             hospital_index=ncr_hosp['hospital_index'].to_numpy())
+
+
+class DegradedTravel:
+    """Read-only view of the ratios written by `build`."""
+
+    def __init__(self, path=TRAVEL_DEGRADED):
+        with np.load(path) as stored:
+            self.ratios = stored['ratio']
+            self.brgy_pos = pd.Index(stored['brgy_index'])
+            self.hospital_pos = pd.Index(stored['hospital_index'])
+
+    def travel_matrix(self, base, combination):
+        """`base` with the durations of rerouted pairs scaled by their ratio, pairs that lost every route dropped.
+
+        Scaling keeps the routing service's durations where nothing changed;
+        pairs not in the ratios are kept as is.
+        """
+        b = self.brgy_pos.get_indexer(base['brgy_index'])
+        h = self.hospital_pos.get_indexer(base['hospital_index'])
+        known = (b >= 0) & (h >= 0)
+        factor = np.ones(len(base))
+        factor[known] = self.ratios[COMBINATIONS.index(combination)][b[known], h[known]]
+        matrix = base.assign(duration=base['duration'] * factor)
+        return matrix.loc[np.isfinite(matrix['duration'])].reset_index(drop=True)
+
+
+#the stored ratios and the matrices scaled by them, per generation of the artifacts
+_degraded = None
+_matrices = {}
+
+
+@datastore.on_swap
+def _reset(old_version, new_version):
+    #a new generation may come with rebuilt ratios, hospitals and travel matrix
+    global _degraded
+    _degraded = None
+    for key in [k for k in _matrices if k[0] != new_version]:
+        del _matrices[key]
+
+
+def available(path=TRAVEL_DEGRADED):
+    return os.path.exists(path)
+
+
+def degraded_travel_matrix(potentials, travel_matrix):
+    """Damaged travel matrix for a set of liquefaction classes, kept per worker for each combination."""
+    global _degraded
+    combination = tuple(p for p in POTENTIALS if p in potentials)
+    if not combination:
+        return travel_matrix
+    key = (datastore.version(), combination)
+    if key not in _matrices:
+        if _degraded is None:
+            _degraded = DegradedTravel()
+        _matrices[key] = _degraded.travel_matrix(travel_matrix, combination)
+    return _matrices[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the damaged-road travel time ratios.')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    build(RoadGraph.load(ROAD_GRAPH),
+          gpd.read_file(os.path.join(ANALYTICS_DIR, 'liquefaction_map.geojson')),
+          gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_boundary_pop.geojson')),
+          gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_hosp.geojson')),
+          jobs=args.jobs)
+    print(f'wrote {TRAVEL_DEGRADED} in {time.perf_counter() - start:.1f}s')
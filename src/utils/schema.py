@@ -0,0 +1,193 @@
+"""Declared column types of the analytics artifacts, applied and checked at load.
+
+Repeated strings load as categoricals, so filters such as
+`isin(risk_type_dropdown)` or `== impact_type` look the values up once among
+the categories and compare integer codes. Indices and counts load as int32
+and measures as float32, except values shown unformatted in hover labels,
+which keep float64 so 5.8 does not print as 5.800000190734863. A missing
+column, a value outside its declared categories or range, or a null in an
+integer column raises a SchemaError naming the artifact.
+
+Run from the src folder for the memory and filter time of every table,
+with default and declared types:
+
+    python -m utils.schema
+"""
+import argparse
+import os
+import time
+from collections import namedtuple
+
+import pandas as pd
+import geopandas as gpd
+
+from utils.exposure import ANALYTICS_DIR, POTENTIALS
+from utils.roadways import ROADWAY_TYPES
+
+#dtype, allowed categories (None for any), inclusive range of numbers (None for open)
+Column = namedtuple('Column', ['dtype', 'categories', 'low', 'high'], defaults=(None, None, None))
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def category(categories=None):
+    return Column('category', tuple(categories) if categories is not None else None)
+
+
+def integer(low=0, high=None):
+    return Column('int32', None, low, high)
+
+
+def measure(low=None, high=None, dtype='float32'):
+    return Column(dtype, None, low, high)
+
+
+#hospitals outside every zone are 'No Potential'; the shipped artifact spells Moderate as Medium
+HOSPITAL_POTENTIALS = POTENTIALS + ['Medium Potential', 'No Potential']
+SERVICE_LEVELS = ['Level 1', 'Level 2', 'Level 3']
+IMPACT_TYPES = ['Building Damage', 'Casualties', 'Economic Loss']
+RATES = ['total', 'normalized']
+MAG_GROUPS = ['5.0-5.9', '6.0-6.9', '7.0-7.9', '8.0-8.9', '9.0-9.9']
+
+EARTHQUAKES = {'latitude': measure(-90, 90, dtype='float64'),
+               'longitude': measure(-180, 180, dtype='float64'),
+               'mag': measure(0, 10, dtype='float64'),
+               'magType': category(),
+               'depth': measure(dtype='float64'),
+               'mag_group': category(MAG_GROUPS)}
+
+IMPACT = {'municipality': category(),
+          'impact_type': category(IMPACT_TYPES),
+          'rate': category(RATES),
+          'value': measure(low=0, dtype='float64')}
+
+SCHEMAS = {
+    'ncr_boundary_pop.geojson': {'region': category(),
+                                 'city': category(),
+                                 'barangay': category(),
+                                 'population': integer(),
+                                 'brgy_index': integer()},
+    'ncr_hosp.geojson': {'service_capability': category(SERVICE_LEVELS),
+                         'bed_capacity': integer(),
+                         'hospital_index': integer(),
+                         'potential': category(HOSPITAL_POTENTIALS)},
+    'liquefaction_map.geojson': {'potential': category(POTENTIALS)},
+    'liqf_roadways_gdf.geojson': {'type': category(ROADWAY_TYPES),
+                                  'potential': category(POTENTIALS),
+                                  'length_km': measure(low=0)},
+    'fault_lines_ph.geojson': {},
+    'earthquake_impact_total_gdf.geojson': IMPACT,
+    'earthquake_impact_total.csv': IMPACT,
+    'earthquake_impact.csv': dict(IMPACT, state=category()),
+    'earthquake_data.csv': EARTHQUAKES,
+    'earthquake_catalog': EARTHQUAKES,
+    'eq_rate_df.csv': {'no_eq': integer(),
+                       'p': measure(0, 1, dtype='float64')},
+    'liquefaction_potential_hospital.csv': {'type': category(POTENTIALS),
+                                            'service_capability': category(SERVICE_LEVELS),
+                                            'facility_name': integer()},
+    'liquefaction_potential_capacity.csv': {'type': category(POTENTIALS),
+                                            'bed_capacity': integer()},
+    'liqf_roadways_km.csv': {'potential': category(POTENTIALS),
+                             'type': category(ROADWAY_TYPES),
+                             'length_km': measure(low=0, dtype='float64')},
+    'travel_matrix.csv': {'brgy_index': integer(),
+                          'hospital_index': integer(),
+                          'duration': measure(low=0),
+                          'potential': category(HOSPITAL_POTENTIALS)},
+}
+
+
+def csv_dtypes(name):
+    """dtype argument for read_csv, so categories and floats are never parsed as object or float64 first."""
+    return {column: spec.dtype for column, spec in SCHEMAS.get(name, {}).items()
+            if spec.dtype == 'category' or spec.dtype.startswith('float')}
+
+
+def _check_range(name, column, values, spec):
+    if spec.low is not None and (values < spec.low).any():
+        raise SchemaError(f"{name}: {column} has {int((values < spec.low).sum())} values below {spec.low}")
+    if spec.high is not None and (values > spec.high).any():
+        raise SchemaError(f"{name}: {column} has {int((values > spec.high).sum())} values above {spec.high}")
+
+
+def apply(name, frame):
+    """`frame` with the declared types of artifact `name`, validated; undeclared columns are left as read."""
+    schema = SCHEMAS.get(name)
+    if schema is None:
+        return frame
+    missing = [column for column in schema if column not in frame.columns]
+    if missing:
+        raise SchemaError(f"{name}: missing columns {missing}")
+
+    for column, spec in schema.items():
+        values = frame[column]
+        if spec.dtype == 'category':
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype('category')
+            if spec.categories is not None:
+                unknown = sorted(set(values.cat.categories) - set(spec.categories))
+                if unknown:
+                    raise SchemaError(f"{name}: {column} has undeclared values {unknown}")
+                values = values.cat.set_categories(spec.categories)
+        else:
+            if spec.dtype.startswith('int') and values.isna().any():
+                raise SchemaError(f"{name}: {column} has {int(values.isna().sum())} missing values")
+            _check_range(name, column, values, spec)
+            values = values.astype(spec.dtype)
+        frame[column] = values
+    return frame
+
+
+def _filter(frame, name):
+    """A filter like the pages run on the first categorical column, or None without one."""
+    for column, spec in SCHEMAS.get(name, {}).items():
+        if spec.dtype == 'category':
+            values = list(pd.unique(frame[column].dropna()))[:2]
+            return lambda f: f.loc[f[column].isin(values)]
+    return None
+
+
+def _report(name, repeat):
+    path = os.path.join(ANALYTICS_DIR, name)
+    if os.path.isdir(path):
+        plain = pd.read_parquet(path)
+        typed = apply(name, pd.read_parquet(path))
+    elif name.endswith('.csv'):
+        plain = pd.read_csv(path)
+        typed = apply(name, pd.read_csv(path, dtype=csv_dtypes(name)))
+    else:
+        plain = gpd.read_file(path, driver='GeoJSON')
+        typed = apply(name, plain.copy())
+
+    row = {'table': name, 'rows': len(plain),
+           'before_mb': plain.drop(columns='geometry', errors='ignore').memory_usage(deep=True).sum() / 1e6,
+           'after_mb': typed.drop(columns='geometry', errors='ignore').memory_usage(deep=True).sum() / 1e6}
+    query = _filter(typed, name)
+    for label, frame in (('before_ms', plain), ('after_ms', typed)):
+        if query is None:
+            row[label] = float('nan')
+            continue
+        start = time.perf_counter()
+        for _ in range(repeat):
+            query(frame)
+        row[label] = (time.perf_counter() - start) / repeat * 1000
+    return row
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Memory and filter time of each artifact, default vs declared types.')
+    parser.add_argument('--repeat', type=int, default=50, help='filter runs timed per table')
+    args = parser.parse_args()
+
+    header = f"{'table':<40}{'rows':>10}{'MB before':>11}{'MB after':>10}{'ms before':>11}{'ms after':>10}"
+    print(header)
+    print('-' * len(header))
+    for name in SCHEMAS:
+        if not os.path.exists(os.path.join(ANALYTICS_DIR, name)):
+            continue
+        row = _report(name, args.repeat)
+        print(f"{row['table']:<40}{row['rows']:>10,}{row['before_mb']:>11.2f}{row['after_mb']:>10.2f}"
+              f"{row['before_ms']:>11.3f}{row['after_ms']:>10.3f}")
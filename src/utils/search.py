@@ -0,0 +1,87 @@
+import bisect
+import heapq
+import re
+import unicodedata
+from collections import defaultdict
+
+#options returned per keystroke
+MAX_RESULTS = 20
+
+#least trigram overlap (Jaccard) of a fuzzy match
+MIN_SIMILARITY = 0.2
+
+
+def normalize(text):
+    """Lowercase words without accents or punctuation, e.g. 'Parañaque' -> 'paranaque'."""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Prefix and trigram index over labels such as 'Barangay 100 | (Caloocan)'.
+
+    Every word of a label is kept in a sorted list, so the labels having a
+    word that starts with a typed word are one binary search away; a query
+    matches the labels found for all of its words. When that leaves fewer
+    than `limit` results, labels sharing enough trigrams with the query
+    fill the rest, so typos still find something.
+    """
+
+    def __init__(self, labels):
+        self.labels = [str(label) for label in labels]
+        self.normalized = [normalize(label) for label in self.labels]
+        self.word_sets = [set(text.split()) for text in self.normalized]
+        self.gram_counts = [len(trigrams(text)) for text in self.normalized]
+
+        postings = defaultdict(set)
+        self.grams = defaultdict(set)
+        for i, text in enumerate(self.normalized):
+            for word in text.split():
+                postings[word].add(i)
+            for gram in trigrams(text):
+                self.grams[gram].add(i)
+        self.words = sorted(postings)
+        self.postings = [postings[word] for word in self.words]
+
+    def _prefixed(self, prefix):
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + '\x7f')
+        matches = set()
+        for ids in self.postings[start:end]:
+            matches |= ids
+        return matches
+
+    def search(self, query, limit=MAX_RESULTS):
+        """Labels best matching `query`: prefix matches first, then fuzzy ones."""
+        query = normalize(query)
+        if not query:
+            return []
+        words = query.split()
+
+        hits = set.intersection(*(self._prefixed(word) for word in words))
+        #labels starting with the query, then more whole-word matches, then shorter labels
+        ranked = heapq.nsmallest(limit, hits, key=lambda i: (not self.normalized[i].startswith(query),
+                                                             -len(self.word_sets[i].intersection(words)),
+                                                             len(self.normalized[i]), self.normalized[i]))
+
+        if len(ranked) < limit:
+            query_grams = trigrams(query)
+            shared = defaultdict(int)
+            for gram in query_grams:
+                for i in self.grams.get(gram, ()):
+                    shared[i] += 1
+            scored = []
+            for i, count in shared.items():
+                if i in hits:
+                    continue
+                similarity = count / (len(query_grams) + self.gram_counts[i] - count)
+                if similarity >= MIN_SIMILARITY:
+                    scored.append((-similarity, len(self.normalized[i]), i))
+            ranked += [i for _, _, i in heapq.nsmallest(limit - len(ranked), scored)]
+
+        return [self.labels[i] for i in ranked]
@@ -0,0 +1,122 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+
+import diskcache
+
+from utils import datastore
+
+#results are kept just long enough for workers that queued behind the leader
+RESULT_TTL = 60
+
+#a leader that dies mid-computation releases its lock after this many seconds
+LOCK_EXPIRE = 300
+
+shared_store = diskcache.Cache(os.environ.get('SHARED_STORE', '../data/cache/shared'))
+
+_MISSING = object()
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _normalize(value):
+    #checklist values are sets, the order they were clicked in doesn't matter
+    if isinstance(value, (list, tuple)):
+        items = [_normalize(v) for v in value]
+        if all(isinstance(v, str) for v in items):
+            return sorted(items)
+        return items
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def make_key(name, args, kwargs):
+    #results computed from one generation of the artifacts are never shared with the next
+    payload = json.dumps([name, datastore.version(), _normalize(list(args)), _normalize(kwargs)],
+                         sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def _count(name, counter):
+    shared_store.incr(('singleflight-stats', name, counter), default=0, retry=True)
+
+
+def stats():
+    """Computations run and computations saved, per coalesced function."""
+    summary = {}
+    for key in shared_store.iterkeys():
+        if isinstance(key, tuple) and key[0] == 'singleflight-stats':
+            _, name, counter = key
+            summary.setdefault(name, {'computed': 0, 'shared_in_process': 0,
+                                      'shared_across_workers': 0})
+            summary[name][counter] = shared_store.get(key, 0)
+    for counts in summary.values():
+        counts['saved'] = counts['shared_in_process'] + counts['shared_across_workers']
+    return summary
+
+
+def _run_shared(name, key, fn, args, kwargs, ttl):
+    #only one worker computes a key; the others wait on the lock, then read its result
+    with diskcache.Lock(shared_store, ('singleflight-lock', key), expire=LOCK_EXPIRE):
+        result = shared_store.get(('singleflight', key), default=_MISSING, retry=True)
+        if result is not _MISSING:
+            _count(name, 'shared_across_workers')
+            return result
+
+        result = fn(*args, **kwargs)
+        shared_store.set(('singleflight', key), result, expire=ttl, retry=True)
+        _count(name, 'computed')
+        return result
+
+
+def singleflight(name, ttl=RESULT_TTL):
+    """Coalesce concurrent calls with identical inputs into one computation.
+
+    Threads of the same worker wait on an in-memory event; other workers
+    wait on a lock in the shared store and pick up the pickled result.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = make_key(name, args, kwargs)
+
+            with _inflight_lock:
+                call = _inflight.get(key)
+                leader = call is None
+                if leader:
+                    call = _inflight[key] = _Call()
+
+            if not leader:
+                call.done.wait()
+                _count(name, 'shared_in_process')
+                if call.error is not None:
+                    raise call.error
+                return call.result
+
+            try:
+                call.result = _run_shared(name, key, fn, args, kwargs, ttl)
+                return call.result
+            except BaseException as error:
+                call.error = error
+                raise
+            finally:
+                with _inflight_lock:
+                    del _inflight[key]
+                call.done.set()
+
+        return wrapper
+    return decorator
+
+
+def register_stats_route(server, path='/_stats/singleflight'):
+    server.add_url_rule(path, 'singleflight_stats', lambda: stats())
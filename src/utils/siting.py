@@ -0,0 +1,181 @@
+"""Where to add beds, or a new hospital, to best serve the worst-off barangays.
+
+Candidates are scored by how much they lower the population-weighted RAAM
+score of the barangays worst served in the starting solution. Every score,
+with or without the picks so far and the candidate, comes from the same
+solve: RAAM continued from the starting allocation at the last step of its
+schedule. A pick therefore gains exactly what it was predicted to. The
+candidates of a batch share one RAAM problem along the solver's batch axis,
+and batches are spread across a process pool. Candidates are picked
+lazy-greedily: gains computed before the last pick only bound the current
+ones, so only the candidates that could still be best are scored again.
+"""
+import heapq
+from collections import namedtuple
+
+import numpy as np
+
+from utils import raam
+from utils.routing import haversine
+
+#share of barangays, worst RAAM scores first, whose service is optimized
+WORST_SHARE = 0.1
+
+#beds added per greedy step, and beds of a new hospital
+BED_STEP = 50
+FACILITY_BEDS = 100
+
+#cycles of RAAM after the starting solution's, per score
+EVAL_CYCLES = 30
+
+#candidates scored per RAAM batch
+BATCH_SIZE = 16
+
+Candidate = namedtuple('Candidate', ['kind', 'target', 'beds'])
+Pick = namedtuple('Pick', ['candidate', 'gain', 'objective'])
+
+
+class _State:
+    #cost, supply and starting allocation of a single supply row, after the picks so far
+    def __init__(self, cost, supply, allocation):
+        self.cost = cost
+        self.supply = supply
+        self.allocation = allocation
+
+
+def _objective(scores, demand, worst):
+    #population-weighted mean score of the worst served barangays, lower is better
+    scores = scores[:, worst]
+    weight = np.where(np.isfinite(scores), demand[worst][None], 0)
+    return (np.nan_to_num(scores) * weight).sum(axis=1) / weight.sum(axis=1)
+
+
+def _score_batch(task):
+    """Objective after each candidate of a batch (None for the state as it is), as one RAAM problem."""
+    cost, supply, allocation, demand, site_costs, candidates, tau, rho, worst, start_cycle, cycles = task
+    n_supply = len(supply)
+    sites = [c for c in candidates if c is not None and c.kind == 'site']
+
+    batch_cost = np.hstack([cost] + [site_costs[c.target][:, None] for c in sites])
+    batch_supply = np.zeros((len(candidates), batch_cost.shape[1]))
+    batch_supply[:, :n_supply] = supply
+    site_column = n_supply
+    for row, candidate in enumerate(candidates):
+        if candidate is None:
+            continue
+        if candidate.kind == 'beds':
+            batch_supply[row, candidate.target] += candidate.beds
+        else:
+            batch_supply[row, site_column] = candidate.beds
+            site_column += 1
+
+    batch_allocation = np.zeros((len(candidates),) + batch_cost.shape)
+    batch_allocation[:, :, :n_supply] = allocation
+
+    problem = raam.RaamProblem(demand, batch_supply, batch_cost)
+    result = raam.solve(problem, tau, rho=rho, allocation=batch_allocation,
+                        start_cycle=start_cycle, max_cycles=cycles)
+    return _objective(result.scores, demand, worst)
+
+
+class SitingModel:
+    """Greedy bed and hospital siting on top of one RAAM solution (one supply row)."""
+
+    def __init__(self, problem, result, brgy_lon, brgy_lat, hosp_lon, hosp_lat, tau, row=0,
+                 worst_share=WORST_SHARE, eval_cycles=EVAL_CYCLES):
+        self.demand = problem.demand
+        self.tau = tau
+        self.start_cycle = result.cycle
+        self.eval_cycles = eval_cycles
+        #congestion stays normalized by the starting supply (population per bed) so every candidate is compared alike
+        self.rho = problem.rho()[row]
+        self.state = _State(problem.cost.copy(), problem.supply[row].copy(),
+                            np.asarray(result.allocation[row], dtype=np.float64))
+
+        scores = result.scores[row]
+        ranked = np.argsort(np.where(np.isfinite(scores), -scores, np.inf))
+        n_worst = max(1, int(np.isfinite(scores).sum() * worst_share))
+        self.worst = np.zeros(len(scores), dtype=bool)
+        self.worst[ranked[:n_worst]] = True
+
+        #A new hospital's travel times come from straight-line distance, with
+        #seconds per meter fitted on the existing barangay-hospital pairs.
+        self.brgy_lon, self.brgy_lat = np.asarray(brgy_lon), np.asarray(brgy_lat)
+        meters = haversine(self.brgy_lon[:, None], self.brgy_lat[:, None],
+                           np.asarray(hosp_lon)[None], np.asarray(hosp_lat)[None])
+        routed = np.isfinite(problem.cost)
+        self.seconds_per_meter, self.base_seconds = np.polyfit(meters[routed], problem.cost[routed], 1)
+
+        #the state without any pick, solved like the candidates
+        self.objective = float(self.objectives([None])[0])
+
+    def site_costs(self, targets):
+        """Travel seconds from every barangay to a new hospital at each target barangay's centroid."""
+        meters = haversine(self.brgy_lon[:, None], self.brgy_lat[:, None],
+                           self.brgy_lon[targets][None], self.brgy_lat[targets][None])
+        return dict(zip(targets, (self.base_seconds + self.seconds_per_meter * meters).T))
+
+    def bed_candidates(self, beds=BED_STEP):
+        return [Candidate('beds', s, beds) for s in np.flatnonzero(self.state.supply > 0)]
+
+    def site_candidates(self, beds=FACILITY_BEDS):
+        #new hospitals are tried where the worst served barangays are
+        return [Candidate('site', d, beds) for d in np.flatnonzero(self.worst)]
+
+    def objectives(self, candidates, jobs=None):
+        """Objective of the current state with each candidate added (None for none)."""
+        site_costs = self.site_costs(sorted({c.target for c in candidates if c is not None and c.kind == 'site'}))
+        tasks = [(self.state.cost, self.state.supply, self.state.allocation, self.demand, site_costs,
+                  candidates[i:i + BATCH_SIZE], self.tau, self.rho, self.worst, self.start_cycle, self.eval_cycles)
+                 for i in range(0, len(candidates), BATCH_SIZE)]
+        return np.concatenate(raam.map_batches(_score_batch, tasks, jobs))
+
+    def gains(self, candidates, jobs=None):
+        """Drop in the objective for each candidate, from the current state."""
+        return self.objective - self.objectives(candidates, jobs)
+
+    def apply(self, candidate):
+        """Add a candidate to the state; its objective is the one its gain was computed from."""
+        objective = float(self.objectives([candidate])[0])
+        state = self.state
+        if candidate.kind == 'beds':
+            state.supply = state.supply.copy()
+            state.supply[candidate.target] += candidate.beds
+        else:
+            column = self.site_costs([candidate.target])[candidate.target]
+            state.cost = np.hstack([state.cost, column[:, None]])
+            state.supply = np.append(state.supply, candidate.beds)
+            state.allocation = np.hstack([state.allocation, np.zeros((len(self.demand), 1))])
+        self.objective = objective
+
+    def lazy_greedy(self, candidates, steps, repeat=False, jobs=None, log=None):
+        """Pick up to `steps` candidates, each the best given the earlier picks.
+
+        With `repeat` a picked candidate stays available (more beds at the
+        same hospital). Stops early when no candidate improves the objective.
+        """
+        gains = self.gains(candidates, jobs)
+        heap = [(-gain, i, 0) for i, gain in enumerate(gains)]
+        heapq.heapify(heap)
+        picks = []
+
+        for step in range(steps):
+            #entries tagged with an earlier step are upper bounds; score the top ones again
+            while heap and heap[0][2] != step:
+                stale = []
+                while heap and heap[0][2] != step and len(stale) < BATCH_SIZE:
+                    stale.append(heapq.heappop(heap))
+                fresh = self.gains([candidates[i] for _, i, _ in stale], jobs)
+                for (_, i, _), gain in zip(stale, fresh):
+                    heapq.heappush(heap, (-gain, i, step))
+
+            if not heap or -heap[0][0] <= 0:
+                break
+            negative_gain, i, _ = heapq.heappop(heap)
+            self.apply(candidates[i])
+            picks.append(Pick(candidates[i], -negative_gain, self.objective))
+            if repeat:
+                heapq.heappush(heap, (negative_gain, i, step))
+            if log is not None:
+                log(step + 1, steps, picks[-1])
+        return picks
@@ -0,0 +1,188 @@
+"""Hospital surge after the earthquake, simulated in discrete time steps.
+
+PHIVOLCS casualties per municipality are spread over its barangays by
+population and arrive over the first days. Each step, hospitals discharge
+patients, then every barangay's waiting patients go to the nearest open
+hospital that can treat them and still has beds, in order of triage
+priority. Patients no hospital within reach can take wait and try again
+next step. Every barangay and hospital is one element of an array, so a
+step is a few vector operations per severity and choice of hospital.
+
+Run from the src folder to time a 7-day run at 15-minute steps:
+
+    python -m utils.surge
+"""
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from utils.exposure import ANALYTICS_DIR
+from utils.hourly import dense_durations
+
+#casualty state in the impact table, share of it admitted, mean stay (hours), service levels able to treat it
+Severity = namedtuple('Severity', ['state', 'admitted', 'stay_hours', 'levels'])
+
+#in triage order; fatalities need no bed
+SEVERITIES = [Severity('Life - threatening Injuries', 1.0, 240, ('Level 2', 'Level 3')),
+              Severity('Serious Injuries', 1.0, 72, None),
+              Severity('Slight Injuries', 0.1, 12, None)]
+
+#share of beds already taken by patients admitted before the earthquake, who stay
+BASELINE_OCCUPANCY = 0.7
+
+#casualties arriving at hospitals fall off exponentially with this time constant (hours)
+ARRIVAL_HOURS = 12
+
+#a patient tries at most this many of the nearest hospitals, within this travel time (minutes)
+MAX_CHOICES = 20
+MAX_TRAVEL_MINUTES = 120
+
+DAYS = 7
+STEP_MINUTES = 15
+
+Surge = namedtuple('Surge', ['hours', 'brgy_index', 'hospital_index', 'capacity', 'baseline',
+                             'occupancy', 'overflow', 'waiting', 'arrived'])
+
+
+def casualty_demand(ncr_boundary_pop, earthquake_impact, severities=SEVERITIES):
+    """Patients needing a bed, (severity, barangay), from municipality totals split by population."""
+    casualties = earthquake_impact.loc[(earthquake_impact['impact_type'] == 'Casualties') &
+                                       (earthquake_impact['rate'] == 'total')]
+    totals = casualties.pivot_table(index='municipality', columns='state', values='value', aggfunc='sum')
+
+    #boundary cities are spelled like the impact table, without the trailing " City"
+    municipality = ncr_boundary_pop['city'].str.replace(r' City$', '', regex=True)
+    population = ncr_boundary_pop['population'].fillna(0).to_numpy(dtype=np.float64)
+    municipal_population = pd.Series(population).groupby(municipality.to_numpy()).transform('sum').to_numpy()
+    share = np.divide(population, municipal_population, out=np.zeros_like(population),
+                      where=municipal_population > 0)
+
+    demand = np.zeros((len(severities), len(ncr_boundary_pop)))
+    for s, severity in enumerate(severities):
+        if severity.state in totals.columns:
+            municipal_total = municipality.map(totals[severity.state]).fillna(0).to_numpy(dtype=np.float64)
+            demand[s] = severity.admitted * municipal_total * share
+    return demand
+
+
+def hospital_choices(durations, service_levels, is_open, severities=SEVERITIES,
+                     max_choices=MAX_CHOICES, max_minutes=MAX_TRAVEL_MINUTES):
+    """Positions of each barangay's nearest eligible hospitals, (severity, barangay, choice); -1 past the last."""
+    k = min(max_choices, durations.shape[1])
+    choices = np.full((len(severities), durations.shape[0], k), -1, dtype=np.int32)
+    for s, severity in enumerate(severities):
+        eligible = is_open if severity.levels is None else is_open & np.isin(service_levels, severity.levels)
+        cost = np.where(eligible & (durations <= max_minutes * 60), durations, np.inf)
+        nearest = np.argsort(cost, axis=1, kind='stable')[:, :k]
+        reachable = np.isfinite(np.take_along_axis(cost, nearest, axis=1))
+        choices[s] = np.where(reachable, nearest, -1)
+    return choices
+
+
+def arrival_profile(steps, step_hours, arrival_hours=ARRIVAL_HOURS):
+    """Share of all casualties arriving in each step, summing to 1 over the run."""
+    start = np.arange(steps) * step_hours
+    weights = np.exp(-start / arrival_hours) - np.exp(-(start + step_hours) / arrival_hours)
+    return weights / weights.sum()
+
+
+def simulate(demand, choices, capacity, baseline, profile, step_hours, severities=SEVERITIES):
+    """Occupancy and first-choice overflow per hospital and step, and patients waiting per barangay.
+
+    Patients sent to a hospital with fewer free beds than arrivals are admitted
+    in the same proportion from every barangay; the rest try their next choice.
+    Stays end at a constant rate, so a bed frees up after `stay_hours` on average.
+    """
+    n_severities, n_brgy = demand.shape
+    n_hosp = len(capacity)
+    steps = len(profile)
+    discharge = np.array([min(1.0, step_hours / severity.stay_hours) for severity in severities])
+
+    free = np.maximum(capacity - baseline, 0).astype(np.float64)
+    admitted = np.zeros((n_severities, n_hosp))
+    queue = np.zeros((n_severities, n_brgy))
+
+    occupancy = np.empty((steps, n_hosp), dtype=np.float32)
+    overflow = np.zeros((steps, n_hosp), dtype=np.float32)
+    waiting = np.empty((steps, n_brgy), dtype=np.float32)
+
+    for t in range(steps):
+        leaving = admitted * discharge[:, None]
+        admitted -= leaving
+        free += leaving.sum(axis=0)
+        queue += demand * profile[t]
+
+        for s in range(n_severities):
+            waiting_s = queue[s]
+            for k in range(choices.shape[2]):
+                target = choices[s, :, k]
+                sending = (target >= 0) & (waiting_s > 0)
+                if not sending.any() or not (free > 0).any():
+                    break
+                wanted = np.bincount(target[sending], weights=waiting_s[sending], minlength=n_hosp)
+                ratio = np.divide(np.minimum(free, wanted), wanted, out=np.zeros(n_hosp), where=wanted > 0)
+                waiting_s[sending] -= waiting_s[sending] * ratio[target[sending]]
+                taken = wanted * ratio
+                free = np.maximum(free - taken, 0)
+                admitted[s] += taken
+                if k == 0:
+                    #patients whose nearest hospital was full, diverted or left waiting
+                    overflow[t] += (wanted - taken).astype(np.float32)
+
+        occupancy[t] = baseline + admitted.sum(axis=0)
+        waiting[t] = queue.sum(axis=0)
+
+    return occupancy, overflow, waiting
+
+
+def run(ncr_boundary_pop, ncr_hosp, travel_matrix, earthquake_impact, excluded_potentials=(),
+        baseline_occupancy=BASELINE_OCCUPANCY, days=DAYS, step_minutes=STEP_MINUTES):
+    """Simulate the surge with hospitals in the excluded liquefaction potentials closed."""
+    brgy_ids = ncr_boundary_pop['brgy_index'].to_numpy()
+    hospitals = ncr_hosp.drop_duplicates('hospital_index')
+    hospital_ids = hospitals['hospital_index'].to_numpy()
+    capacity = hospitals['bed_capacity'].fillna(0).to_numpy(dtype=np.float64)
+    is_open = ~hospitals['potential'].isin(list(excluded_potentials)).to_numpy()
+
+    durations = dense_durations(travel_matrix, brgy_ids, hospital_ids)
+    choices = hospital_choices(durations, hospitals['service_capability'].to_numpy(), is_open)
+    demand = casualty_demand(ncr_boundary_pop, earthquake_impact)
+
+    step_hours = step_minutes / 60
+    steps = int(round(days * 24 / step_hours))
+    profile = arrival_profile(steps, step_hours)
+    #closed hospitals hold no one; their baseline patients are counted as evacuated
+    baseline = np.where(is_open, np.floor(capacity * baseline_occupancy), 0)
+    occupancy, overflow, waiting = simulate(demand, choices, np.where(is_open, capacity, 0), baseline,
+                                            profile, step_hours)
+
+    return Surge(hours=np.arange(1, steps + 1) * step_hours,
+                 brgy_index=brgy_ids,
+                 hospital_index=hospital_ids,
+                 capacity=np.where(is_open, capacity, 0),
+                 baseline=baseline,
+                 occupancy=occupancy,
+                 overflow=overflow,
+                 waiting=waiting,
+                 arrived=np.cumsum(profile) * demand.sum())
+
+
+if __name__ == '__main__':
+    ncr_boundary_pop = gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_boundary_pop.geojson'))
+    ncr_hosp = gpd.read_file(os.path.join(ANALYTICS_DIR, 'ncr_hosp.geojson'))
+    travel_matrix = pd.read_csv(os.path.join(ANALYTICS_DIR, 'travel_matrix.csv'))
+    earthquake_impact = pd.read_csv(os.path.join(ANALYTICS_DIR, 'earthquake_impact.csv'))
+
+    start = time.perf_counter()
+    surge = run(ncr_boundary_pop, ncr_hosp, travel_matrix, earthquake_impact, ['High Potential'])
+    elapsed = time.perf_counter() - start
+    #closed hospitals have no capacity and would count as full
+    full = ((surge.occupancy >= surge.capacity - 0.5) & (surge.capacity > 0)).sum(axis=1)
+    print(f'{len(surge.hours)} steps, {len(surge.brgy_index)} barangays, {len(surge.hospital_index)} hospitals '
+          f'in {elapsed:.2f}s')
+    print(f'patients needing a bed: {surge.arrived[-1]:,.0f}; peak waiting {surge.waiting.sum(axis=1).max():,.0f}; '
+          f'hospitals full at the peak: {full.max()} of {int((surge.capacity > 0).sum())}')
@@ -0,0 +1,251 @@
+"""Polygon layers as a quantized TopoJSON topology with shared arcs.
+
+Neighboring barangays (and the municipalities they make up) store every
+shared border once: rings are cut where they meet other rings, identical
+pieces become one arc referenced from both sides, and coordinates are
+snapped to an integer grid and delta-encoded. Simplification runs on the
+arcs, so neighbors keep exactly the same border.
+
+Run from the src folder to compare sizes with the GeoJSON artifacts:
+
+    python -m utils.topology [--simplify 5]
+"""
+import argparse
+import json
+import os
+
+from utils.exposure import ANALYTICS_DIR
+
+#one topology holds both boundary layers; municipalities are unions of barangays
+BOUNDARIES_FILE = 'ncr_boundaries.topojson'
+BOUNDARIES = os.path.join(ANALYTICS_DIR, BOUNDARIES_FILE)
+
+#topology object standing in for each GeoJSON artifact
+LAYERS = {'ncr_boundary_pop.geojson': 'barangays',
+          'earthquake_impact_total_gdf.geojson': 'municipalities'}
+
+#grid points per axis; over Metro Manila a step is well under a meter
+QUANTIZATION = 100000
+
+METERS_PER_DEGREE = 111320
+
+
+def _rings(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    raise ValueError(f"unsupported geometry {geometry['type']}")
+
+
+def _quantize(ring, transform):
+    (kx, ky), (x0, y0) = transform['scale'], transform['translate']
+    points = []
+    for x, y in ring:
+        point = (int(round((x - x0) / kx)), int(round((y - y0) / ky)))
+        if not points or point != points[-1]:
+            points.append(point)
+    #open ring, the closing point is implied
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return points
+
+
+def _junctions(rings):
+    """Points where rings meet and part ways, or where a ring touches another."""
+    neighbors = {}
+    junctions = set()
+    for ring in rings:
+        n = len(ring)
+        for i, point in enumerate(ring):
+            pair = frozenset((ring[i - 1], ring[(i + 1) % n]))
+            seen = neighbors.setdefault(point, pair)
+            if seen != pair:
+                junctions.add(point)
+    return junctions
+
+
+def _cut(ring, junctions):
+    """A ring as arcs from junction to junction, or as one closed arc without junctions."""
+    cuts = [i for i, point in enumerate(ring) if point in junctions]
+    if not cuts:
+        #start isolated rings at their smallest point so the same ring is always one arc
+        start = ring.index(min(ring))
+        ring = ring[start:] + ring[:start]
+        return [ring + [ring[0]]]
+    ring = ring[cuts[0]:] + ring[:cuts[0]]
+    cuts = [i - cuts[0] for i in cuts] + [len(ring)]
+    ring = ring + [ring[0]]
+    return [ring[a:b + 1] for a, b in zip(cuts, cuts[1:])]
+
+
+def _canonical_closed(arc):
+    ring = arc[:-1]
+    start = ring.index(min(ring))
+    return tuple(ring[start:] + ring[:start] + [ring[start]])
+
+
+def _simplify(arc, tolerance):
+    """Douglas-Peucker on one arc, keeping its ends (and enough points to stay a ring)."""
+    if tolerance <= 0 or len(arc) <= 2:
+        return arc
+    keep = [False] * len(arc)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(arc) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = arc[first], arc[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = (dx * dx + dy * dy) ** 0.5
+        farthest, index = 0, None
+        for i in range(first + 1, last):
+            x, y = arc[i]
+            if length:
+                distance = abs(dy * x - dx * y + x2 * y1 - y2 * x1) / length
+            else:
+                distance = ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+            if distance > farthest:
+                farthest, index = distance, i
+        if index is not None and farthest > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    simplified = [point for point, kept in zip(arc, keep) if kept]
+    if arc[0] == arc[-1] and len(simplified) < 4:
+        return arc
+    return simplified
+
+
+def encode(layers, quantization=QUANTIZATION, simplify_meters=0):
+    """Topology of `layers`, {name: [(geometry, properties), ...]} with GeoJSON (Multi)Polygons in lon/lat."""
+    xs, ys = [], []
+    for features in layers.values():
+        for geometry, _ in features:
+            for polygon in _rings(geometry):
+                for ring in polygon:
+                    xs.extend(x for x, _ in ring)
+                    ys.extend(y for _, y in ring)
+    x0, y0, x1, y1 = min(xs), min(ys), max(xs), max(ys)
+    transform = {'scale': [(x1 - x0) / (quantization - 1) or 1, (y1 - y0) / (quantization - 1) or 1],
+                 'translate': [x0, y0]}
+
+    quantized = {name: [[[_quantize(ring, transform) for ring in polygon] for polygon in _rings(geometry)]
+                        for geometry, _ in features]
+                 for name, features in layers.items()}
+    all_rings = [ring for polygons in quantized.values() for polygon_list in polygons
+                 for polygon in polygon_list for ring in polygon if len(ring) >= 3]
+    junctions = _junctions(all_rings)
+    tolerance = simplify_meters / (METERS_PER_DEGREE * transform['scale'][1])
+
+    arcs, index = [], {}
+
+    def arc_index(arc):
+        closed = arc[0] == arc[-1]
+        key = _canonical_closed(arc) if closed else tuple(arc)
+        if key in index:
+            return index[key]
+        backward = _canonical_closed(arc[::-1]) if closed else tuple(arc[::-1])
+        if backward in index:
+            return ~index[backward]
+        index[key] = len(arcs)
+        arcs.append(_simplify(list(key), tolerance))
+        return index[key]
+
+    objects = {}
+    for name, features in layers.items():
+        geometries = []
+        for (geometry, properties), polygons in zip(features, quantized[name]):
+            polygon_arcs = [[[arc_index(arc) for arc in _cut(ring, junctions)] for ring in polygon if len(ring) >= 3]
+                            for polygon in polygons]
+            polygon_arcs = [polygon for polygon in polygon_arcs if polygon]
+            if geometry['type'] == 'Polygon' and len(polygon_arcs) == 1:
+                entry = {'type': 'Polygon', 'arcs': polygon_arcs[0]}
+            else:
+                entry = {'type': 'MultiPolygon', 'arcs': polygon_arcs}
+            entry['properties'] = properties
+            geometries.append(entry)
+        objects[name] = {'type': 'GeometryCollection', 'geometries': geometries}
+
+    #first point absolute, the rest as steps from the previous one
+    encoded = []
+    for arc in arcs:
+        deltas = [list(arc[0])] + [[x - px, y - py] for (px, py), (x, y) in zip(arc, arc[1:])]
+        encoded.append(deltas)
+    return {'type': 'Topology', 'transform': transform, 'objects': objects, 'arcs': encoded}
+
+
+def decode(topology, name):
+    """GeoJSON features of one object of the topology."""
+    (kx, ky), (x0, y0) = topology['transform']['scale'], topology['transform']['translate']
+    arcs = []
+    for deltas in topology['arcs']:
+        x = y = 0
+        points = []
+        for dx, dy in deltas:
+            x, y = x + dx, y + dy
+            points.append([x * kx + x0, y * ky + y0])
+        arcs.append(points)
+
+    def ring(indexes):
+        points = []
+        for i in indexes:
+            arc = arcs[i] if i >= 0 else arcs[~i][::-1]
+            points.extend(arc if not points else arc[1:])
+        return points
+
+    features = []
+    for geometry in topology['objects'][name]['geometries']:
+        if geometry['type'] == 'Polygon':
+            coordinates = [ring(indexes) for indexes in geometry['arcs']]
+        else:
+            coordinates = [[ring(indexes) for indexes in polygon] for polygon in geometry['arcs']]
+        features.append({'type': 'Feature', 'properties': geometry.get('properties') or {},
+                         'geometry': {'type': geometry['type'], 'coordinates': coordinates}})
+    return features
+
+
+def encode_frames(frames, quantization=QUANTIZATION, simplify_meters=0):
+    """Topology of GeoDataFrames, {name: gdf}, keeping their other columns as properties."""
+    from shapely.geometry import mapping
+
+    layers = {}
+    for name, gdf in frames.items():
+        gdf = gdf.to_crs('EPSG:4326')
+        properties = json.loads(gdf.drop(columns=gdf.geometry.name).to_json(orient='records'))
+        layers[name] = [(mapping(geometry), props) for geometry, props in zip(gdf.geometry, properties)]
+    return encode(layers, quantization, simplify_meters)
+
+
+def decode_frame(topology, name):
+    import geopandas as gpd
+
+    return gpd.GeoDataFrame.from_features(decode(topology, name), crs='EPSG:4326')
+
+
+def write(topology, path):
+    with open(path, 'w') as f:
+        json.dump(topology, f, separators=(',', ':'))
+
+
+def read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the boundary GeoJSON artifacts with their topology.')
+    parser.add_argument('--simplify', type=float, default=0, help='simplification tolerance in meters')
+    args = parser.parse_args()
+
+    layers, geojson_bytes = {}, 0
+    for file_name, name in LAYERS.items():
+        path = os.path.join(ANALYTICS_DIR, file_name)
+        geojson_bytes += os.path.getsize(path)
+        with open(path) as f:
+            layers[name] = [(feature['geometry'], feature['properties']) for feature in json.load(f)['features']]
+
+    topology = encode(layers, simplify_meters=args.simplify)
+    topology_bytes = len(json.dumps(topology, separators=(',', ':')))
+    points = sum(len(arc) for arc in topology['arcs'])
+    print(f"GeoJSON {geojson_bytes / 1e6:.2f} MB -> topology {topology_bytes / 1e6:.2f} MB "
+          f"({geojson_bytes / topology_bytes:.1f}x), {len(topology['arcs']):,} arcs, {points:,} points")
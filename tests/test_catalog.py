@@ -0,0 +1,53 @@
+import pandas as pd
+
+from utils import catalog
+
+
+def _events(rows):
+    return pd.DataFrame({'time': pd.to_datetime([row[0] for row in rows], utc=True),
+                         'latitude': [row[1] for row in rows],
+                         'longitude': [row[2] for row in rows],
+                         'mag': [row[3] for row in rows]})
+
+
+def test_deduplicate_within_tolerances():
+    stored = _events([('2020-01-01 00:00:00', 14.5, 121.0, 6.0)])
+    events = _events([
+        ('2020-01-01 00:00:30', 14.6, 121.1, 6.3),  #same earthquake in the other agency's export
+        ('2020-01-01 00:02:00', 14.5, 121.0, 6.0),  #over a minute later
+        ('2020-01-01 00:00:10', 15.5, 121.0, 6.0),  #over 50 km away
+        ('2019-12-31 23:59:50', 14.5, 121.0, 5.2),  #magnitude too far apart
+    ])
+    new, duplicates = catalog.deduplicate(events, stored)
+    assert duplicates == 1
+    assert len(new) == 3
+    assert new['time'].is_monotonic_increasing
+    assert not ((new['latitude'] == 14.6) & (new['mag'] == 6.3)).any()
+
+
+def test_rows_of_one_export_are_distinct():
+    #aftershocks seconds apart are kept, and nothing is dropped against an empty store
+    events = _events([('2020-01-01 00:00:00', 14.5, 121.0, 6.0),
+                      ('2020-01-01 00:00:20', 14.52, 121.01, 5.8)])
+    new, duplicates = catalog.deduplicate(events, catalog.stored_events([2020], directory='/nonexistent'))
+    assert duplicates == 0 and len(new) == 2
+    new, duplicates = catalog.deduplicate(events, events)
+    assert duplicates == 2 and len(new) == 0
+
+
+def test_read_export_mixed_and_local_times(tmp_path):
+    usgs = tmp_path / 'usgs.csv'
+    usgs.write_text('time,latitude,longitude,depth,mag,magType,place,type\n'
+                    '2023-09-18 02:54:04.143000+00:00,13.22,120.34,35,5.0,mb,"Mindoro, Philippines",earthquake\n'
+                    '2013-05-01 05:37:59+00:00,14.1,121.2,10,5.4,mww,Luzon,earthquake\n'
+                    '2013-05-02 05:37:59+00:00,14.1,121.2,10,5.4,mww,Luzon,quarry blast\n')
+    events = catalog.read_export(str(usgs))
+    assert len(events) == 2
+    assert str(events['time'].dt.tz) == 'UTC'
+    assert events['mag_group'].tolist() == ['5.0-5.9', '5.0-5.9']
+
+    phivolcs = tmp_path / 'phivolcs.csv'
+    phivolcs.write_text('Date - Time (Philippine Time),Latitude (ºN),Longitude (ºE),Depth (km),Mag,Location\n'
+                        '31 January 2023 - 01:23 PM,14.5,121.0,10,5.1,Manila\n')
+    events = catalog.read_export(str(phivolcs))
+    assert events['time'].tolist() == [pd.Timestamp('2023-01-31 05:23', tz='UTC')]
@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+
+from pipeline.stages import _bed_capacity, read_impact_table, travel_pairs
+
+
+def test_travel_pairs_skips_unroutable():
+    row = {'brgy_index': '[0, 1, 2, 3]', 'hosp_index': '1691',
+           'duration': '[[2367.47], [None], [696.15], None]'}
+    assert list(travel_pairs(row)) == [(0, 2367.47), (2, 696.15)]
+
+
+def test_travel_pairs_plain_durations():
+    row = {'brgy_index': '[5, 6]', 'hosp_index': '1700', 'duration': '[12.5, 30]'}
+    assert list(travel_pairs(row)) == [(5, 12.5), (6, 30)]
+
+
+def test_impact_table_parses_thousands_and_drops_sum(tmp_path):
+    path = tmp_path / 'building damage per LGU.csv'
+    path.write_text('﻿Municipality,Area (m2),Slight Damage (m2),Complete Damage (m2)\n'
+                    'Angono,22071349.33,234789,426421\n'
+                    'Caloocan,52000000.0,"1,234,567",18498145\n'
+                    'SUM,,"44,804,325","89,089,333"\n', encoding='utf-8')
+    table = read_impact_table(path)
+    assert table['municipality'].tolist() == ['Caloocan']
+    assert list(table.columns) == ['municipality', 'Slight Damage (m2)', 'Complete Damage (m2)']
+    assert table['Slight Damage (m2)'].tolist() == [1234567]
+    assert pd.api.types.is_numeric_dtype(table['Complete Damage (m2)'])
+
+
+def test_impact_table_rejects_text_values(tmp_path):
+    path = tmp_path / 'casualties per LGU.csv'
+    path.write_text('Municipality,Fatalities\nManila,unknown\n', encoding='utf-8')
+    with pytest.raises(ValueError):
+        read_impact_table(path)
+
+
+def test_bed_capacity_thousands_separator():
+    values = pd.Series(['17', '1,334', '4,200', None, 150])
+    assert _bed_capacity(values).tolist() == [17, 1334, 4200, 0, 150]
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+from access import Access
+
+from utils import raam
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(7)
+    barangays = pd.DataFrame({'brgy_index': np.arange(40), 'population': rng.integers(100, 5000, 40)})
+    hospitals = pd.DataFrame({'hospital_index': 100 + np.arange(8), 'bed_capacity': rng.integers(10, 200, 8)})
+    pairs = pd.MultiIndex.from_product([barangays['brgy_index'], hospitals['hospital_index']],
+                                       names=['brgy_index', 'hospital_index']).to_frame(index=False)
+    pairs['duration'] = rng.uniform(300, 3600, len(pairs)).round(2)
+    #a few unroutable pairs, left out as in the travel matrix
+    return barangays, hospitals, pairs.drop(index=[3, 17, 90])
+
+
+def problem_from(frames, supply='bed_capacity'):
+    barangays, hospitals, pairs = frames
+    return raam.RaamProblem.from_frames(barangays, 'brgy_index', 'population', hospitals, 'hospital_index',
+                                        supply, pairs, 'brgy_index', 'hospital_index', 'duration')
+
+
+def test_matches_access(frames):
+    barangays, hospitals, pairs = frames
+    tau = 1800
+    access = Access(demand_df=barangays, demand_index='brgy_index', demand_value='population',
+                    supply_df=hospitals, supply_index='hospital_index', supply_value='bed_capacity',
+                    cost_df=pairs, cost_origin='brgy_index', cost_dest='hospital_index', cost_name='duration')
+    access.raam(name='raam', tau=tau)
+    expected = access.access_df['raam_bed_capacity'].reindex(barangays['brgy_index'])
+
+    #run until no one moves, the answer is access's; stopping at the gap tolerance comes close
+    problem = problem_from(frames)
+    np.testing.assert_allclose(raam.solve(problem, tau).scores[0], expected.to_numpy(), rtol=2e-2)
+    result = raam.solve(problem, tau, tolerance=0)
+    np.testing.assert_allclose(result.scores[0], expected.to_numpy(), rtol=1e-9)
+
+
+def test_rho_is_population_per_bed(frames):
+    problem = problem_from(frames)
+    assert problem.rho()[0] == pytest.approx(frames[0]['population'].sum() / frames[1]['bed_capacity'].sum())
+
+
+def test_allocation_keeps_population(frames):
+    problem = problem_from(frames)
+    for result in raam.iterate(problem, 1800, first_report=0, report_every=25):
+        np.testing.assert_allclose(result.allocation.sum(axis=2)[0], problem.demand)
+        assert (result.allocation >= 0).all()
+
+
+def test_warm_start_ends_with_cold_schedule(frames):
+    problem = problem_from(frames)
+    cache = raam.RaamCache(DictStore())
+    cold = list(raam.progressive(problem, 1800, cache, 'scenario'))[-1]
+    warm = list(raam.progressive(problem, 1860, cache, 'scenario'))
+    assert warm[-1].cycle <= cold.cycle
+    assert warm[-1].cycle - warm[0].cycle < raam.MAX_CYCLES
+    #an exact hit is answered from the cache
+    assert list(raam.progressive(problem, 1800, cache, 'scenario'))[0].cycle == cold.cycle
+
+
+class DictStore(dict):
+    """The part of a diskcache store that RaamCache uses."""
+
+    def get(self, key, default=None, retry=False):
+        return super().get(key, default)
+
+    def set(self, key, value, retry=False):
+        self[key] = value
+
+    def transact(self, retry=False):
+        import contextlib
+        return contextlib.nullcontext()
+
+
+def test_rows_match_separate_solves(frames):
+    barangays, hospitals, pairs = frames
+    hospitals = hospitals.assign(large_only=hospitals['bed_capacity'].where(hospitals['bed_capacity'] > 80, 0))
+    levels = ['bed_capacity', 'large_only']
+    together = raam.solve(problem_from((barangays, hospitals, pairs), levels), 1800)
+    for k, level in enumerate(levels):
+        alone = raam.solve(problem_from((barangays, hospitals, pairs), level), 1800)
+        np.testing.assert_array_equal(together.scores[k], alone.scores[0])
+        np.testing.assert_array_equal(together.allocation[k], alone.allocation[0])
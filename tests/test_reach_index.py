@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from utils.reach_index import ReachIndex
+
+
+def _index():
+    #hospital 2's own record spells Moderate as Medium, like the shipped ncr_hosp
+    ncr_hosp = pd.DataFrame({'hospital_index': [1, 2, 3],
+                             'potential': ['No Potential', 'Medium Potential', 'High Potential'],
+                             'service_capability': ['Level 1', 'Level 3', 'Level 2'],
+                             'bed_capacity': [10, 200, np.nan]})
+    travel_matrix = pd.DataFrame({'brgy_index': [0, 0, 0, 0, 5],
+                                  'hospital_index': [1, 2, 3, 2, 3],
+                                  'duration': [600.0, 1200.0, 300.0, 900.0, 1800.0],
+                                  'potential': ['No Potential', 'Moderate Potential', 'High Potential',
+                                                'Moderate Potential', 'High Potential']})
+    return ReachIndex(travel_matrix, ncr_hosp)
+
+
+def test_nearest_first_with_totals():
+    reach = _index().query(0, 30)
+    assert reach.hospital_index.tolist() == [3, 1, 2]
+    #the duplicate pair keeps its fastest route
+    assert reach.duration.tolist() == [300.0, 600.0, 900.0]
+    assert reach.hospital_count == 3
+    assert reach.bed_capacity == 210
+    assert reach.level_counts == {'Level 1': 1, 'Level 2': 1, 'Level 3': 1}
+
+
+def test_threshold_is_strict():
+    assert _index().query(0, 10).hospital_index.tolist() == [3]
+    assert _index().query(5, 30).hospital_count == 0
+
+
+def test_exclusion_follows_travel_matrix_potential():
+    reach = _index().query(0, 30, ['Moderate Potential', 'High Potential'])
+    assert reach.hospital_index.tolist() == [1]
+    assert reach.bed_capacity == 10
+    assert reach.level_counts == {'Level 1': 1, 'Level 2': 0, 'Level 3': 0}
+
+
+def test_barangay_without_travel_times_reaches_nothing():
+    for brgy_index in (-1, 3, 99):
+        reach = _index().query(brgy_index, 60)
+        assert len(reach.hospital_index) == 0 and len(reach.duration) == 0
+        assert reach.hospital_count == 0 and reach.bed_capacity == 0
+        assert reach.level_counts == {'Level 1': 0, 'Level 2': 0, 'Level 3': 0}
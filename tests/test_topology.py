@@ -0,0 +1,69 @@
+import shapely
+from shapely.geometry import MultiPolygon, Polygon, mapping, shape
+
+from utils import topology
+
+LEFT = Polygon([(121.0, 14.5), (121.01, 14.5), (121.01, 14.51), (121.0, 14.51)])
+RIGHT = Polygon([(121.01, 14.5), (121.02, 14.5), (121.02, 14.51), (121.01, 14.51)])
+HOLED = Polygon([(121.03, 14.5), (121.05, 14.5), (121.05, 14.52), (121.03, 14.52)],
+                [[(121.035, 14.505), (121.04, 14.505), (121.04, 14.51), (121.035, 14.51)]])
+ISLANDS = MultiPolygon([Polygon([(121.06, 14.5), (121.07, 14.5), (121.07, 14.51)]),
+                        Polygon([(121.08, 14.5), (121.09, 14.5), (121.09, 14.51)])])
+
+
+def _layers():
+    return {'barangays': [(mapping(LEFT), {'brgy_index': 0}), (mapping(RIGHT), {'brgy_index': 1}),
+                          (mapping(HOLED), {'brgy_index': 2})],
+            'municipalities': [(mapping(shapely.union(LEFT, RIGHT)), {'municipality': 'A'}),
+                               (mapping(ISLANDS), {'municipality': 'B'})]}
+
+
+def _geometries(topo, name):
+    features = topology.decode(topo, name)
+    return [shape(feature['geometry']) for feature in features], [feature['properties'] for feature in features]
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'boundaries.topojson'
+    topology.write(topology.encode(_layers()), str(path))
+    topo = topology.read(str(path))
+
+    for name, features in _layers().items():
+        geometries, properties = _geometries(topo, name)
+        assert properties == [props for _, props in features]
+        for decoded, (original, _) in zip(geometries, features):
+            original = shape(original)
+            assert decoded.geom_type == original.geom_type
+            #off by at most a quantization step along the border
+            assert decoded.symmetric_difference(original).area < 1e-4 * original.area
+    assert len(shape(topology.decode(topo, 'barangays')[2]['geometry']).interiors) == 1
+
+
+def test_shared_border_is_one_arc():
+    topo = topology.encode({'barangays': _layers()['barangays'][:2]})
+    left, right = topo['objects']['barangays']['geometries']
+    shared = {~i if i < 0 else i for i in left['arcs'][0]} & {~i if i < 0 else i for i in right['arcs'][0]}
+    assert len(shared) == 1
+    #one side walks the shared arc backwards
+    assert sorted(i < 0 for ring in (left['arcs'][0], right['arcs'][0]) for i in ring
+                  if (~i if i < 0 else i) in shared) == [False, True]
+
+
+def test_simplified_neighbors_leave_no_gap():
+    topo = topology.encode(_layers(), simplify_meters=50)
+    (left, right, _), _ = _geometries(topo, 'barangays')
+    assert left.intersection(right).length > 0
+    assert left.intersection(right).area < 1e-12
+    assert abs(left.union(right).area - (left.area + right.area)) < 1e-12
+
+
+def test_encode_frames_keeps_columns():
+    import geopandas as gpd
+
+    frame = gpd.GeoDataFrame({'brgy_index': [0, 1], 'barangay': ['Left', 'Right']},
+                             geometry=[LEFT, RIGHT], crs='EPSG:4326')
+    decoded = topology.decode_frame(topology.encode_frames({'barangays': frame}), 'barangays')
+    assert decoded['barangay'].tolist() == ['Left', 'Right']
+    assert decoded.crs == frame.crs
+    difference = shapely.symmetric_difference(decoded.geometry.values, frame.geometry.values)
+    assert (shapely.area(difference) < 1e-4 * shapely.area(frame.geometry.values)).all()